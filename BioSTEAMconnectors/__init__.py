@@ -24,10 +24,16 @@ from . import _default_inputs
 from ._default_inputs import *
 
 from . import _inputs
+from . import _profile
 from . import _fdcic
+from . import _spatial
+from . import _summary
 
 from ._inputs import *
+from ._profile import *
 from ._fdcic import *
+from ._spatial import *
+from ._summary import *
 
 __all__ = (
     'path',
@@ -37,5 +43,8 @@ __all__ = (
     *_default_parameters.__all__,
     *_default_inputs.__all__,
     *_inputs.__all__,
+    *_profile.__all__,
     *_fdcic.__all__,
+    *_spatial.__all__,
+    *_summary.__all__,
     )
\ No newline at end of file
@@ -17,6 +17,7 @@ Note: Canadian corn not included at this stage.
 import pandas as pd
 from math import e
 from . import default_parameters, Variable, Variables
+from ._profile import PropertyProfile, DependencyTrace
 
 __all__ = ('FDCIC',)
 
@@ -40,6 +41,32 @@ class FDCIC(Variables):
         self.crop_inputs = crop_inputs
         self.reset_variables()
 
+    def profile(self):
+        '''
+        Record the number of evaluations and the time of each property
+        within a `with` block, see :class:`PropertyProfile`.
+
+        Examples
+        --------
+        >>> with fdcic.profile() as profile: fdcic.GHG_table # doctest: +SKIP
+        >>> profile.table # doctest: +SKIP
+        >>> profile.save_collapsed('GHG_table.folded') # doctest: +SKIP
+        '''
+        return PropertyProfile(self)
+
+    def trace(self):
+        '''
+        Record the properties and variables used by each property evaluated
+        within a `with` block as a graph, see :class:`DependencyTrace`.
+
+        Examples
+        --------
+        >>> with fdcic.trace() as trace: fdcic.GHG_table # doctest: +SKIP
+        >>> trace.dependencies['N2O_Fert_and_Res_GHG'] # doctest: +SKIP
+        >>> trace.save('GHG_table.dot') # doctest: +SKIP
+        '''
+        return DependencyTrace(self)
+
     @property
     def inputs(self):
         '''Crop-specific inputs.'''
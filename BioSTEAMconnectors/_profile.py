@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# BioSTEAMconnectors
+# Copyright (C) 2022-, Yalin Li <mailto.yalin.li@gmail.com>
+#
+# This module is under the UIUC open-source license. See
+# github.com/BioSTEAMDevelopmentGroup/biosteam/blob/master/LICENSE.txt
+# for license details.
+
+import os, json, linecache, tracemalloc
+import pandas as pd
+from math import isfinite
+from numbers import Number
+from time import perf_counter_ns
+from collections import defaultdict
+from contextlib import contextmanager
+
+__all__ = ('PropertyProfile', 'DependencyTrace', 'MemoryProfile',)
+
+# Subclasses with instrumented properties, created once for each class
+_instrumented_classes = {}
+
+
+def _get_properties(cls):
+    '''Properties of the class (including the inherited ones) by name.'''
+    properties = {}
+    for klass in reversed(cls.__mro__):
+        for name, attr in vars(klass).items():
+            if isinstance(attr, property): properties[name] = attr
+            else: properties.pop(name, None) # overridden by a non-property
+    return properties
+
+
+def _instrument(name, prop):
+    fget = prop.fget
+    def fget_instrumented(self):
+        return self._instrument._evaluate(name, fget, self)
+    return property(fget_instrumented, prop.fset, prop.fdel, prop.__doc__)
+
+
+def _get_instrumented_class(cls, trace_variables=False):
+    key = (cls, trace_variables)
+    try: return _instrumented_classes[key]
+    except KeyError: pass
+    dct = {name: _instrument(name, prop)
+           for name, prop in _get_properties(cls).items() if prop.fget}
+    if trace_variables:
+        getattribute = cls.__getattribute__
+        def __getattribute__(self, name):
+            value = getattribute(self, name)
+            instrument = getattribute(self, '_instrument')
+            if name in instrument.variable_names: instrument._read(name, value)
+            return value
+        dct['__getattribute__'] = __getattribute__
+    dct['__module__'] = cls.__module__
+    dct['__doc__'] = cls.__doc__
+    _instrumented_classes[key] = instrumented = type(cls.__name__, (cls,), dct)
+    return instrumented
+
+
+class _Instrument:
+    '''
+    Base class of the context managers that instrument the properties of an object,
+    subclasses implement `_evaluate(name, fget, obj)` (and `_read(name, value)`
+    for the reads of the variables if `trace_variables` is True).
+    '''
+
+    trace_variables = False
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.reset()
+
+    def __enter__(self):
+        obj = self.obj
+        if hasattr(obj, '_instrument'):
+            raise RuntimeError(f'{obj!r} is already being instrumented.')
+        #: Names of the variables of the object and its other numbers.
+        self.variable_names = frozenset((
+            *(i.name for i in getattr(obj, 'variables', ())),
+            *(k for k, v in vars(obj).items() if k[0] != '_' and isinstance(v, Number)),
+            ))
+        self._cls = cls = type(obj)
+        obj._instrument = self
+        obj.__class__ = _get_instrumented_class(cls, self.trace_variables)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        obj = self.obj
+        obj.__class__ = self._cls
+        del obj._instrument
+
+
+class PropertyProfile(_Instrument):
+    '''
+    Record the number of evaluations and the time of each property of an object
+    (e.g., :class:`FDCIC`) within a `with` block. The object is only instrumented
+    within the block, other objects of the same class are not affected.
+
+    Time of a property is recorded both as the cumulative time (including
+    the properties it uses) and the self time (excluding them). Note that
+    the instrumentation adds an overhead (about 1 µs per evaluation).
+
+    Parameters
+    ----------
+    obj : object
+        The object to profile.
+
+    Examples
+    --------
+    >>> from BioSTEAMconnectors import CornInputs, FDCIC
+    >>> fdcic = FDCIC(CornInputs())
+    >>> with fdcic.profile() as profile: table = fdcic.GHG_table
+    >>> profile.table.loc['CF_Ammonia_Intermediate', 'calls'] > 1
+    True
+    >>> profile.save_collapsed('GHG_table.folded') # doctest: +SKIP
+    '''
+
+    def __repr__(self):
+        return (f'<{type(self).__name__}: {type(self.obj).__name__}, '
+                f'{sum(self.calls.values())} evaluations of {len(self.calls)} properties>')
+
+    def reset(self):
+        '''Clear the records.'''
+        #: Number of evaluations of each property.
+        self.calls = defaultdict(int)
+        #: Cumulative time of each property, in ns.
+        self.cumulative_time = defaultdict(int)
+        #: Self time of each property, in ns.
+        self.self_time = defaultdict(int)
+        #: Self time of each stack of properties (joined by ";"), in ns.
+        self.stacks = defaultdict(int)
+        self._stack = []
+        self._children_time = []
+
+    def _evaluate(self, name, fget, obj):
+        stack = self._stack
+        recursive = name in stack
+        stack.append(name)
+        self._children_time.append(0)
+        start = perf_counter_ns()
+        try:
+            return fget(obj)
+        finally:
+            elapsed = perf_counter_ns() - start
+            self_time = elapsed - self._children_time.pop()
+            self.stacks[';'.join(stack)] += self_time
+            stack.pop()
+            self.calls[name] += 1
+            self.self_time[name] += self_time
+            # Only count the outermost evaluation of recursive properties
+            if not recursive: self.cumulative_time[name] += elapsed
+            if self._children_time: self._children_time[-1] += elapsed
+
+    @property
+    def table(self):
+        '''
+        Number of evaluations and the cumulative, self, and per-evaluation
+        (cumulative) time in seconds of each property,
+        sorted by the cumulative time.
+        '''
+        df = pd.DataFrame({
+            'calls': pd.Series(self.calls, dtype='int64'),
+            'cumulative_time': pd.Series(self.cumulative_time, dtype='float64')/1e9,
+            'self_time': pd.Series(self.self_time, dtype='float64')/1e9,
+            })
+        df['time_per_call'] = df.cumulative_time/df.calls
+        df.index.name = 'property'
+        return df.sort_values('cumulative_time', ascending=False)
+
+    def get_collapsed(self):
+        '''
+        Stacks of the evaluated properties in the collapsed format of flame graphs
+        (one "outer;inner self_time" line per stack, time in µs), which can be read
+        by flamegraph.pl, speedscope, or inferno.
+        '''
+        return '\n'.join(f'{stack} {round(ns/1e3)}' for stack, ns in self.stacks.items())
+
+    def save_collapsed(self, path):
+        '''Save the stacks in the collapsed format (see :func:`get_collapsed`).'''
+        with open(path, 'w') as file: file.write(self.get_collapsed() + '\n')
+
+
+def _to_json_value(value):
+    if isinstance(value, str): return value
+    if isinstance(value, Number):
+        value = float(value)
+        return value if isfinite(value) else None
+    return None # tables etc.
+
+
+class DependencyTrace(_Instrument):
+    '''
+    Record the properties and variables (e.g., parameters and inputs of :class:`FDCIC`,
+    as well as other numbers stored on the object) used by each property of an object evaluated within a `with` block,
+    as a directed acyclic graph (DAG) from the used properties/variables to the users,
+    with the values of the nodes.
+
+    Properties that do not use any other properties or variables of the object
+    (e.g., `FDCIC.Yield_TS`, which is read from `FDCIC.crop_inputs`) are recorded
+    as variables, as variables used through other objects are not traced.
+    Note that only the evaluated branches are recorded (e.g., a variable only used
+    for another crop will not be included).
+
+    Parameters
+    ----------
+    obj : object
+        The object to trace.
+
+    Examples
+    --------
+    >>> from BioSTEAMconnectors import CornInputs, FDCIC
+    >>> fdcic = FDCIC(CornInputs())
+    >>> with fdcic.trace() as trace: table = fdcic.GHG_table
+    >>> 'Cornfarming_biomass_N2O_factor' in trace.get_variables('N2O_Fert_and_Res_GHG')
+    True
+    >>> 'N2O_Fert_and_Res_GHG' in trace.get_affected(['Cornfarming_biomass_N2O_factor'])
+    True
+    >>> 'Yield_TS' in trace.get_variables('N2O_Fert_and_Res_GHG')
+    True
+    >>> trace.save('GHG_table.dot') # doctest: +SKIP
+    '''
+
+    trace_variables = True
+
+    def __repr__(self):
+        return (f'<{type(self).__name__}: {type(self.obj).__name__}, '
+                f'{len(self.values)} nodes, {len(self.edges)} edges>')
+
+    def reset(self):
+        '''Clear the records.'''
+        #: Latest value of each node (property or variable).
+        self.values = {}
+        #: Names of the evaluated properties that use other properties or variables,
+        #: the other properties are recorded as variables.
+        self.properties = set()
+        #: Edges as (used, user) pairs.
+        self.edges = set()
+        self._stack = []
+
+    def _read(self, name, value):
+        stack = self._stack
+        if stack:
+            user = stack[-1]
+            self.edges.add((name, user))
+            self.properties.add(user)
+        self.values[name] = value
+
+    def _evaluate(self, name, fget, obj):
+        stack = self._stack
+        stack.append(name)
+        try: value = fget(obj)
+        finally: stack.pop()
+        self._read(name, value)
+        return value
+
+    def _get_kind(self, name):
+        if name in self.properties: return 'property'
+        obj = self.obj
+        if name in {i.name for i in getattr(obj, 'parameters', ())}: return 'parameter'
+        return 'input'
+
+    def _get_unit(self, name):
+        for i in getattr(self.obj, 'variables', ()):
+            if i.name == name: return i.default_unit
+        return ''
+
+    def _get_used(self):
+        used = defaultdict(set)
+        for i, j in self.edges: used[j].add(i)
+        return used
+
+    def get_variables(self, name):
+        '''Names of the variables that the property uses directly or indirectly.'''
+        used = self._get_used()
+        nodes, variables, stack = set(), set(), [name]
+        while stack:
+            for i in used[stack.pop()]:
+                if i in nodes: continue
+                nodes.add(i)
+                if i in self.properties: stack.append(i)
+                else: variables.add(i)
+        return sorted(variables)
+
+    @property
+    def dependencies(self):
+        '''Names of the variables used by each property.'''
+        return {i: self.get_variables(i) for i in sorted(self.properties)}
+
+    def get_affected(self, names):
+        '''
+        Names of the properties that use (directly or indirectly) any of the given
+        properties or variables, e.g., the ones to recalculate when the variables change.
+        '''
+        users = defaultdict(set)
+        for i, j in self.edges: users[i].add(j)
+        affected, stack = set(), list(names)
+        while stack:
+            for i in users[stack.pop()]:
+                if i in affected: continue
+                affected.add(i)
+                stack.append(i)
+        return sorted(affected)
+
+    def to_dict(self):
+        '''
+        The graph as a dict of "nodes" (with the name, kind, value, and unit)
+        and "edges" (from the used node to the user), used by :func:`to_json`.
+        '''
+        nodes = [{'name': name,
+                  'kind': self._get_kind(name),
+                  'value': _to_json_value(value),
+                  'unit': self._get_unit(name)}
+                 for name, value in sorted(self.values.items())]
+        edges = [{'source': i, 'target': j} for i, j in sorted(self.edges)]
+        return {'nodes': nodes, 'edges': edges}
+
+    def to_json(self, indent=1):
+        '''The graph in JSON (see :func:`to_dict`).'''
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_dot(self):
+        '''
+        The graph in the DOT language of Graphviz, properties are boxes
+        and variables are ellipses, labeled with the names and values.
+        '''
+        lines = ['digraph {', '    rankdir=LR;']
+        for node in self.to_dict()['nodes']:
+            name, value = node['name'], node['value']
+            label = name
+            if isinstance(value, float): label += f'\\n{value:.4g} {node["unit"]}'.rstrip()
+            elif isinstance(value, str): label += f'\\n{value}'
+            label = label.replace('"', '\\"')
+            shape = 'box' if node['kind'] == 'property' else 'ellipse'
+            lines.append(f'    "{name}" [label="{label}", shape={shape}];')
+        lines.extend(f'    "{i}" -> "{j}";' for i, j in sorted(self.edges))
+        lines.append('}')
+        return '\n'.join(lines)
+
+    def save(self, path):
+        '''Save the graph in DOT (if `path` ends with .dot or .gv) or JSON.'''
+        content = self.to_dot() if path.endswith(('.dot', '.gv')) else self.to_json()
+        with open(path, 'w') as file: file.write(content + '\n')
+
+
+class MemoryProfile:
+    '''
+    Memory used by the stages of a run (e.g., "load", "calculate",
+    "save", and "summarize" of `run_total.run`), traced by `tracemalloc` with snapshots
+    at the boundaries of the stages. For each stage, the peak of the traced
+    memory and the net allocations (i.e., memory still held at the end of the stage)
+    by source line are recorded, stages of chunked runs are accumulated over the chunks.
+    Allocations are also attributed to the innermost line in this repository
+    that led to them (e.g., a line of `run_total.update_results` calling pandas),
+    given the traced frames are deep enough.
+
+    Note that tracing slows down the run and only memory allocated through Python
+    (including numpy arrays) is traced.
+
+    Parameters
+    ----------
+    top : int
+        Number of source lines of each stage to print in the report.
+    frames : int
+        Number of frames traced for each allocation.
+
+    Examples
+    --------
+    >>> with MemoryProfile() as profile:
+    ...     with profile.stage('calculate'): outputs = update_results(inputs) # doctest: +SKIP
+    >>> profile.report() # doctest: +SKIP
+    '''
+
+    # Allocations of the tracing itself are excluded
+    filters = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, '<unknown>'),
+        )
+
+    # Callers of the allocations are searched in this directory
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def __init__(self, top=10, frames=30):
+        self.top = top
+        self.frames = frames
+        #: Peak of the traced memory during each stage, in bytes.
+        self.peaks = {}
+        #: Net allocations of each stage, in bytes.
+        self.net = {}
+        self._lines = {}
+
+    def __enter__(self):
+        self._started = not tracemalloc.is_tracing()
+        if self._started: tracemalloc.start(self.frames)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._started: tracemalloc.stop()
+
+    def _take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(self.filters)
+
+    @contextmanager
+    def stage(self, name):
+        '''Context manager to record the memory of the stage.'''
+        before = self._take_snapshot()
+        tracemalloc.reset_peak()
+        yield
+        peak = tracemalloc.get_traced_memory()[1]
+        after = self._take_snapshot()
+        self.peaks[name] = max(self.peaks.get(name, 0), peak)
+        lines = self._lines
+        net = 0
+        root = self.root
+        for stat in after.compare_to(before, 'traceback'):
+            if not (stat.size_diff or stat.count_diff): continue
+            frames = stat.traceback # from the oldest to the most recent
+            frame = frames[-1]
+            caller = next((i for i in reversed(frames) if i.filename.startswith(root)), None)
+            caller = (caller.filename, caller.lineno) if caller else ('', 0)
+            key = (name, frame.filename, frame.lineno, *caller)
+            size, count = lines.get(key, (0, 0))
+            lines[key] = (size+stat.size_diff, count+stat.count_diff)
+            net += stat.size_diff
+        self.net[name] = self.net.get(name, 0) + net
+
+    @property
+    def table(self):
+        '''Peak of the traced memory and the net allocations of each stage, in MB.'''
+        return pd.DataFrame({'peak_MB': pd.Series(self.peaks, dtype='float64')/1e6,
+                             'net_MB': pd.Series(self.net, dtype='float64')/1e6})
+
+    @property
+    def lines(self):
+        '''
+        Net allocations (MB and number of memory blocks) of each stage by source line
+        and the innermost line in this repository leading to it (i.e., caller),
+        sorted by the stage and the size.
+        '''
+        getline = lambda filename, lineno: linecache.getline(filename, lineno).strip()
+        records = [(stage, f'{filename}:{lineno}', size/1e6, count, getline(filename, lineno),
+                    f'{caller}:{caller_lineno}' if caller else '', getline(caller, caller_lineno))
+                   for (stage, filename, lineno, caller, caller_lineno), (size, count)
+                   in self._lines.items()]
+        df = pd.DataFrame(records, columns=('stage', 'line', 'net_MB', 'blocks', 'code',
+                                            'caller', 'caller_code'))
+        order = {stage: i for i, stage in enumerate(self.peaks)}
+        df['order'] = df.stage.map(order)
+        df['abs'] = df.net_MB.abs()
+        df = df.sort_values(['order', 'abs'], ascending=[True, False])
+        return df.drop(columns=['order', 'abs']).reset_index(drop=True)
+
+    def report(self, path=None):
+        '''Print the peak and the top lines of each stage, save the lines if `path` is given.'''
+        lines = self.lines
+        print(f'\nMemory profile (overall peak: {max(self.peaks.values(), default=0)/1e6:.3f} MB):')
+        print(self.table.to_string(float_format='{:.3f}'.format))
+        shorten = lambda line: os.sep.join(line.split(os.sep)[-2:])
+        for stage, df in lines.groupby('stage', sort=False):
+            print(f'\nTop allocations of {stage}:')
+            for row in df.head(self.top).itertuples():
+                print(f'{row.net_MB:10.3f} MB {row.blocks:8d} blocks  {shorten(row.line)}  {row.code}')
+                if row.caller and row.caller != row.line:
+                    print(f'{"":30}from {shorten(row.caller)}  {row.caller_code}')
+        if path:
+            lines.to_csv(path, index=False)
+            print(f'\nMemory profile by source line saved to {path}.')
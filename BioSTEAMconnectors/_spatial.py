@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# BioSTEAMconnectors
+# Copyright (C) 2022-, Yalin Li <mailto.yalin.li@gmail.com>
+#
+# This module is under the UIUC open-source license. See
+# github.com/BioSTEAMDevelopmentGroup/biosteam/blob/master/LICENSE.txt
+# for license details.
+
+import numpy as np, pandas as pd
+from scipy.spatial import cKDTree
+
+__all__ = ('SiteIndex',)
+
+
+class SiteIndex:
+    '''
+    Spatial index of the sites in the site-year results for
+    carbon intensity lookup at arbitrary coordinates.
+
+    Site-years at the same coordinates are collapsed into one site
+    (they must be of the same feedstock, see `by`), the sites are indexed with a KD-tree on their positions on the sphere,
+    so distances are great-circle distances in km
+    (longitudes can be in either -180 to 180 or 0 to 360).
+
+    Parameters
+    ----------
+    outputs : :class:`pandas.DataFrame`
+        Site-year results with "Lon" and "Lat" columns (in degree),
+        rows of crops that are not of interest should be excluded.
+    column : str
+        Column of the carbon intensity to look up.
+    weight : str
+        Column used to weigh the site-years of the same site,
+        set to None to use the arithmetic mean.
+    by : Iterable(str)
+        Columns identifying the feedstock (the ones not in `outputs` are ignored),
+        site-years of the same site must have the same values in them
+        (e.g., only one sorghum type), otherwise a ValueError will be raised
+        as carbon intensities of different feedstocks cannot be averaged.
+
+    Examples
+    --------
+    >>> outputs = pd.read_csv(join(outputs_path, 'Complete_CI.csv'), index_col=0) # doctest: +SKIP
+    >>> sweet = outputs[(outputs.Crop=='Sorghum') & (outputs.SorgType=='SweetSorghum')] # doctest: +SKIP
+    >>> index = SiteIndex(sweet) # doctest: +SKIP
+    >>> # Inverse-distance-weighted carbon intensity from the 8 nearest sites
+    >>> index.get_CI(lon=-90.2, lat=38.6, k=8) # doctest: +SKIP
+    '''
+
+    #: Mean radius of the Earth, in km.
+    earth_radius = 6371.0088
+
+    def __init__(self, outputs, column='total g CO2eq/ton', weight='AbovegroundBiomass_gCm',
+                 by=('Crop', 'SorgType')):
+        df = outputs[np.isfinite(outputs[column])]
+        by = [i for i in by if i in df.columns]
+        if by:
+            groups = df.groupby(['Lon', 'Lat'], sort=False)[by].nunique(dropna=False)
+            mixed = groups[(groups > 1).any(axis=1)]
+            if not mixed.empty:
+                lon, lat = mixed.index[0]
+                raise ValueError(
+                    f'{mixed.shape[0]} site(s) have site-years of more than one feedstock '
+                    f'(by {", ".join(by)}), e.g., the site at ({lon}, {lat}), '
+                    'filter the outputs to one feedstock first.')
+        values = df[column].astype('float64')
+        if weight:
+            weights = df[weight].astype('float64')
+            grouped = pd.DataFrame({'wx': weights*values, 'w': weights,
+                                    'Lon': df['Lon'], 'Lat': df['Lat']})
+            grouped = grouped.groupby(['Lon', 'Lat'], sort=False).sum()
+            site_values = grouped['wx']/grouped['w']
+        else:
+            site_values = values.groupby([df['Lon'], df['Lat']], sort=False).mean()
+        self.column = column
+        self.sites = sites = site_values.rename(column).reset_index()
+        self.tree = cKDTree(self._to_xyz(sites['Lon'].values, sites['Lat'].values))
+
+    def __repr__(self):
+        return f'<{type(self).__name__}: {self.sites.shape[0]} sites, {self.column}>'
+
+    def _to_xyz(self, lon, lat):
+        lon, lat = np.broadcast_arrays(np.asarray(lon, dtype='float64'),
+                                       np.asarray(lat, dtype='float64'))
+        lon, lat = np.radians(lon), np.radians(lat)
+        cos_lat = np.cos(lat)
+        xyz = np.stack([cos_lat*np.cos(lon), cos_lat*np.sin(lon), np.sin(lat)], axis=-1)
+        return xyz*self.earth_radius
+
+    def _chord_to_distance(self, chord):
+        R = self.earth_radius
+        # Missing neighbors (infinite chords) stay infinite
+        distance = np.where(np.isinf(chord), np.inf, 2*R*np.arcsin(np.minimum(chord/(2*R), 1)))
+        return distance[()] # scalar for a single point
+
+    def _distance_to_chord(self, distance):
+        R = self.earth_radius
+        return 2*R*np.sin(np.minimum(distance/(2*R), np.pi/2))
+
+    def query(self, lon, lat, k=1, radius=np.inf):
+        '''
+        Find the `k` nearest sites of the query points.
+
+        Parameters
+        ----------
+        lon : float|Iterable(float)
+            Longitude(s) of the query point(s), in degree.
+        lat : float|Iterable(float)
+            Latitude(s) of the query point(s), in degree.
+        k : int
+            Number of sites to find.
+        radius : float
+            Only sites within this distance (in km) are returned,
+            missing neighbors have infinite distances and indices of
+            the number of sites (i.e., out of range).
+
+        Returns
+        -------
+        distances : ndarray
+            Great-circle distances to the sites, in km.
+        indices : ndarray
+            Indices of the sites in `SiteIndex.sites`.
+        '''
+        upper = self._distance_to_chord(radius) if np.isfinite(radius) else np.inf
+        chords, indices = self.tree.query(self._to_xyz(lon, lat), k=k,
+                                          distance_upper_bound=upper)
+        return self._chord_to_distance(chords), indices
+
+    def query_radius(self, lon, lat, radius):
+        '''
+        Find all sites within `radius` (in km) of the query points,
+        return the indices of the sites in `SiteIndex.sites`
+        (a list of lists if multiple points are queried).
+        '''
+        return self.tree.query_ball_point(self._to_xyz(lon, lat),
+                                          r=self._distance_to_chord(radius))
+
+    def get_CI(self, lon, lat, k=8, power=2, radius=np.inf):
+        '''
+        Inverse-distance-weighted carbon intensity at the query points
+        from the `k` nearest sites (within `radius` km),
+        NaN if no sites are found.
+
+        Parameters
+        ----------
+        lon : float|Iterable(float)
+            Longitude(s) of the query point(s), in degree.
+        lat : float|Iterable(float)
+            Latitude(s) of the query point(s), in degree.
+        k : int
+            Number of the nearest sites to use.
+        power : float
+            Power of the inverse distance.
+        radius : float
+            Only sites within this distance (in km) are used.
+        '''
+        k = min(k, self.sites.shape[0])
+        distances, indices = self.query(lon, lat, k=k, radius=radius)
+        distances = np.atleast_1d(distances).reshape(-1, k)
+        indices = np.atleast_1d(indices).reshape(-1, k)
+        found = np.isfinite(distances)
+        site_values = np.append(self.sites[self.column].values, np.nan)
+        values = site_values[indices]
+        with np.errstate(divide='ignore'):
+            weights = np.where(found, 1/distances**power, 0)
+        # Query points at a site take the value of the site
+        exact = found & (distances == 0)
+        at_site = exact.any(axis=1)
+        weights[at_site] = exact[at_site]
+        values = np.where(found, values, 0)
+        with np.errstate(invalid='ignore'):
+            CI = (weights*values).sum(axis=1)/weights.sum(axis=1)
+        return CI if np.broadcast(lon, lat).ndim else CI[0]
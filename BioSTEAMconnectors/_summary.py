@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# BioSTEAMconnectors
+# Copyright (C) 2022-, Yalin Li <mailto.yalin.li@gmail.com>
+#
+# This module is under the UIUC open-source license. See
+# github.com/BioSTEAMDevelopmentGroup/biosteam/blob/master/LICENSE.txt
+# for license details.
+
+import numpy as np, pandas as pd
+
+__all__ = ('CISummary',)
+
+
+class CISummary:
+    '''
+    Yield-weighted summary of the carbon intensities of the site-year results
+    (e.g., of `run_total.py`) by the `keys` columns, weighted by the `weight` column.
+
+    Results of the site-year tables are added as partial aggregates
+    (counts, sums, min/max, and weighted histograms of the carbon intensities),
+    which can be merged so that the table can be processed in chunks.
+    Percentiles are read from the histograms, whose logarithmic buckets
+    keep the relative error within `relative_accuracy`.
+
+    Parameters
+    ----------
+    keys : Iterable(str)
+        Columns to group the site-years by.
+    weight : str
+        Column of the yield used as the weight, site-years without yield are excluded.
+    columns : Iterable(str)
+        Columns of the carbon intensities.
+    crops : Iterable(str)
+        Crops (in the "Crop" column) to include, default to all.
+    percentiles : Iterable(float)
+        Percentiles to report.
+    relative_accuracy : float
+        Relative accuracy of the reported percentiles.
+
+    Examples
+    --------
+    >>> summary = CISummary(crops=crop_registry) # doctest: +SKIP
+    >>> for chunk in chunks: summary.add(update_results(chunk)) # doctest: +SKIP
+    >>> summary.table # doctest: +SKIP
+    '''
+    def __init__(self, keys=('State', 'Year', 'SorgType', 'Crop'),
+                 weight='AbovegroundBiomass_gCm',
+                 columns=('BSC g CO2eq/ton', 'BSC gCO2eq/ton without SOC',
+                          'total g CO2eq/ton', 'total g CO2eq without SOC'),
+                 crops=None, percentiles=(5, 25, 50, 75, 95), relative_accuracy=0.01):
+        self.keys = tuple(keys)
+        self.weight = weight
+        self.columns = tuple(columns)
+        self.crops = None if crops is None else tuple(crops)
+        self.percentiles = percentiles
+        self.relative_accuracy = relative_accuracy
+        self.moments = None
+        self.histogram = None
+
+    @property
+    def gamma(self):
+        '''Ratio between the bounds of the histogram buckets.'''
+        alpha = self.relative_accuracy
+        return (1+alpha)/(1-alpha)
+
+    # Bucket indices are shifted by this offset and signed so that their order
+    # follows the order of the values (zero has its own bucket)
+    _bucket_offset = 100000
+
+    def _get_buckets(self, values):
+        buckets = np.zeros(values.shape, dtype='int64')
+        nonzero = values != 0
+        magnitudes = np.log(np.abs(values[nonzero]))/np.log(self.gamma)
+        buckets[nonzero] = np.sign(values[nonzero]) * (np.ceil(magnitudes) + self._bucket_offset)
+        return buckets
+
+    def _get_values(self, buckets):
+        gamma = self.gamma
+        magnitudes = np.abs(buckets) - self._bucket_offset
+        return np.sign(buckets) * 2*gamma**magnitudes/(gamma+1)
+
+    def add(self, outputs):
+        '''Add the results of a site-year table to the partial aggregates.'''
+        groups = [*self.keys, 'CI']
+        weight = self.weight
+        df = outputs if self.crops is None else outputs[outputs['Crop'].isin(self.crops)]
+        df = df.melt(id_vars=[*self.keys, weight], value_vars=list(self.columns),
+                     var_name='CI', value_name='value')
+        df = df[np.isfinite(df['value']) & (df[weight] > 0)]
+        values = df['value'].values.astype('float64')
+        weights = df[weight].values.astype('float64')
+        df = df.assign(weight=weights, weighted_sum=weights*values,
+                       bucket=self._get_buckets(values))
+        grouped = df.groupby(groups, observed=True)
+        moments = grouped.agg(count=('value', 'size'), weight=('weight', 'sum'),
+                              weighted_sum=('weighted_sum', 'sum'),
+                              min=('value', 'min'), max=('value', 'max'))
+        histogram = df.groupby([*groups, 'bucket'], observed=True)['weight'].sum()
+        self._merge(moments, histogram)
+
+    def merge(self, other):
+        '''Merge the partial aggregates of another summary into this one.'''
+        if other.moments is not None: self._merge(other.moments, other.histogram)
+
+    def _merge(self, moments, histogram):
+        moments = moments.astype({'min': 'float64', 'max': 'float64'})
+        if self.moments is not None:
+            moments = pd.concat([self.moments, moments])
+            moments = moments.groupby(level=moments.index.names, observed=True).agg(
+                {'count': 'sum', 'weight': 'sum', 'weighted_sum': 'sum',
+                 'min': 'min', 'max': 'max'})
+            histogram = pd.concat([self.histogram, histogram])
+            histogram = histogram.groupby(level=histogram.index.names, observed=True).sum()
+        self.moments = moments
+        self.histogram = histogram
+
+    @property
+    def table(self):
+        '''
+        Summary table with the number of site-years, the total yield (i.e., `weight`),
+        and the yield-weighted mean, minimum, percentiles, and maximum
+        of the carbon intensities.
+        '''
+        moments = self.moments
+        if moments is None: return None
+        table = pd.DataFrame({
+            'count': moments['count'],
+            self.weight: moments['weight'],
+            'mean': moments['weighted_sum']/moments['weight'],
+            'min': moments['min'],
+            })
+        groups = moments.index.names
+        histogram = self.histogram.sort_index().reset_index()
+        cumulative = histogram.groupby(groups, observed=True)['weight'].cumsum()
+        fraction = cumulative / histogram.groupby(groups, observed=True)['weight'].transform('sum')
+        for p in self.percentiles:
+            # Tolerance for the rounding errors in the cumulative sum
+            reached = histogram[fraction.values >= p/100*(1-1e-12)]
+            buckets = reached.groupby(groups, observed=True)['bucket'].first()
+            values = pd.Series(self._get_values(buckets.values), index=buckets.index)
+            table[f'p{p:g}'] = values.reindex(table.index).clip(table['min'], moments['max'])
+        table['max'] = moments['max']
+        return table
@@ -4,68 +4,384 @@ Created on Wed Jan 18 18:45:18 2023
 
 @author: Empli
 """
-import pandas as pd, os
+import argparse, numpy as np, pandas as pd, os
+from contextlib import nullcontext
+from itertools import count
 join = os.path.join
-from BioSTEAMconnectors import SorghumInputs, FDCIC, inputs_path, outputs_path
+from BioSTEAMconnectors import (
+    CornInputs, SorghumInputs, SugarcaneInputs, FDCIC, CISummary, MemoryProfile,
+    inputs_path, outputs_path,
+    )
 
 gtokg = 1000
-kgtoton = 907.185 #US TON 
+kgtoton = 907.185 #US TON
 m2_per_ha = 10000
 grain_sorg_bu_per_acre = 81.8 #GREET Default
 sweet_sorg_ton_per_acre = 13.785714285714286 #!!! average silage sorghum https://legacy.rma.usda.gov/pubs/2015/biomass_sorghum_data_gathering_report.pdf
 sorg_bu_per_ton = 39.368 #https://grains.org/markets-tools-data/tools/converting-grain-units/
+grain_to_sweet = grain_sorg_bu_per_acre*(1/sweet_sorg_ton_per_acre) #bu grain sorg per ton sweet sorg
+corn_C_frac = 0.429 # multiplier from gC/m2 to bu/ac, same as in the DayCent connector
+corn_bu_per_ton = 2000/56 #56 lb/bu
+m2_per_acre = 4046.86
+tonne_per_ton = 0.907185
+
+# Repeated string columns of the site-year tables, stored as categoricals
+categorical_columns = ('State', 'SorgType', 'Crop')
+
+# Carbon intensity columns appended to the inputs
+CI_columns = (
+    'BSC g CO2eq/ton',
+    'BSC gCO2eq/ton without SOC',
+    'total g CO2eq/ton',
+    'total g CO2eq without SOC',
+    )
+
+# Columns identifying a site-year for incremental runs
+key_columns = ('State', 'Lon', 'Lat', 'SorgType', 'Year')
+
+# Grouping and yield weight of the summary table
+summary_keys = ('State', 'Year', 'SorgType', 'Crop')
+weight_column = 'AbovegroundBiomass_gCm'
+
+
+def compact_dtypes(df, float32=False):
+    '''
+    Return a copy of the site-year table with the repeated string columns
+    as categoricals and, if `float32` is True, float64 columns downcast to float32
+    (sufficient for screening runs).
+    '''
+    df = df.copy()
+    for col in categorical_columns:
+        if col in df.columns: df[col] = df[col].astype('category')
+    if float32:
+        floats = df.select_dtypes('float64').columns
+        df[floats] = df[floats].astype('float32')
+    return df
+
+
+def memory_footprint(df):
+    '''Memory used by the table (including the contents of object columns), in MB.'''
+    return df.memory_usage(deep=True).sum()/1e6
+
+
+def _iter_chunks(data_path, float32, chunksize, verbose):
+    before = after = start = 0
+    for chunk in pd.read_csv(data_path, header=[0], index_col=0, chunksize=chunksize):
+        chunk.index = pd.RangeIndex(start, start+chunk.shape[0])
+        start += chunk.shape[0]
+        compact = compact_dtypes(chunk, float32=float32)
+        before += memory_footprint(chunk)
+        after += memory_footprint(compact)
+        yield compact
+    if verbose:
+        print(f'Inputs memory ({start} rows in chunks of {chunksize}): '
+              f'{before:.3f} MB -> {after:.3f} MB.')
+
+
+def load_inputs(data_path, float32=False, verbose=True, chunksize=None):
+    '''
+    Read the site-year table with compact dtypes.
+
+    Parameters
+    ----------
+    data_path : str
+        Path to the csv file of DayCent outputs (e.g., `SORG.csv`).
+    float32 : bool
+        Whether to store numeric columns as float32 instead of float64.
+    verbose : bool
+        Whether to print the memory footprint before and after compaction.
+    chunksize : int
+        If given, return an iterator of tables with `chunksize` rows instead.
+    '''
+    if chunksize: return _iter_chunks(data_path, float32, chunksize, verbose)
+    inputs = pd.read_csv(data_path, header=[0], index_col=0).reset_index(drop=True)
+    compact = compact_dtypes(inputs, float32=float32)
+    if verbose:
+        print(f'Inputs memory: {memory_footprint(inputs):.3f} MB -> '
+              f'{memory_footprint(compact):.3f} MB.')
+    return compact
+
+
+def hash_rows(inputs):
+    '''Content hash of each row of the site-year table (including the keys), as uint64.'''
+    return pd.util.hash_pandas_object(inputs, index=False).values
+
+
+class CropConversion:
+    '''
+    Conversions between the DayCent outputs of a crop and the FDCIC inputs/results.
+
+    Parameters
+    ----------
+    crop_inputs : type
+        Subclass of :class:`Inputs` for the crop.
+    get_yield : callable
+        Function of the site-year table returning the yield in
+        `crop_inputs.GHG_functional_unit`/acre.
+    get_CI_factor : callable
+        Function of the site-year table returning the multiplier
+        from g CO2e/`crop_inputs.GHG_functional_unit` to g CO2e/ton.
+    C_frac : float
+        Carbon fraction in the dry matter of the aboveground biomass.
+    '''
+    def __init__(self, crop_inputs, get_yield, get_CI_factor, C_frac=0.45):
+        self.crop_inputs = crop_inputs
+        self.get_yield = get_yield
+        self.get_CI_factor = get_CI_factor
+        self.C_frac = C_frac
+
+    def get_results(self, df):
+        '''
+        Carbon intensities of all site-years in the table (all of this crop),
+        in the order of `CI_columns`.
+        '''
+        N = df.shape[0]
+        values = lambda col: df[col].values.astype('float64')
+        crop_inputs = self.crop_inputs()
+        fdcic = FDCIC(crop_inputs=crop_inputs)
+        # All site-years are evaluated at once as arrays
+        crop_inputs.Yield_TS = self.get_yield(df)
+        fdcic.SOC_emission = values('Delta_soilC_gCm2')/gtokg*m2_per_ha
+        items = np.array([np.broadcast_to(getattr(fdcic, item), N)
+                          for item in fdcic.GHG_items], dtype='float64')
+        # Same as in `FDCIC.GHG_table`, missing values are skipped and the last item is SOC
+        CI_factor = self.get_CI_factor(df)
+        BSC = np.nansum(items, axis=0)*CI_factor
+        BSC_without_SOC = np.nansum(items[:-1], axis=0)*CI_factor
+        dry_matter = values('AbovegroundBiomass_gCm')/self.C_frac
+        #!!! unit conversion to be double-checked
+        fieldGHG = values('net_GHG_gCO2e')/(dry_matter*gtokg*kgtoton) #gCO2eq/tonDW
+        return np.array([BSC, BSC_without_SOC, BSC+fieldGHG, BSC_without_SOC+fieldGHG])
+
+
+def _get_sorghum_CI_factor(df):
+    sweet = (df['SorgType'] == 'SweetSorghum').values
+    return np.where(sweet, grain_to_sweet, sorg_bu_per_ton)
+
+# Crops in the `Crop` column that will be calculated,
+# site-years of other crops (e.g., soybean in rotations) are kept as zeros
+crop_registry = {
+    'Sorghum': CropConversion(
+        SorghumInputs,
+        get_yield=lambda df: df['AbovegroundBiomass_gCm'].values.astype('float64')/0.45, #0.45 Carbon ration in drymatter
+        get_CI_factor=_get_sorghum_CI_factor,
+        ),
+    'Corn': CropConversion(
+        CornInputs,
+        get_yield=lambda df: df['GrainYield_gCm2'].values.astype('float64')*corn_C_frac,
+        get_CI_factor=lambda df: corn_bu_per_ton,
+        ),
+    'Sugarcane': CropConversion(
+        SugarcaneInputs,
+        #!!! double-check when we get DayCent outputs, g dry matter/m2 to tonne/acre
+        get_yield=lambda df: df['AbovegroundBiomass_gCm'].values.astype('float64')/0.45*m2_per_acre/1e6,
+        get_CI_factor=lambda df: tonne_per_ton,
+        ),
+    }
 
 
 def update_results(inputs):
     outputs = pd.DataFrame(inputs.copy())
-    outputs['temp_BSC_CO2eq'] = pd.Series(dtype='int')
-    outputs['temp_BSC_CO2eq_without_SOC'] = pd.Series(dtype='int')
-    outputs['temp_total_CO2eq'] = pd.Series(dtype='int')
-    outputs['temp_total_CO2eq_without_SOC'] = pd.Series(dtype='int')
-    inputs = inputs.T
-    for i in inputs:
-        if outputs.loc[i,'Crop'] == 'Sorghum':
-            SorghumInputs.Yield_TS = outputs.loc[i,'AbovegroundBiomass_gCm']/0.45 #0.45 Carbon ration in drymatter
-            fieldGHG = outputs.loc[i,'net_GHG_gCO2e']/(SorghumInputs.Yield_TS*gtokg*kgtoton) #gCO2eq/tonDW
-            fdcic = FDCIC(crop_inputs = SorghumInputs())
-            fdcic.SOC_emission = (outputs.loc[i,'Delta_soilC_gCm2'])/gtokg*m2_per_ha
-            ser = fdcic.GHG_table
-            if outputs.loc[i,'SorgType'] == 'SweetSorghum':
-                grain_to_sweet = grain_sorg_bu_per_acre*(1/sweet_sorg_ton_per_acre) #bu grain sorg per ton sweet sorg
-                outputs.loc[i,'temp_BSC_CO2eq'] = ser['CI with SOC']*grain_to_sweet
-                outputs.loc[i,'temp_BSC_CO2eq_without_SOC'] = ser['CI without SOC']*grain_to_sweet
-                outputs.loc[i,'temp_total_CO2eq'] = (ser['CI with SOC']*grain_to_sweet) +fieldGHG
-                outputs.loc[i,'temp_total_CO2eq_without_SOC'] = (ser['CI without SOC']*grain_to_sweet)+fieldGHG
-            else: 
-                outputs.loc[i,'temp_BSC_CO2eq'] = ser['CI with SOC']*sorg_bu_per_ton 
-                outputs.loc[i,'temp_BSC_CO2eq_without_SOC'] = ser['CI without SOC']*sorg_bu_per_ton 
-                outputs.loc[i,'temp_total_CO2eq'] = (ser['CI with SOC']*sorg_bu_per_ton)+fieldGHG
-                outputs.loc[i,'temp_total_CO2eq_without_SOC'] = (ser['CI without SOC']*sorg_bu_per_ton)+fieldGHG 
-        #elif outputs.loc[i,'Crop'] == 'Sugarcane':
-            #SugarcaneInputs.Yield_TS = outputs.loc[i,'AbovegroundBiomass_gCm']
-            #fdcic = FDCIC(crop_inputs = SugarcaneInputs())
-            #!!! convert units when we get DayCent outputs and set SOC emissions
-            #fdcic.SOC_emission = (outputs.loc[i,'Delta_soilC_gCm2'])/gtokg*m2_per_ha
-            #!!! add things for fieldGHG
-            #ser = fdcic.GHG_table
-            #outputs.loc[i,'temp_BSC_CO2eq'] = ser['CI with SOC'] 
-            #outputs.loc[i,'temp_BSC_CO2eq_without_SOC'] = ser['CI without SOC']
-        else:
-           outputs.loc[i,'temp_BSC_CO2eq'] = 0
-           outputs.loc[i,'temp_BSC_CO2eq_without_SOC'] = 0
-           outputs.loc[i,'temp_total_CO2eq'] = 0
-           outputs.loc[i,'temp_total_CO2eq_without_SOC'] = 0
-    outputs = outputs.rename(columns={'temp_BSC_CO2eq': 'BSC g CO2eq/ton', 'temp_BSC_CO2eq_without_SOC': 'BSC gCO2eq/ton without SOC', 'temp_total_CO2eq': 'total g CO2eq/ton', 'temp_total_CO2eq_without_SOC': 'total g CO2eq without SOC'})
+    results = np.zeros((4, outputs.shape[0]))
+    # Site-years are partitioned by crop, rotations are calculated in one pass
+    for crop, index in outputs.groupby('Crop', observed=True).indices.items():
+        if crop not in crop_registry: continue # kept as zeros
+        results[:, index] = crop_registry[crop].get_results(outputs.iloc[index])
+    # Results follow the precision of the inputs (float32 for screening runs)
+    dtype = 'float64' if outputs.select_dtypes('float64').shape[1] else 'float32'
+    for col, values in zip(CI_columns, results):
+        outputs[col] = values.astype(dtype)
+    return outputs
+
+
+def update_results_reference(inputs):
+    '''
+    Same as :func:`update_results`, but each site-year is calculated with its own
+    :class:`FDCIC` and `FDCIC.GHG_table` (i.e., the property-based calculation),
+    used as the reference of the faster engines (slow for large tables).
+    '''
+    outputs = pd.DataFrame(inputs.copy())
+    results = np.zeros((4, outputs.shape[0]))
+    for i in range(outputs.shape[0]):
+        row = outputs.iloc[[i]]
+        crop = row['Crop'].iloc[0]
+        if crop not in crop_registry: continue # kept as zeros
+        conversion = crop_registry[crop]
+        get = lambda col: float(row[col].iloc[0])
+        crop_inputs = conversion.crop_inputs()
+        crop_inputs.Yield_TS = float(conversion.get_yield(row)[0])
+        fdcic = FDCIC(crop_inputs=crop_inputs)
+        fdcic.SOC_emission = get('Delta_soilC_gCm2')/gtokg*m2_per_ha
+        ser = fdcic.GHG_table
+        CI_factor = float(np.ravel(conversion.get_CI_factor(row))[0])
+        BSC = ser['CI with SOC']*CI_factor
+        BSC_without_SOC = ser['CI without SOC']*CI_factor
+        dry_matter = get('AbovegroundBiomass_gCm')/conversion.C_frac
+        fieldGHG = get('net_GHG_gCO2e')/(dry_matter*gtokg*kgtoton) #gCO2eq/tonDW
+        results[:, i] = BSC, BSC_without_SOC, BSC+fieldGHG, BSC_without_SOC+fieldGHG
+    dtype = 'float64' if outputs.select_dtypes('float64').shape[1] else 'float32'
+    for col, values in zip(CI_columns, results):
+        outputs[col] = values.astype(dtype)
     return outputs
-        
-data_path = join(inputs_path, 'SORG.csv')
-#data_wb = pd.ExcelFile(data_path)
-#inputs = pd.read_csv(data_wb, sheet_name='FDCIC', header=[0], index_col=0).reset_index(drop=True)
-inputs = pd.read_csv(data_path, header=[0], index_col=0).reset_index(drop=True)
-outputs = update_results(inputs)
-output_path = join(outputs_path, 'Complete_CI.csv')
-outputs.to_csv(output_path) 
-#data_wb.close()
 
 
+def update_results_incremental(inputs, previous, previous_hashes, verbose=True):
+    '''
+    Only calculate the site-years that are new or changed compared to
+    a previous run, results of the other site-years are reused.
+
+    Rows are matched by their content hashes (which cover the keys as well),
+    so unchanged rows are reused regardless of their order in the table,
+    including the repeated site-years (same `key_columns`).
+
+    Parameters
+    ----------
+    inputs : :class:`pandas.DataFrame`
+        Current site-year table.
+    previous : :class:`pandas.DataFrame`
+        Results of the previous run.
+    previous_hashes : :class:`pandas.DataFrame`
+        Keys and row hashes of the previous run (in the same order as `previous`),
+        as saved by :func:`run`.
+    verbose : bool
+        Whether to print the number of new, changed, and reused site-years
+        and the number of site-years (keys) no longer in the table.
+    '''
+    hashes = hash_rows(inputs)
+    previous_hashes = previous_hashes.astype(inputs.loc[:, key_columns].dtypes.to_dict())
+    unique, first = np.unique(previous_hashes['hash'].values.astype('uint64'), return_index=True)
+    if unique.size:
+        loc = np.searchsorted(unique, hashes).clip(max=unique.size-1)
+        unchanged = unique[loc] == hashes
+        loc = first[loc]
+    else:
+        loc = np.zeros(hashes.size, dtype='int64')
+        unchanged = np.zeros(hashes.size, dtype=bool)
+    if verbose:
+        keys = pd.MultiIndex.from_frame(inputs.loc[:, key_columns])
+        previous_keys = pd.MultiIndex.from_frame(previous_hashes.loc[:, key_columns])
+        found = keys.isin(previous_keys)
+        N_new = (~found).sum()
+        N_changed = (found & ~unchanged).sum()
+        N_removed = (~previous_keys.isin(keys)).sum()
+        print(f'Incremental run: {N_new} new, {N_changed} changed, {N_removed} removed, '
+              f'{unchanged.sum()} reused site-years.')
+
+    calculated = update_results(inputs[~unchanged])
+    outputs = inputs.copy()
+    for col in CI_columns:
+        values = np.empty(outputs.shape[0], dtype=calculated[col].dtype)
+        values[~unchanged] = calculated[col].values
+        values[unchanged] = previous[col].values[loc[unchanged]]
+        outputs[col] = values
+    return outputs
+
+
+def run(data_path=None, output_path=None, float32=False, incremental=False,
+        chunksize=None, summarize=True, verbose=True, memory_profile=False):
+    '''
+    Calculate the carbon intensities of all site-years and save the results,
+    return the results and the summary table.
+
+    Parameters
+    ----------
+    data_path : str
+        Path to the csv file of DayCent outputs, default to `inputs/SORG.csv`.
+    output_path : str
+        Path to save the results, default to `outputs/Complete_CI.csv`.
+    float32 : bool
+        Whether to store numeric columns as float32 instead of float64.
+    incremental : bool
+        Whether to only calculate the site-years that are new or changed since
+        the last run (based on the row hashes saved next to the results),
+        results of the other site-years are reused.
+    chunksize : int
+        If given, the table is processed in chunks of `chunksize` rows
+        and the returned results will be None.
+    summarize : bool
+        Whether to save the summary table (see :class:`CISummary`)
+        next to the results.
+    verbose : bool
+        Whether to print the memory footprint of the tables.
+    memory_profile : bool
+        Whether to trace the memory of the stages (see :class:`MemoryProfile`),
+        the report is printed and the allocations by source line are saved
+        next to the results.
+    '''
+    data_path = data_path or join(inputs_path, 'SORG.csv')
+    output_path = output_path or join(outputs_path, 'Complete_CI.csv')
+    root = os.path.splitext(output_path)[0]
+    hashes_path = root + '_hashes.csv'
+    profile = MemoryProfile() if memory_profile else None
+    stage = profile.stage if profile else lambda name: nullcontext()
+    with profile or nullcontext():
+        summary = CISummary(summary_keys, weight_column, CI_columns, crop_registry) \
+            if summarize else None
+        if chunksize:
+            if incremental: raise ValueError('Incremental runs cannot be chunked.')
+            outputs = None
+            outputs_MB = 0
+            chunks = load_inputs(data_path, float32=float32, verbose=verbose, chunksize=chunksize)
+            for n in count():
+                with stage('load'): inputs = next(chunks, None)
+                if inputs is None: break
+                with stage('calculate'): chunk = update_results(inputs)
+                outputs_MB = max(outputs_MB, memory_footprint(chunk))
+                mode, header = ('w', True) if n == 0 else ('a', False)
+                with stage('save'):
+                    chunk.to_csv(output_path, mode=mode, header=header)
+                    hashes = inputs.loc[:, key_columns].assign(hash=hash_rows(inputs))
+                    hashes.to_csv(hashes_path, mode=mode, header=header, index=False)
+                if summary:
+                    with stage('summarize'): summary.add(chunk)
+            if verbose: print(f'Outputs memory (largest chunk): {outputs_MB:.3f} MB.')
+        else:
+            with stage('load'):
+                inputs = load_inputs(data_path, float32=float32, verbose=verbose)
+                previous = None
+                if incremental and os.path.isfile(output_path) and os.path.isfile(hashes_path):
+                    previous = pd.read_csv(output_path, index_col=0)
+                    previous_hashes = pd.read_csv(hashes_path, dtype={'hash': 'uint64'})
+            with stage('calculate'):
+                if previous is None: outputs = update_results(inputs)
+                else: outputs = update_results_incremental(inputs, previous, previous_hashes, verbose)
+            if verbose: print(f'Outputs memory: {memory_footprint(outputs):.3f} MB.')
+            with stage('save'):
+                outputs.to_csv(output_path)
+                hashes = inputs.loc[:, key_columns].assign(hash=hash_rows(inputs))
+                hashes.to_csv(hashes_path, index=False)
+            if summary:
+                with stage('summarize'): summary.add(outputs)
+        with stage('summarize'):
+            table = summary.table if summary else None
+            if table is not None: table.to_csv(root + '_summary.csv')
+    if profile: profile.report(root + '_memory.csv')
+    return outputs, table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Calculate feedstock carbon intensities of site-years from DayCent outputs.')
+    parser.add_argument('--inputs', default=None,
+                        help='path to the DayCent outputs, default to inputs/SORG.csv')
+    parser.add_argument('--outputs', default=None,
+                        help='path to save the results, default to outputs/Complete_CI.csv')
+    parser.add_argument('--float32', action='store_true',
+                        help='store numeric columns as float32 (for screening runs)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only calculate new or changed site-years since the last run')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='process the table in chunks of this many rows')
+    parser.add_argument('--no-summary', action='store_true',
+                        help='do not save the summary table by state, year, and sorghum type')
+    parser.add_argument('--memory-profile', action='store_true',
+                        help='report the peak and allocations by source line of each stage '
+                             '(tracemalloc), saved next to the outputs')
+    args = parser.parse_args(argv)
+    return run(args.inputs, args.outputs, float32=args.float32,
+               incremental=args.incremental, chunksize=args.chunksize,
+               summarize=not args.no_summary, memory_profile=args.memory_profile)
+
 
+if __name__ == '__main__':
+    main()
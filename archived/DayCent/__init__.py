@@ -12,14 +12,30 @@ del os
 
 
 
+from . import _cache
+from ._cache import *
+
+from . import _user_data
+from ._user_data import *
+
 from . import _fdcic
 from ._fdcic import *
 
 from . import _daycent
 from ._daycent import *
 
+from . import _async
+from ._async import *
+
+from . import _watch
+from ._watch import *
+
 __all__ = (
     '_connector_path',
+    *_cache.__all__,
+    *_user_data.__all__,
     *_fdcic.__all__,
     *_daycent.__all__,
+    *_async.__all__,
+    *_watch.__all__,
     )
\ No newline at end of file
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Yalin Li
+
+asyncio runner of the DayCent connector, DayCent and list100 are run as
+asyncio subprocesses (no shell) with a limit on the number of concurrent runs,
+staging and post-processing are done in threads so that they overlap
+with the simulations that are still running.
+"""
+
+import os, time, asyncio
+from concurrent.futures import ThreadPoolExecutor
+from . import _daycent
+from ._daycent import (
+    SiteRun,
+    calc_site_CI,
+    fail_site,
+    get_command,
+    prepare_batch,
+    read_manifest,
+    share_spinup,
+    )
+
+__all__ = (
+    'Progress',
+    'run_batch_async',
+    'run_DayCent_async',
+    'run_manifest_async',
+    'run_process_async',
+    )
+
+join = os.path.join
+PIPE = asyncio.subprocess.PIPE
+STDOUT = asyncio.subprocess.STDOUT
+
+
+async def run_process_async(args, cwd=None, timeout=None, name=''):
+    '''
+    Run a process to completion as an asyncio subprocess, raise an error
+    if it times out (the process will be killed) or exits with a non-zero code.
+    '''
+    name = name or os.path.basename(args[0])
+    process = await asyncio.create_subprocess_exec(*args, cwd=cwd, stdout=PIPE, stderr=STDOUT)
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise TimeoutError(f'{name} did not finish within {timeout} s in {cwd}.')
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    if process.returncode != 0:
+        log = stdout.decode(errors='replace').strip().splitlines()[-10:]
+        raise RuntimeError(f'{name} exited with code {process.returncode} in {cwd}, '
+                           'last lines of the output:\n' + '\n'.join(log))
+    return process.returncode
+
+
+async def wait_for_file_async(path, timeout=60, interval=0.1):
+    '''Same as :func:`wait_for_file`, but without blocking the event loop.'''
+    start = time.time()
+    size = -1
+    while True:
+        new_size = os.path.getsize(path) if os.path.isfile(path) else -1
+        if new_size >= 0 and new_size == size: return
+        if time.time() - start > timeout:
+            raise TimeoutError(f'{path} was not ready within {timeout} s.')
+        size = new_size
+        await asyncio.sleep(interval)
+
+
+async def run_DayCent_async(sch_file, extension, cwd=None, exe_dir='', list100=True, timeout=None):
+    '''
+    Same as :func:`run_DayCent`, but DayCent and list100 are run as
+    asyncio subprocesses, each of them will be killed if it takes longer
+    than `timeout` (in seconds, default to `run_timeout` in the settings).
+    '''
+    print(f'\nRunning DayCent for {sch_file}...')
+    cwd = cwd or os.getcwd()
+    timeout = timeout or _daycent.run_timeout
+    file_timeout = _daycent.file_timeout
+    args = ['-s', sch_file, '-n', sch_file]
+    if extension: args.extend(['-e', extension])
+    await run_process_async([*get_command(_daycent.dc_path, exe_dir), *args], cwd=cwd,
+                            timeout=timeout, name='DayCent')
+    await wait_for_file_async(join(cwd, f'{sch_file}.bin'), timeout=file_timeout)
+    if not list100: return
+
+    await run_process_async([*get_command(_daycent.dclist_path, exe_dir),
+                             sch_file, sch_file, 'outvars.txt'],
+                            cwd=cwd, timeout=timeout, name='list100')
+    await wait_for_file_async(join(cwd, f'{sch_file}.lis'), timeout=file_timeout)
+
+
+def format_time(seconds):
+    '''Format seconds as h:mm:ss.'''
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02}:{seconds:02}'
+
+
+class Progress:
+    '''
+    Progress of a batch, with the throughput and the estimated time to finish
+    (ETA) based on the completed runs.
+
+    Parameters
+    ----------
+    total : int
+        Total number of runs.
+    name : str
+        What is being run, used in the reports.
+    '''
+
+    def __init__(self, total, name='sites'):
+        self.total = total
+        self.name = name
+        self.done = self.failed = 0
+        self.start = time.time()
+
+    def __repr__(self):
+        return f'<{type(self).__name__}: {self.get_report()}>'
+
+    @property
+    def completed(self):
+        '''Number of runs that are done or failed.'''
+        return self.done + self.failed
+
+    @property
+    def elapsed(self):
+        '''Time since the start, in seconds.'''
+        return time.time() - self.start
+
+    @property
+    def throughput(self):
+        '''Completed runs per minute.'''
+        elapsed = self.elapsed
+        return self.completed/elapsed*60 if elapsed else 0.
+
+    @property
+    def eta(self):
+        '''Estimated time to finish the remaining runs, in seconds (NaN if unknown).'''
+        completed = self.completed
+        if not completed: return float('nan')
+        return self.elapsed/completed*(self.total-completed)
+
+    def get_report(self):
+        '''Progress as a line of text.'''
+        eta = self.eta
+        eta = format_time(eta) if eta == eta else '?'
+        failed = f', {self.failed} failed' if self.failed else ''
+        return (f'{self.completed}/{self.total} {self.name}{failed}, '
+                f'{self.throughput:.1f} {self.name}/min, '
+                f'elapsed {format_time(self.elapsed)}, ETA {eta}')
+
+    def update(self, failed=False):
+        '''Record a completed run and print the progress.'''
+        if failed: self.failed += 1
+        else: self.done += 1
+        self.report()
+
+    def report(self):
+        '''Print the progress.'''
+        print(f'\n[{self.get_report()}]')
+
+    async def report_periodically(self, interval):
+        '''Print the progress every `interval` seconds until cancelled.'''
+        while True:
+            await asyncio.sleep(interval)
+            self.report()
+
+
+async def _run(run, semaphore, timeout, on_start=None):
+    # Staging and post-processing are run in threads to not block the event loop,
+    # only the simulations are limited by the semaphore,
+    # `on_start` is called once the run is let through (e.g., to mark the sites as running)
+    loop = asyncio.get_running_loop()
+    try:
+        async with semaphore:
+            if on_start: on_start()
+            await loop.run_in_executor(None, run.stage)
+            if not run.cached: await run_DayCent_async(**run.DayCent_kwargs, timeout=timeout)
+        return await loop.run_in_executor(None, run.finish)
+    finally:
+        await loop.run_in_executor(None, run.close)
+
+
+async def run_batch_async(workspace_path, sites, journal_path=None, max_concurrency=None,
+                          retry_failed=True, timeout=None, report_interval=60):
+    '''
+    Same as :func:`run_batch`, but the sites are run with asyncio.
+
+    Parameters
+    ----------
+    workspace_path: str
+        Path to the workspace containing the DayCent executables and site folders.
+    sites: Iterable(dict)
+        Sites to run, with "folder", and optional "schedule", "extension",
+        and "spinup" (see :func:`read_manifest`).
+    journal_path: str
+        Path to the journal file, default to journal.jsonl in the workspace.
+    max_concurrency: int
+        Maximum number of DayCent/list100 processes running at the same time,
+        default to the number of CPUs.
+    retry_failed: bool
+        Whether to rerun sites that failed in previous runs.
+    timeout: float
+        Time limit (in seconds) of each DayCent/list100 run, hung runs
+        will be killed, default to `run_timeout` in the settings.
+    report_interval: float
+        Interval (in seconds) of progress reports in addition to the ones
+        when runs are completed, None to disable.
+
+    Returns
+    -------
+    journal: :class:`SiteJournal`
+        Journal with the states of all sites.
+    '''
+    sites, journal, to_run, spinups, cache = prepare_batch(
+        workspace_path, sites, journal_path, retry_failed)
+    semaphore = asyncio.Semaphore(max_concurrency or os.cpu_count())
+    loop = asyncio.get_running_loop()
+
+    # Phase 1: run each unique spin-up once
+    spinup_failed = set()
+    async def run_spinup(folders):
+        def on_start():
+            for folder in folders: journal.set_state(folder, 'running')
+        run = SiteRun(workspace_path, folders[0], schedule=sites[folders[0]]['spinup'],
+                      cache=cache, spinup=True)
+        try:
+            bin_path = await _run(run, semaphore, timeout, on_start)
+            await loop.run_in_executor(None, share_spinup, workspace_path, sites, folders, bin_path)
+        except Exception as error:
+            for folder in folders: fail_site(journal, folder, error)
+            spinup_failed.update(folders)
+    if spinups:
+        await asyncio.gather(*[run_spinup(folders) for folders in spinups.values()])
+    # Sites failed in previous runs are in `to_run` to be retried
+    to_run = [i for i in to_run if i not in spinup_failed]
+
+    # Phase 2: run the schedules (as extensions of the spin-ups),
+    # sites are post-processed as soon as they are finished
+    progress = Progress(len(to_run))
+    # The Excel FD-CIC cannot be run in parallel, so it is run in its own thread
+    # (one site at a time) to not block the event loop
+    CI_executor = ThreadPoolExecutor(max_workers=1) if _daycent.use_excel_FDCIC else None
+    async def run_site(folder):
+        site = sites[folder]
+        run = SiteRun(workspace_path, folder, site.get('spinup') or site.get('extension', ''),
+                      site.get('schedule', ''), cache)
+        try:
+            await _run(run, semaphore, timeout, lambda: journal.set_state(folder, 'running'))
+            await loop.run_in_executor(CI_executor, calc_site_CI, workspace_path, folder)
+        except Exception as error:
+            fail_site(journal, folder, error)
+            progress.update(failed=True)
+        else:
+            journal.set_state(folder, 'done')
+            progress.update()
+
+    reporter = loop.create_task(progress.report_periodically(report_interval)) \
+        if report_interval and to_run else None
+    try:
+        await asyncio.gather(*[run_site(folder) for folder in to_run])
+    finally:
+        if reporter: reporter.cancel()
+        if CI_executor: CI_executor.shutdown()
+    if cache is not None: cache.report()
+    return journal
+
+
+def run_manifest_async(manifest_path, journal_path=None, max_concurrency=None,
+                       retry_failed=True, timeout=None, report_interval=60):
+    '''
+    Run the sites listed in the manifest with :func:`run_batch_async`,
+    see :func:`run_manifest` for the journal.
+    '''
+    workspace_path, sites = read_manifest(manifest_path)
+    journal_path = journal_path or f'{os.path.splitext(manifest_path)[0]}.journal.jsonl'
+    return asyncio.run(run_batch_async(workspace_path, sites, journal_path, max_concurrency,
+                                       retry_failed, timeout, report_interval))
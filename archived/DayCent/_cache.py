@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Yalin Li
+
+Content-addressed cache of DayCent runs, runs with identical inputs
+(including the DayCent and list100 executables) are only simulated once.
+"""
+
+import os, shutil, hashlib, tempfile, threading
+from functools import lru_cache
+
+__all__ = ('RunCache', 'hash_file', 'link_or_copy',)
+
+
+def hash_file(path, chunk_size=1<<20):
+    '''SHA-256 hex digest of the file content.'''
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def link_or_copy(src, dst, symlink=True):
+    '''
+    Make `dst` a hard link of `src` (or a symbolic link if `symlink` is True
+    and hard links are not supported, e.g., across file systems),
+    copy the file if neither is possible, return the method used
+    ("hardlink", "symlink", or "copy").
+
+    Linked files share the contents, they should be read-only.
+    '''
+    if os.path.isdir(dst): dst = os.path.join(dst, os.path.basename(src))
+    if os.path.lexists(dst): os.remove(dst)
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError: pass
+    if symlink:
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return 'symlink'
+        except OSError: pass # e.g., no privilege on Windows
+    shutil.copy(src, dst)
+    return 'copy'
+
+
+def _as_dict(files):
+    return files if isinstance(files, dict) else {i: i for i in files}
+
+
+@lru_cache(maxsize=None)
+def _hash_file_cached(path, mtime, size):
+    return hash_file(path)
+
+
+def hash_command(args):
+    '''
+    Hash of a command, files in the arguments (e.g., the executable)
+    are hashed by their contents, other arguments by themselves.
+    '''
+    hasher = hashlib.sha256()
+    for arg in args:
+        if os.path.isfile(arg):
+            stat = os.stat(arg)
+            # Executables rarely change, reuse the hash if not modified
+            hasher.update(_hash_file_cached(os.path.abspath(arg), stat.st_mtime_ns, stat.st_size).encode())
+        else: hasher.update(arg.encode())
+        hasher.update(b'\0')
+    return hasher.hexdigest()
+
+
+class RunCache:
+    '''
+    Content-addressed cache of DayCent runs.
+
+    The key of a run is the hash of the names and contents of all input
+    files of the run, other run arguments, and the commands (including
+    the executables) of DayCent and list100.
+    The outputs of the run are saved in `<path>/<key[:2]>/<key>/`,
+    and are hard linked (or copied if not possible) to and from the runs,
+    so they should not be modified in place.
+
+    Files can be given as dicts of the names used in the cache to the names
+    in the run directory so that runs of files with different names
+    (e.g., schedule files named after the site) can share the cache.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the cache, will be created if not exist.
+
+    Examples
+    --------
+    >>> cache = RunCache('.cache') # doctest: +SKIP
+    >>> key = cache.get_key(sandbox, files, commands, args) # doctest: +SKIP
+    >>> if not cache.restore(key, sandbox, outputs): # doctest: +SKIP
+    ...     run(sandbox)
+    ...     cache.store(key, sandbox, outputs)
+    >>> cache.report() # doctest: +SKIP
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def __repr__(self):
+        return f'<{type(self).__name__}: {self.path}, {self.hits} hits, {self.misses} misses>'
+
+    @property
+    def hit_rate(self):
+        '''Fraction of the lookups served from the cache, NaN if no lookups.'''
+        total = self.hits + self.misses
+        return self.hits/total if total else float('nan')
+
+    def reset_stats(self):
+        '''Reset the numbers of hits and misses.'''
+        self.hits = self.misses = 0
+
+    def report(self):
+        '''Print the numbers of hits and misses and the hit rate.'''
+        total = self.hits + self.misses
+        if not total: return
+        print(f'\nRun cache: {self.hits} of {total} runs served from the cache '
+              f'({self.hit_rate:.0%} hit rate).')
+
+    @staticmethod
+    def get_key(directory, files, commands=(), args=()):
+        '''
+        Key of a run.
+
+        Parameters
+        ----------
+        directory : str
+            Directory containing the input files.
+        files : Iterable(str)|dict
+            Names of the input files (or a dict of the names used
+            in the cache to those in `directory`), can also be absolute paths.
+        commands : Iterable(Iterable(str))
+            Commands (lists of arguments) used in the run.
+        args : Iterable(str)
+            Other arguments of the run.
+        '''
+        hasher = hashlib.sha256()
+        files = _as_dict(files)
+        for file in sorted(files):
+            hasher.update(file.encode() + b'\0')
+            hasher.update(hash_file(os.path.join(directory, files[file])).encode())
+        for command in commands:
+            hasher.update(hash_command(command).encode())
+        for arg in args:
+            hasher.update(str(arg).encode() + b'\0')
+        return hasher.hexdigest()
+
+    def get_path(self, key):
+        '''Directory of the cached outputs of the run.'''
+        return os.path.join(self.path, key[:2], key)
+
+    def restore(self, key, directory, files):
+        '''
+        Copy the cached output files of the run to `directory`,
+        return whether the run is in the cache.
+        '''
+        path = self.get_path(key)
+        files = _as_dict(files)
+        hit = all(os.path.isfile(os.path.join(path, i)) for i in files)
+        if hit:
+            for file, name in files.items():
+                link_or_copy(os.path.join(path, file), os.path.join(directory, name), symlink=False)
+        with self._lock:
+            if hit: self.hits += 1
+            else: self.misses += 1
+        return hit
+
+    def store(self, key, directory, files):
+        '''Save the output files of the run in `directory` to the cache.'''
+        path = self.get_path(key)
+        if os.path.isdir(path): return
+        files = _as_dict(files)
+        parent = os.path.dirname(path)
+        os.makedirs(parent, exist_ok=True)
+        # Write to a temporary directory first so that
+        # incomplete outputs will never be in the cache
+        temp = tempfile.mkdtemp(prefix=f'.{key[:8]}_', dir=parent)
+        try:
+            for file, name in files.items():
+                link_or_copy(os.path.join(directory, name), os.path.join(temp, file), symlink=False)
+            try: os.rename(temp, path)
+            except OSError: pass # saved by another run at the same time
+        finally:
+            shutil.rmtree(temp, ignore_errors=True)
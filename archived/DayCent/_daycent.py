@@ -19,6 +19,7 @@ TODO/Notes:
 C_frac = {
     'corn': 0.429,
     'soybean': 0.3169,
+    'sorghum': 0.429, # same bushel weight (56 lb) as corn
     }
 
 # Mass conversion
@@ -51,18 +52,70 @@ fertilizers = {
     'P': 'MAP', # MAP, DAP
     }
 
-# Name of the executive files
+# Name of the executive files, relative to the workspace,
+# can also be a list of command arguments (e.g., `stand_in_paths`)
 dc_path = 'DayCent_CABBI.exe' # DayCent
 dclist_path = 'list100_DayCent-CABBI.exe' # DayCent list100
 
+# Time limits (in seconds) for each DayCent/list100 run (None for no limit)
+# and for the outputs to be ready after the run
+run_timeout = None
+file_timeout = 60
+
+# Whether to calculate carbon intensities with the macro in the Excel FD-CIC
+# (requires Excel and xlwings) instead of the native FD-CIC
+use_excel_FDCIC = False
+
+# Directory (relative to the workspace) of the cache of DayCent runs,
+# runs with identical inputs and executables will be served from the cache,
+# set to '' to disable
+cache_dir = '.cache'
+
+# Whether to run manifests with the asyncio runner (see `run_batch_async`)
+use_asyncio = False
+
+# Whether to also save the processed outputs to user_data.xlsx (slow),
+# outputs are always saved in user_data_outputs.csv (see `read_user_outputs`),
+# user_data.xlsx is always updated when using the Excel FD-CIC
+export_excel = False
+
+# Whether to stage the input files of the runs with hard or symbolic links
+# instead of copying them (files will be copied if links cannot be made)
+link_inputs = True
+
+# Whether to save parsed copies of the DayCent outputs (as .npz next to the outputs)
+# so that post-processing the outputs again (e.g., with different factors)
+# does not need to parse the outputs, copies are used until the outputs are changed
+save_parsed_outputs = True
+
 
 # %%
 
-__all__ = ('run_DayCent_connector',)
+__all__ = (
+    'SiteJournal',
+    'process_site',
+    'read_manifest',
+    'run_batch',
+    'run_DayCent_connector',
+    'run_manifest',
+    'stand_in_paths',
+    )
 
-import os, subprocess, time, shutil, re
+import os, sys, subprocess, time, shutil, re, tempfile, json, threading
 import numpy as np, pandas as pd
-from . import _connector_path, run_FDCIC
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from . import (
+    _connector_path,
+    RunCache,
+    export_user_data,
+    link_or_copy,
+    read_user_inputs,
+    run_FDCIC,
+    run_FDCIC_native,
+    write_user_outputs,
+    )
+from ._user_data import outputs_csv, get_schema_path
 
 # Functions that used a lot
 isfile = os.path.isfile
@@ -71,10 +124,119 @@ cp = shutil.copy
 mv = shutil.move
 rm = os.remove
 
+# `np.loadtxt` is implemented in C (and faster than `pd.read_csv`) since numpy 1.23
+_C_loadtxt = tuple(int(i) for i in np.__version__.split('.')[:2]) >= (1, 23)
+
+# Commands to use the stand-in of DayCent and list100 (e.g., for tests), set
+# `dc_path, dclist_path = stand_in_paths` to use
+_stand_in = join(_connector_path, '_stand_in.py')
+stand_in_paths = ([sys.executable, _stand_in, 'DayCent'],
+                  [sys.executable, _stand_in, 'list100'])
+
+# Columns used from the DayCent CSV outputs and their dtypes
+output_columns = {
+    'harvest.csv': {
+        'cgrain': 'float64',
+        'crmvst': 'float64',
+        'strmac2': 'float64',
+        'fertappN': 'float64',
+        'fertappP': 'float64',
+        },
+    'year_summary.csv': {
+        'time': 'float64',
+        'N2Oflux': 'float64',
+        'NOflux': 'float64',
+        },
+    'methane.csv': {
+        'time': 'float64',
+        'CH4_prod': 'float32',
+        'CH4_oxid': 'float32',
+        },
+    }
+# Columns used from the .lis output
+lis_columns = {
+    'somtc': 'float64',
+    'strmac2': 'float64',
+    'volpac': 'float64',
+    }
+
+input_files = [
+    'crop.100',
+    'cult.100',
+    'fert.100',
+    'fix.100',
+    'harv.100',
+    'irri.100',
+    'site.100',
+    'tree.100',
+    'trem.100',
+    'outfiles.in',
+    'sitepar.in',
+    'soils.in',
+    'outvars.txt',
+    'weather.wth',
+    # 'TEAValues.csv',
+    # 'non-soil.csv',
+    ]
+
+output_files = [
+    'co2.csv',
+    'harvest.csv',
+    'methane.csv',
+    'nflux.csv',
+    'potcrp.csv',
+    'potfor.csv',
+    'potgt.csv',
+    'resp.csv',
+    'summary.csv',
+    'year_summary.csv']
+
+
+def get_command(exe, exe_dir=''):
+    '''Arguments to call an executable set as a path (relative to `exe_dir`) or a list of arguments.'''
+    if isinstance(exe, str): return [join(exe_dir, exe)]
+    return list(exe)
+
+
+def run_process(args, cwd=None, timeout=None, name=''):
+    '''
+    Run a process to completion, raise an error if it times out
+    (the process will be killed) or exits with a non-zero code.
+    '''
+    name = name or os.path.basename(args[0])
+    try:
+        process = subprocess.run(args, cwd=cwd, timeout=timeout,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 text=True, errors='replace')
+    except subprocess.TimeoutExpired:
+        raise TimeoutError(f'{name} did not finish within {timeout} s in {cwd}.')
+    if process.returncode != 0:
+        log = process.stdout.strip().splitlines()[-10:]
+        raise RuntimeError(f'{name} exited with code {process.returncode} in {cwd}, '
+                           'last lines of the output:\n' + '\n'.join(log))
+    return process
+
+
+def wait_for_file(path, timeout=60, interval=0.1):
+    '''
+    Wait until the file exists and its size stays the same between two checks
+    (i.e., it is completely written), raise an error if it takes longer than `timeout`.
+    '''
+    start = time.time()
+    size = -1
+    while True:
+        new_size = os.path.getsize(path) if isfile(path) else -1
+        if new_size >= 0 and new_size == size: return
+        if time.time() - start > timeout:
+            raise TimeoutError(f'{path} was not ready within {timeout} s.')
+        size = new_size
+        time.sleep(interval)
+
 
-def run_DayCent(sch_file, extension):
+def run_DayCent(sch_file, extension, cwd=None, exe_dir='', list100=True):
     '''
-    Runs DayCent with a specific schedule file.
+    Runs DayCent with a specific schedule file, then list100 once DayCent
+    has exited and the binary output is ready.
 
     Parameters
     ----------
@@ -82,18 +244,29 @@ def run_DayCent(sch_file, extension):
         Name of schedule file to be used
     extension: str
         whether or not there is an extension file and the extension .bin
+    cwd: str
+        Directory containing the input files (current directory if not given),
+        outputs will be saved in it.
+    exe_dir: str
+        Directory of the DayCent and list100 executables.
+    list100: bool
+        Whether to run list100 (not needed for spin-up runs).
     '''
     print(f'\nRunning DayCent for {sch_file}...')
-    if extension:
-        subprocess.call(f'{dc_path} -s {sch_file} -n {sch_file} -e {extension}', shell=True)
-    else:
-        subprocess.call(f'{dc_path} -s {sch_file} -n {sch_file}', shell=True)
+    cwd = cwd or os.getcwd()
+    args = ['-s', sch_file, '-n', sch_file]
+    if extension: args.extend(['-e', extension])
+    run_process([*get_command(dc_path, exe_dir), *args], cwd=cwd,
+                timeout=run_timeout, name='DayCent')
+    wait_for_file(join(cwd, f'{sch_file}.bin'), timeout=file_timeout)
+    if not list100: return
 
-    time.sleep(10)
-    subprocess.call(f'{dclist_path} {sch_file} {sch_file} outvars.txt', shell=True)
+    run_process([*get_command(dclist_path, exe_dir), sch_file, sch_file, 'outvars.txt'],
+                cwd=cwd, timeout=run_timeout, name='list100')
+    wait_for_file(join(cwd, f'{sch_file}.lis'), timeout=file_timeout)
 
 
-def read_lis(lis_path, head_skip, tail_skip):
+def read_lis(lis_path, head_skip, tail_skip, columns=None):
     '''
     Read space-delimited .lis output files and convert to a dataframe
     (including skipping headers and
@@ -107,63 +280,185 @@ def read_lis(lis_path, head_skip, tail_skip):
         Number of rows to skip at beginning of file, incl. headers and dummy data.
     tail_skip : int
         Numbers of rows to skip at end of file, typically dummy data.
+    columns : Iterable(str)
+        Only read these columns (as in the file, e.g., "strmac(2)",
+        or with spaces and parentheses removed, e.g., "strmac2"),
+        all columns will be read if not given.
     '''
-    # read all lines into a 2D list, delete the list initialization and specified head/tail lines
-    input_data = open(lis_path, 'r')
-    # Skip head lines and get header
-    for i in range(head_skip):
-        if i== 0:
-            header = next(input_data).split()
+    with open(lis_path, 'r') as input_data:
+        # Skip head lines and get header
+        header = [clean_name(i) for i in next(input_data).split()]
+        for i in range(head_skip-1): next(input_data)
+        if columns is None: usecols = None
+        else:
+            usecols = [clean_name(i) for i in columns]
+            missing = set(usecols).difference(header)
+            if missing:
+                raise ValueError(f'Columns {", ".join(sorted(missing))} not in {lis_path}.')
+        if _C_loadtxt:
+            index = None if usecols is None else [header.index(i) for i in usecols]
+            data = np.loadtxt(input_data, usecols=index, ndmin=2)
+            df = pd.DataFrame(data, columns=header if usecols is None else usecols)
         else:
-            next(input_data)
-    data = np.loadtxt(input_data)[:-tail_skip]
-    df = pd.DataFrame(data, columns=header)
-    return update_col(df)
+            df = pd.read_csv(input_data, sep=r'\s+', header=None, names=header,
+                             usecols=usecols, dtype='float64', engine='c')
+            if usecols is not None: df = df[usecols]
+    if tail_skip: df = df.iloc[:-tail_skip]
+    return df
+
+
+def get_run_files(folder, schedule=''):
+    '''Names of the files generated in the site folder by running the site.'''
+    schedule = schedule or folder
+    outputs = [*output_files, f'{schedule}.lis']
+    return [*outputs, *(get_parsed_path(i) for i in outputs), f'{schedule}.bin',
+            outputs_csv, get_schema_path(outputs_csv), f'{folder}_CI.csv', f'{folder}.xlsm']
 
 
 def cleanup_files(workspace_path, folders=()):
-    '''Remove the copied files generated during run.'''
-    # In the top level of workspace
-    for file in os.listdir():
-        for suffix in ('.100', '.in', '.sch', '.bin', '.lis', '.csv', '.xlsx', 'xlsm',
-                       'weather.wth', 'outvars.txt'):
-            if file.endswith(suffix):
-                rm(file)
-
-    # In individual folders
+    '''
+    Remove the files generated by previous runs in the site folders,
+    `folders` can be names of the folders or sites (dicts with "folder"
+    and "schedule") as in :func:`read_manifest`.
+    '''
+    # Runs are in temporary directories, nothing is left in the workspace
     for folder in folders:
-        folder_path = join(workspace_path, folder)
-        for file in os.listdir(folder_path):
-            for suffix in ('.bin', '.lis', '.csv'):
-                if (file.endswith(suffix)
-                    # and file not in ('TEAValues.csv', 'non-soil.csv')
-                    ):
-                    rm(join(folder_path, file))
+        site = {'folder': folder} if isinstance(folder, str) else folder
+        folder_path = join(workspace_path, site['folder'])
+        to_remove = set(get_run_files(site['folder'], site.get('schedule', '')))
+        to_remove.discard(f"{site.get('extension')}.bin") # extension file of the run
+        for file in to_remove.intersection(os.listdir(folder_path)):
+            rm(join(folder_path, file))
+
+
+@lru_cache(maxsize=None)
+def clean_name(name):
+    '''Strip spaces, parentheses, and slashes in the column name.'''
+    return ''.join(re.split(r'\(|\)| |/', name))
 
 
 def update_col(df):
     '''Update dataframe column names so it's easier to retrieve data.'''
     # Strip spaces and parenthese
-    df = df.rename(columns={i: ''.join(re.split('\(|\)| |/', i))
-                            for i in df.columns})
+    df = df.rename(columns={i: clean_name(i) for i in df.columns})
+    return df
+
+
+def read_output(csv_path, columns=None):
+    '''
+    Read a DayCent CSV output with only the needed columns.
+
+    Parameters
+    ----------
+    csv_path: str
+        Path to the output file.
+    columns: dict
+        Names of the needed columns (with spaces, parentheses, and slashes removed,
+        e.g., "strmac2" for "strmac(2)") and their dtypes, default to the ones
+        in `output_columns` for the file.
+    '''
+    columns = columns or output_columns[os.path.basename(csv_path)]
+    with open(csv_path, 'r') as file: header = file.readline()
+    names = [clean_name(i.strip().strip('"')) for i in header.rstrip('\n').split(',')]
+    missing = set(columns).difference(names)
+    if missing:
+        raise ValueError(f'Columns {", ".join(sorted(missing))} not in {csv_path}.')
+    usecols = [names.index(i) for i in columns]
+    df = pd.read_csv(csv_path, header=0, usecols=usecols, engine='c',
+                     names=[names[i] if i in usecols else f'_{i}' for i in range(len(names))],
+                     dtype=columns)
+    return df[list(columns)]
+
+
+def get_parsed_path(path):
+    '''Path to the parsed copy of the DayCent output.'''
+    return f'{path}.npz'
+
+
+def _get_source(path):
+    stat = os.stat(path)
+    return np.array([stat.st_mtime_ns, stat.st_size], dtype='int64')
+
+
+def read_parsed(path, columns, read):
+    '''
+    Read the columns of a DayCent output from its parsed copy if the output
+    has not been changed (same modification time and size) since the copy
+    was saved, otherwise read the output with `read` and save the parsed copy
+    (if `save_parsed_outputs` is True in the settings).
+
+    Parameters
+    ----------
+    path: str
+        Path to the output file.
+    columns: dict
+        Names of the needed columns (with spaces, parentheses, and slashes removed)
+        and their dtypes.
+    read: Callable
+        Function to read the output, called with `path` and
+        should return a DataFrame with `columns`.
+    '''
+    parsed_path = get_parsed_path(path)
+    if not save_parsed_outputs: return read(path)
+    source = _get_source(path)
+    if isfile(parsed_path):
+        try:
+            with np.load(parsed_path) as parsed:
+                if (parsed['_source'] == source).all() and \
+                    all(i in parsed and parsed[i].dtype == columns[i] for i in columns):
+                    return pd.DataFrame({i: parsed[i] for i in columns})
+        except (OSError, ValueError, KeyError): pass # incomplete or not readable, parse again
+    df = read(path)
+    # Write to a temporary file (unique to the process and thread) first
+    # so that incomplete copies will never be used
+    temp_path = f'{parsed_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as file:
+        np.savez(file, _source=source, **{i: df[i].values for i in columns})
+    os.replace(temp_path, parsed_path)
     return df
 
 
-def update_results(inputs, folder):
-    '''Read, organize, and save DayCent results.'''
+def get_annual_methane(methane):
+    '''
+    Sum daily CH4 production and oxidation into annual values
+    (in the order the years appear in `methane`).
+
+    Returns
+    -------
+    CH4_prod : ndarray
+        Annual CH4 production.
+    CH4_oxid : ndarray
+        Annual CH4 oxidation.
+    '''
+    year = np.floor(methane.time.values)
+    values = methane[['CH4_prod', 'CH4_oxid']].values
+    if year.size and (np.diff(year) >= 0).all():
+        # Sorted by time (as DayCent writes it), sum over the runs of each year
+        starts = np.flatnonzero(np.r_[True, year[1:]!=year[:-1]])
+        annual = np.add.reduceat(values, starts, axis=0, dtype='float64')
+    else:
+        annual = pd.DataFrame(values, dtype='float64').groupby(
+            year, sort=False).sum().values.reshape(-1, 2)
+    return annual[:, 0], annual[:, 1]
+
+
+def update_results(inputs, folder, path=''):
+    '''Read, organize, and save DayCent results (saved in `path`).'''
     header = [i[1] for i in inputs.columns]
     outputs = inputs.copy()
     outputs.columns = header
 
     # Results from DayCent
-    harvest = update_col(pd.read_csv('harvest.csv'))
-    year_summary = update_col(pd.read_csv('year_summary.csv'))
-    lis_results = read_lis(f'{folder}.lis', head_skip=2, tail_skip=1)
-    methane = update_col(pd.read_csv('methane.csv'))
+    harvest, year_summary, methane = [
+        read_parsed(join(path, i), output_columns[i], read_output)
+        for i in ('harvest.csv', 'year_summary.csv', 'methane.csv')]
+    lis_results = read_parsed(
+        join(path, f'{folder}.lis'), lis_columns,
+        lambda lis_path: read_lis(lis_path, head_skip=2, tail_skip=1, columns=lis_columns))
 
     # Find crop yield in bu/ac
     croptype = outputs.CROP_type
-    cfracs = np.asarray([C_frac[i] or 0.429 for i in croptype])
+    cfracs = np.asarray([C_frac.get(i) or 0.429 for i in croptype])
     cyields = [harvest.cgrain[i] if croptype[i] in grains \
                else harvest.crmvst[i] if croptype[i] in grasses \
                else 0. \
@@ -197,12 +492,8 @@ def update_results(inputs, folder):
     Papp = harvest.fertappP # g P/m2
     outputs.loc[:, fertilizers['P']] = Papp * PtoP2O5 * m2_per_acre * gtolb # g P2O5/m2
 
-    #formatting methane variables
-    methane['year'] = np.floor(methane.time)
     # Daily emission to annual emission
-    years = methane.year.unique()
-    CH4_prodyear = np.array([methane[methane.year==i].CH4_prod.sum() for i in years])
-    CH4_oxyear = np.array([methane[methane.year==i].CH4_oxid.sum() for i in years])
+    CH4_prodyear, CH4_oxyear = get_annual_methane(methane)
     # Get the CO2-eq CH4, note that the oxidized CH4 does not need to multiply by the methane CF
     CH4flux = (CH4_prodyear-CH4_oxyear)*CtoCH4*CFs['BioCH4'] + CH4_oxyear*CtoCO2
     outputs.CH4_FLUX = CH4flux * multiplier
@@ -211,104 +502,573 @@ def update_results(inputs, folder):
     return outputs
 
 
-def run_DayCent_connector():
-    '''Execute DayCent-related functions. '''
-    # Navigate to workspace
-    workspace_path = input("Path to workspace: ")
-    # Change the directory now so that if there's a problem with the path,
-    # the user will receive the error early
-    os.chdir(workspace_path)
+class SiteRun:
+    '''
+    A DayCent run of a site in its own temporary directory in the workspace,
+    used by both the threaded and asyncio runners as:
+    `stage` (create the directory, copy inputs, and check the cache),
+    run DayCent (if not `cached`) in `sandbox` with `DayCent_kwargs`,
+    `finish` (post-process and save the results to the site folder), and
+    `close` (remove the temporary directory).
 
-    #!!! Maybe should consider extension for different folders as well?
-    extend = input("Are you extending a file? (y or n) : ")
-    if extend == 'y':
-        extension = input('Input file running DayCent extension with. '
-                          ' Do not include the .bin extension')
-    else:
-        extension = ''
-
-    folders = []
-    first = input('Folder name: ')
-    folders = [first]
-    addfolder = input('Would you like to add another folder? y or n: ')
-    while addfolder == 'y':
-        new = input('Folder name: ')
-        folders.append(new)
-        addfolder = input('Would you like to add another folder? y or n: ')
+    Parameters
+    ----------
+    workspace_path: str
+        Path to the workspace containing the DayCent executables and site folders.
+    folder: str
+        Name of the site folder.
+    extension: str
+        Name of the extension file (without .bin), will be looked up
+        in the site folder then the workspace.
+    schedule: str
+        Name of the schedule file (without .sch) in the site folder,
+        default to the name of the folder.
+    cache: :class:`RunCache`
+        If given, DayCent outputs will be restored from the cache
+        if the same run has been done, or saved to the cache after the run.
+    spinup: bool
+        Whether this is a spin-up run, `schedule` is the spin-up schedule
+        (looked up in the site folder then the workspace), list100 and
+        post-processing are not needed, and only the binary output
+        `<schedule>.bin` is saved to the site folder.
+    '''
 
-    cleanup_files(workspace_path, folders)
-
-    input_files= [
-        'crop.100',
-        'cult.100',
-        'fert.100',
-        'fix.100',
-        'harv.100',
-        'irri.100',
-        'site.100',
-        'tree.100',
-        'trem.100',
-        'outfiles.in',
-        'sitepar.in',
-        'soils.in',
-        'outvars.txt',
-        'weather.wth',
-        # 'TEAValues.csv',
-        # 'non-soil.csv',
-        'user_data.xlsx']
-
-    output_files = [
-        'co2.csv',
-        'harvest.csv',
-        'methane.csv',
-        'nflux.csv',
-        'potcrp.csv',
-        'potfor.csv',
-        'potgt.csv',
-        'resp.csv',
-        'summary.csv',
-        'year_summary.csv']
-    for folder in folders:
-        # Copy needed input files
-        folder_path = join(workspace_path, folder)
-        for file in [*input_files, f'{folder}.sch']:
-            cp(join(folder_path, file), workspace_path)
+    def __init__(self, workspace_path, folder, extension='', schedule='', cache=None, spinup=False):
+        self.workspace_path = workspace_path
+        self.folder = folder
+        self.extension = extension
+        self.schedule = schedule or folder
+        self.cache = cache
+        self.spinup = spinup
+        self.sandbox = ''
+        self.cached = False
+        #: Bytes of the files linked, copied, and moved (i.e., renamed) by the run.
+        self.io = dict(linked=0, copied=0, moved=0)
+
+    def __repr__(self):
+        return f'<{type(self).__name__}: {self.folder}, {self.schedule}>'
+
+    @property
+    def folder_path(self):
+        '''Path to the site folder.'''
+        return join(self.workspace_path, self.folder)
+
+    @property
+    def DayCent_kwargs(self):
+        '''Keyword arguments for :func:`run_DayCent`.'''
+        return dict(sch_file=self.schedule, extension=self.extension, cwd=self.sandbox,
+                    exe_dir=self.workspace_path, list100=not self.spinup)
 
-        # Run DayCent and update results
-        run_DayCent(sch_file=folder, extension=extension)
+    @property
+    def run_files(self):
+        '''Output files of the run.'''
+        if self.spinup: return [f'{self.schedule}.bin']
+        return [*output_files, f'{self.schedule}.lis', f'{self.schedule}.bin']
 
-        data_path = join(workspace_path, 'user_data.xlsx')
-        data_wb = pd.ExcelFile(data_path)
-        inputs = pd.read_excel(data_wb, sheet_name='inputs',
-                               header=[0,1,2], index_col=0).reset_index(drop=True)
-        outputs = update_results(inputs, folder)
-        data_wb.close()
+    def _stage_file(self, src, dst, link=True):
+        if os.path.isdir(dst): dst = join(dst, os.path.basename(src))
+        if link_inputs and link: method = link_or_copy(src, dst)
+        else:
+            cp(src, dst)
+            method = 'copy'
+        self.io['copied' if method == 'copy' else 'linked'] += os.path.getsize(src)
+
+    def _move_file(self, src, dst):
+        size = os.path.getsize(src)
+        if os.path.lexists(dst): rm(dst)
+        mv(src, dst)
+        self.io['moved'] += size
+
+    def report_io(self):
+        '''Print the I/O volume of the run.'''
+        MB = [f'{self.io[i]/1e6:.1f} MB {i}' for i in ('linked', 'copied', 'moved')]
+        run = f'spin-up of {self.folder}' if self.spinup else self.folder
+        print(f'\nFiles of {run}: {", ".join(MB)}.')
+
+    def stage(self):
+        '''Create the temporary directory, stage the inputs, and restore the outputs from the cache.'''
+        folder, folder_path, schedule, extension = \
+            self.folder, self.folder_path, self.schedule, self.extension
+        self.sandbox = sandbox = tempfile.mkdtemp(
+            prefix=f'{folder}_spinup_' if self.spinup else f'{folder}_', dir=self.workspace_path)
+        if self.spinup:
+            # Spin-ups only need the DayCent inputs, schedule can be shared in the workspace
+            files = get_spinup_files(self.workspace_path, folder, schedule)
+            for file, path in files.items():
+                self._stage_file(path, join(sandbox, f'{schedule}.sch' if file == 'spinup.sch' else file))
+        else:
+            for file in [*input_files, f'{schedule}.sch']:
+                self._stage_file(join(folder_path, file), sandbox)
+            if extension:
+                bin_file = f'{extension}.bin'
+                bin_path = join(folder_path, bin_file)
+                # Copy if DayCent will write to the extension file
+                self._stage_file(bin_path if isfile(bin_path) else join(self.workspace_path, bin_file),
+                                 sandbox, link=extension!=schedule)
+
+        cache = self.cache
+        if cache is None: return
+        # Schedule and extension files are named by what they are in the cache
+        # so that sites with identical inputs share the runs
+        if self.spinup:
+            names = {f'{schedule}.sch': 'spinup.sch', f'{schedule}.bin': 'spinup.bin'}
+            exes, args = (dc_path,), ('spinup',)
+        else:
+            names = {f'{schedule}.sch': 'schedule.sch', f'{schedule}.lis': 'schedule.lis',
+                     f'{schedule}.bin': 'schedule.bin'}
+            if extension: names[f'{extension}.bin'] = 'extension.bin'
+            exes, args = (dc_path, dclist_path), (bool(extension),)
+        files = {names.get(i, i): i for i in os.listdir(sandbox)}
+        commands = [get_command(i, self.workspace_path) for i in exes]
+        self._key = cache.get_key(sandbox, files, commands, args)
+        self._cached_files = {names.get(i, i): i for i in self.run_files}
+        self.cached = cached = cache.restore(self._key, sandbox, self._cached_files)
+        if cached:
+            run = 'Spin-up' if self.spinup else 'DayCent outputs'
+            name = schedule if schedule == folder else f'{schedule} ({folder})'
+            print(f'\n{run} of {name} restored from the cache.')
+
+    def finish(self):
+        '''
+        Save the outputs to the cache, post-process and save the results
+        and outputs to the site folder, return the processed outputs
+        (or the path to the binary output for spin-ups).
+        '''
+        sandbox, folder_path = self.sandbox, self.folder_path
+        if self.cache is not None and not self.cached:
+            self.cache.store(self._key, sandbox, self._cached_files)
+        if self.spinup:
+            bin_path = join(folder_path, f'{self.schedule}.bin')
+            self._move_file(join(sandbox, f'{self.schedule}.bin'), bin_path)
+            self.report_io()
+            return bin_path
+
+        inputs = read_user_inputs(folder_path)
+        outputs = update_results(inputs, self.schedule, path=sandbox)
 
         # Save results and move back to the respective folder
-        data_writer = pd.ExcelWriter(join(folder_path, 'user_data.xlsx'))
-        inputs.to_excel(data_writer, sheet_name='inputs')
-        outputs.to_excel(data_writer, sheet_name='outputs')
-        data_writer.save()
+        write_user_outputs(outputs, folder_path)
+        if export_excel: export_user_data(folder_path)
+
+        for file in self.run_files:
+            self._move_file(join(sandbox, file), join(folder_path, file))
+            # Parsed copies are moved after the outputs so that they stay up-to-date
+            parsed_file = get_parsed_path(file)
+            if isfile(join(sandbox, parsed_file)):
+                self._move_file(join(sandbox, parsed_file), join(folder_path, parsed_file))
+        self.report_io()
+        return outputs
 
-        for file in [*output_files, f'{folder}.lis', f'{folder}.bin']:
-            mv(join(workspace_path, file), folder_path)
+    def close(self):
+        '''Remove the temporary directory.'''
+        if self.sandbox: shutil.rmtree(self.sandbox, ignore_errors=True)
 
+
+def run_site(workspace_path, folder, extension='', schedule='', cache=None):
+    '''
+    Run DayCent for one site in its own temporary directory in the workspace
+    and save the outputs and the processed outputs to the site folder,
+    see :class:`SiteRun` for the parameters.
+    '''
+    run = SiteRun(workspace_path, folder, extension, schedule, cache)
+    try:
+        run.stage()
+        if not run.cached: run_DayCent(**run.DayCent_kwargs)
+        return run.finish()
+    finally:
         # Remove used files
-        for file in [*input_files, f'{folder}.sch']:
-            rm(join(workspace_path, file))
+        run.close()
 
-    print('\nDayCent run finished, calculating feedstock carbon intensity...')
 
-    for folder in folders:
+def process_site(workspace_path, folder, schedule=''):
+    '''
+    Post-process the DayCent outputs in the site folder again (e.g., after
+    changing the factors in the settings) and save the processed outputs,
+    return the processed outputs.
+    '''
+    folder_path = join(workspace_path, folder)
+    inputs = read_user_inputs(folder_path)
+    outputs = update_results(inputs, schedule or folder, path=folder_path)
+    write_user_outputs(outputs, folder_path)
+    if export_excel: export_user_data(folder_path)
+    return outputs
+
+
+def read_manifest(manifest_path):
+    '''
+    Read the sites to run from a manifest file, return the path to the workspace
+    and the sites (as dicts with "folder", "schedule", and "extension").
+
+    The manifest can be a CSV file with a "folder" column and optional
+    "schedule" and "extension" columns (the workspace is the directory
+    of the manifest), e.g.,
+
+        folder,schedule,extension
+        site1,,
+        site2,site2_rotation,spinup
+
+    or a JSON file with the workspace (relative to the manifest),
+    a default extension, and the sites (names of folders or dicts), e.g.,
+
+        {"workspace": ".", "extension": "",
+         "sites": ["site1", {"folder": "site2", "schedule": "site2_rotation", "extension": "spinup"}]}
+
+    Empty schedules default to the name of the folder and empty extensions
+    to the default extension (i.e., no extension for CSV manifests).
+
+    Sites can also have a "spinup" schedule (in the site folder or the workspace,
+    default to the "spinup" of JSON manifests) instead of an extension,
+    the spin-up will be run first and the schedule will be run as its extension,
+    see :func:`run_batch`.
+    '''
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    if manifest_path.lower().endswith('.json'):
+        with open(manifest_path, 'r') as file: manifest = json.load(file)
+        workspace_path = join(manifest_dir, manifest.get('workspace', '.'))
+        default_extension = manifest.get('extension', '')
+        default_spinup = manifest.get('spinup', '')
+        sites = [{'folder': i} if isinstance(i, str) else i for i in manifest['sites']]
+    else:
+        workspace_path = manifest_dir
+        default_extension = default_spinup = ''
+        sites = pd.read_csv(manifest_path, dtype=str).fillna('').to_dict('records')
+    sites = [{'folder': str(site['folder']).strip(),
+              'schedule': str(site.get('schedule') or '').strip() or str(site['folder']).strip(),
+              'extension': str(site.get('extension') or '').strip() or default_extension,
+              'spinup': str(site.get('spinup') or '').strip() or default_spinup}
+             for site in sites]
+    for site in sites:
+        if site['extension'] and site['spinup']:
+            raise ValueError(f'Site {site["folder"]} has both an extension and a spin-up, '
+                             'the schedule can only extend one of them.')
+    folders = [site['folder'] for site in sites]
+    duplicates = sorted({i for i in folders if folders.count(i) > 1})
+    if duplicates:
+        raise ValueError(f'Duplicate sites in {manifest_path}: {", ".join(duplicates)}.')
+    return os.path.normpath(workspace_path), sites
+
+
+class SiteJournal:
+    '''
+    Per-site states of a batch run, saved as an append-only JSON-lines file
+    (one line per state change, the last line of a site is its state)
+    so that an interrupted batch can be resumed.
+
+    Sites are "pending" until they are run, then "running", and finally
+    "done" or "failed". Sites found "running" when loading the journal
+    were interrupted and are reset to "pending".
+
+    Parameters
+    ----------
+    path: str
+        Path to the journal file, will be created if not exist.
+    sites: Iterable(str)
+        Names of the sites (folders) in the batch.
+    '''
+
+    states = ('pending', 'running', 'done', 'failed')
+
+    def __init__(self, path, sites=()):
+        self.path = path
+        self._lock = threading.Lock()
+        self.records = records = {}
+        if isfile(path):
+            with open(path, 'r') as file: lines = file.read()
+            for line in lines.splitlines():
+                line = line.strip()
+                if not line: continue
+                try: record = json.loads(line)
+                except json.JSONDecodeError: continue # partially written line
+                records[record['site']] = record
+            # End the partially written line so that new records start on a new line
+            if lines and not lines.endswith('\n'):
+                with open(path, 'a') as file: file.write('\n')
+        for site, record in records.items():
+            if record['state'] == 'running':
+                print(f'\n{site} was interrupted in a previous run, will be rerun.')
+                record['state'] = 'pending'
+        for site in sites:
+            if site not in records: records[site] = {'site': site, 'state': 'pending'}
+
+    def __repr__(self):
+        counts = ', '.join(f'{len(self.get_sites(i))} {i}' for i in self.states)
+        return f'<{type(self).__name__}: {counts}>'
+
+    def __getitem__(self, site):
+        return self.records[site]['state']
+
+    def set_state(self, site, state, **info):
+        '''Update and save the state of the site, `info` will be saved with the state.'''
+        if state not in self.states:
+            raise ValueError(f'State "{state}" not in {self.states}.')
+        record = {'site': site, 'state': state, 'time': time.strftime('%Y-%m-%d %H:%M:%S'), **info}
+        with self._lock:
+            self.records[site] = record
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(record) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+
+    def get_sites(self, state):
+        '''Names of the sites in the given state.'''
+        return [site for site, record in self.records.items() if record['state'] == state]
+
+
+def calc_site_CI(workspace_path, folder):
+    '''Calculate the feedstock carbon intensities of a site that has been run.'''
+    folder_path = join(workspace_path, folder)
+    if use_excel_FDCIC:
         # Copy the feedstock carbon intensity calculator (FD-CIC) to the folder and rename
         org_fdcic_path = join(_connector_path, 'FD-CIC_2021_dynamic.xlsm')
         new_fdcic_path = join(folder_path, f'{folder}.xlsm')
         cp(org_fdcic_path, new_fdcic_path)
-
-        # Run FD-CIC
-        folder_path = join(workspace_path, folder)
-        data_path = join(folder, 'user_data.xlsx')
+        data_path = export_user_data(folder_path)
         run_FDCIC(data_path=data_path, fdcic_path=new_fdcic_path)
-        print(f'\nFinished calculating carbon intensity for {folder}')
+    else:
+        run_FDCIC_native(join(folder_path, outputs_csv), join(folder_path, f'{folder}_CI.csv'))
+    print(f'\nFinished calculating carbon intensity for {folder}')
+
+
+def get_spinup_files(workspace_path, folder, spinup):
+    '''
+    Input files of the spin-up run of the site (as a dict of the names used in
+    :class:`RunCache` to the paths), the spin-up schedule is looked up
+    in the site folder then the workspace.
+    '''
+    folder_path = join(workspace_path, folder)
+    files = {i: join(folder_path, i) for i in input_files}
+    sch_path = join(folder_path, f'{spinup}.sch')
+    files['spinup.sch'] = sch_path if isfile(sch_path) else join(workspace_path, f'{spinup}.sch')
+    return files
+
+
+def get_spinup_key(workspace_path, folder, spinup):
+    '''Key of the spin-up run of the site, sites with the same key share the spin-up.'''
+    files = get_spinup_files(workspace_path, folder, spinup)
+    return RunCache.get_key('', files, [get_command(dc_path, workspace_path)], ('spinup',))
+
+
+def run_spinup(workspace_path, folder, spinup, cache=None):
+    '''
+    Run the spin-up schedule of the site (DayCent only, without list100)
+    in a temporary directory and save the binary output `<spinup>.bin`
+    to the site folder so that it can be extended.
+
+    Parameters
+    ----------
+    workspace_path: str
+        Path to the workspace containing the DayCent executables and site folders.
+    folder: str
+        Name of the site folder.
+    spinup: str
+        Name of the spin-up schedule file (without .sch).
+    cache: :class:`RunCache`
+        If given, the binary output will be restored from the cache
+        if the same spin-up has been run, or saved to the cache after the run.
+    '''
+    run = SiteRun(workspace_path, folder, schedule=spinup, cache=cache, spinup=True)
+    try:
+        run.stage()
+        if not run.cached: run_DayCent(**run.DayCent_kwargs)
+        return run.finish()
+    finally:
+        run.close()
+
+
+def fail_site(journal, folder, error):
+    '''Record the failure of the site in the journal.'''
+    journal.set_state(folder, 'failed', error=f'{type(error).__name__}: {error}')
+    print(f'\nRun failed for {folder}: {error}')
+
+
+def prepare_batch(workspace_path, sites, journal_path=None, retry_failed=True):
+    '''
+    Load the journal of the batch, clean up the sites to run,
+    and group the sites with spin-ups by their spin-up inputs,
+    see :func:`run_batch` for the parameters.
+
+    Returns
+    -------
+    sites: dict
+        Sites by their folders.
+    journal: :class:`SiteJournal`
+        Journal with the states of all sites.
+    to_run: list(str)
+        Folders of the sites to run.
+    spinups: dict
+        Folders of the sites sharing the same spin-up, by the keys of the spin-ups.
+    cache: :class:`RunCache`
+        Cache of the runs, None if not used.
+    '''
+    if not os.path.isdir(workspace_path):
+        raise FileNotFoundError(f'Workspace {workspace_path} does not exist.')
+    sites = {site['folder']: site for site in sites}
+    journal = SiteJournal(journal_path or join(workspace_path, 'journal.jsonl'), sites)
+    skipped = [i for i in sites if journal[i] == 'done']
+    to_run = [i for i in sites if journal[i] == 'pending' or
+              (retry_failed and journal[i] == 'failed')]
+    if skipped:
+        print(f'\nSkipping {len(skipped)} site(s) that are done, {len(to_run)} to run.')
+    cleanup_files(workspace_path, [sites[i] for i in to_run])
+    cache = RunCache(join(workspace_path, cache_dir)) if cache_dir else None
+
+    spinups, failed = {}, set()
+    for folder in to_run:
+        spinup = sites[folder].get('spinup')
+        if not spinup: continue
+        try: key = get_spinup_key(workspace_path, folder, spinup)
+        except Exception as error:
+            fail_site(journal, folder, error)
+            failed.add(folder)
+        else: spinups.setdefault(key, []).append(folder)
+    to_run = [i for i in to_run if i not in failed]
+    if spinups:
+        print(f'\nRunning {len(spinups)} unique spin-up(s) for '
+              f'{sum(len(i) for i in spinups.values())} site(s)...')
+    return sites, journal, to_run, spinups, cache
+
+
+def share_spinup(workspace_path, sites, folders, bin_path):
+    '''Copy the binary output of the spin-up to the other sites sharing it.'''
+    for folder in folders[1:]:
+        link_or_copy(bin_path, join(workspace_path, folder, f'{sites[folder]["spinup"]}.bin'),
+                     symlink=False)
+
+
+def run_batch(workspace_path, sites, journal_path=None, max_workers=None, retry_failed=True):
+    '''
+    Run DayCent and calculate carbon intensities for the sites in parallel,
+    site states are saved in a :class:`SiteJournal` so that the batch
+    can be resumed, sites that are done will not be rerun.
+
+    Sites with spin-ups are run in two phases: the spin-ups are run first,
+    once for all sites with identical spin-up inputs (schedule, parameter,
+    soil, and weather files), then the schedules of the sites are run
+    as extensions of the spin-ups.
+
+    Parameters
+    ----------
+    workspace_path: str
+        Path to the workspace containing the DayCent executables and site folders.
+    sites: Iterable(dict)
+        Sites to run, with "folder", and optional "schedule", "extension",
+        and "spinup" (see :func:`read_manifest`).
+    journal_path: str
+        Path to the journal file, default to journal.jsonl in the workspace.
+    max_workers: int
+        Maximum number of sites running at the same time, default to the number of CPUs.
+    retry_failed: bool
+        Whether to rerun sites that failed in previous runs.
+
+    Returns
+    -------
+    journal: :class:`SiteJournal`
+        Journal with the states of all sites.
+    '''
+    sites, journal, to_run, spinups, cache = prepare_batch(
+        workspace_path, sites, journal_path, retry_failed)
+    max_workers = max_workers or os.cpu_count()
+
+    # Phase 1: run each unique spin-up once
+    spinup_failed = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_spinup, workspace_path, folders[0],
+                                   sites[folders[0]]['spinup'], cache): folders
+                   for folders in spinups.values()}
+        for folders in futures.values():
+            for folder in folders: journal.set_state(folder, 'running')
+        for future in as_completed(futures):
+            folders = futures[future]
+            try: share_spinup(workspace_path, sites, folders, future.result())
+            except Exception as error:
+                for folder in folders: fail_site(journal, folder, error)
+                spinup_failed.update(folders)
+    # Only drop the sites failed by this run's spin-ups,
+    # sites failed in previous runs are in `to_run` to be retried
+    to_run = [i for i in to_run if i not in spinup_failed]
+
+    # Phase 2: run the schedules (as extensions of the spin-ups)
+    def run(folder):
+        site = sites[folder]
+        journal.set_state(folder, 'running')
+        return run_site(workspace_path, folder, site.get('spinup') or site.get('extension', ''),
+                        site.get('schedule', ''), cache)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run, folder): folder for folder in to_run}
+        for future in as_completed(futures):
+            folder = futures[future]
+            try:
+                future.result()
+                # In the main thread as the Excel FD-CIC cannot be run in parallel
+                calc_site_CI(workspace_path, folder)
+            except Exception as error: fail_site(journal, folder, error)
+            else:
+                journal.set_state(folder, 'done')
+    if cache is not None: cache.report()
+    return journal
+
+
+def run_manifest(manifest_path, journal_path=None, max_workers=None, retry_failed=True):
+    '''
+    Run the sites listed in the manifest (see :func:`read_manifest`) with
+    :func:`run_batch`, the journal defaults to <manifest name>.journal.jsonl
+    next to the manifest so rerunning the same manifest resumes the batch.
+    '''
+    workspace_path, sites = read_manifest(manifest_path)
+    journal_path = journal_path or f'{os.path.splitext(manifest_path)[0]}.journal.jsonl'
+    return run_batch(workspace_path, sites, journal_path, max_workers, retry_failed)
+
+
+def run_DayCent_connector(manifest_path='', max_workers=None):
+    '''
+    Execute DayCent-related functions.
+
+    Parameters
+    ----------
+    manifest_path: str
+        Path to the manifest of the sites (see :func:`read_manifest`),
+        will ask for the workspace, extension, and sites if not given.
+    max_workers: int
+        Maximum number of sites running at the same time, default to the number of CPUs.
+    '''
+    if manifest_path:
+        if use_asyncio:
+            from ._async import run_manifest_async
+            journal = run_manifest_async(manifest_path, max_concurrency=max_workers)
+        else: journal = run_manifest(manifest_path, max_workers=max_workers)
+    else:
+        # Navigate to workspace
+        workspace_path = input("Path to workspace: ")
+        # Check the path now so that if there's a problem with the path,
+        # the user will receive the error early
+        if not os.path.isdir(workspace_path):
+            raise FileNotFoundError(f'Workspace {workspace_path} does not exist.')
+
+        #!!! Maybe should consider extension for different folders as well?
+        extend = input("Are you extending a file? (y or n) : ")
+        if extend == 'y':
+            extension = input('Input file running DayCent extension with. '
+                              ' Do not include the .bin extension')
+        else:
+            extension = ''
+
+        folders = []
+        first = input('Folder name: ')
+        folders = [first]
+        addfolder = input('Would you like to add another folder? y or n: ')
+        while addfolder == 'y':
+            new = input('Folder name: ')
+            folders.append(new)
+            addfolder = input('Would you like to add another folder? y or n: ')
+
+        # Interactive runs always start over
+        journal_path = join(workspace_path, 'journal.jsonl')
+        if isfile(journal_path): rm(journal_path)
+        sites = [{'folder': i, 'extension': extension} for i in folders]
+        journal = run_batch(workspace_path, sites, journal_path, max_workers)
 
-    print('\nAll runs completed!')
\ No newline at end of file
+    failed = journal.get_sites('failed')
+    if failed: print(f'\nRuns completed, failed sites: {", ".join(failed)}.')
+    else: print('\nAll runs completed!')
+    return journal
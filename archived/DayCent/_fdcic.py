@@ -5,13 +5,174 @@ Created on Wed Nov 10 09:49:03 2021
 @author: Yalin Li
 """
 
-import pandas as pd, xlwings as xw
+import os
+import numpy as np, pandas as pd
+from BioSTEAMconnectors import CornInputs, SorghumInputs, FDCIC
+from ._user_data import read_table
 # from math import floor, ceil
 # from matplotlib import pyplot as plt
 
-__all__ = ('run_FDCIC',)
+__all__ = ('DayCentFDCIC', 'calc_FDCIC', 'run_FDCIC', 'run_FDCIC_native',)
 
 
+# %%
+
+# =============================================================================
+# Settings that can be updated
+# =============================================================================
+
+# Inputs of the crops (by `CROP_type` in user_data.xlsx) that can be calculated
+# by the native FD-CIC, functional units must match the DayCent yields (bu/ac),
+# carbon intensities of other crops will be NaN
+crop_inputs = {
+    'corn': CornInputs,
+    'sorghum': SorghumInputs,
+    }
+
+# Columns of farming inputs in user_data.xlsx and the corresponding FD-CIC inputs
+# (the crop name will be filled in), fertilizers are simulated in DayCent
+# so empty cells are taken as 0, other empty cells will use FD-CIC defaults
+fertilizer_columns = {
+    'Ammonia': 'Ammonia_{}Farming_val',
+    'Urea': 'Urea_{}Farming_val',
+    'UAN': 'UAN_{}Farming_val',
+    'MAP': 'MAP_{}Farming_asPfert_val',
+    'DAP': 'DAP_{}Farming_asPfert_val',
+    }
+other_columns = {
+    'K2O': 'K2O_{}Farming_val',
+    'Lime': 'CaCO3_{}Farming_val',
+    'Herbicide': 'HerbicideUse_{}Farming_val',
+    'Insecticide': 'InsecticideUse_{}Farming_val',
+    }
+# Fertilizers not tracked in user_data.xlsx
+untracked_fertilizers = (
+    'AN_{}Farming_val',
+    'AS_{}Farming_val',
+    'MAP_{}Farming_asNfert_val',
+    'DAP_{}Farming_asNfert_val',
+    )
+
+
+# %%
+
+# =============================================================================
+# Native (in Python) FD-CIC
+# =============================================================================
+
+class DayCentFDCIC(FDCIC):
+    '''
+    FD-CIC with field emissions simulated by DayCent, N2O and CH4 emissions
+    are taken from the DayCent results instead of the emission factors.
+
+    All DayCent results can be arrays (one value per site-year).
+
+    Parameters
+    ----------
+    crop_inputs : :class:`CropInputs`
+        Object containing crop inputs.
+    N2O_direct : float|Iterable(float)
+        Direct N2O emission, in g CO2e/`DayCentFDCIC.GHG_functional_unit`.
+    N2O_indirect : float|Iterable(float)
+        Indirect N2O emission from leached and volatilized N,
+        in g CO2e/`DayCentFDCIC.GHG_functional_unit`.
+    CH4_emission : float|Iterable(float)
+        Net CH4 emission, in g CO2e/`DayCentFDCIC.GHG_functional_unit`.
+    '''
+
+    def __init__(self, crop_inputs, N2O_direct=0, N2O_indirect=0, CH4_emission=0):
+        FDCIC.__init__(self, crop_inputs)
+        self.N2O_direct = N2O_direct
+        self.N2O_indirect = N2O_indirect
+        self.CH4_emission = CH4_emission
+
+    @property
+    def N2O_Fert_and_Res_GHG(self):
+        '''Direct and indirect N2O emission from DayCent, in g GHG per `FDCIC.GHG_functional_unit`.'''
+        return self.N2O_direct + self.N2O_indirect
+
+    @property
+    def CH4_GHG(self):
+        '''Net CH4 emission from DayCent, in g GHG per `FDCIC.GHG_functional_unit`.'''
+        return self.CH4_emission
+
+    # SOC needs to be the last one
+    _GHG_items = [*FDCIC._GHG_items[:-1], 'CH4_GHG', 'SOC_GHG']
+
+
+def calc_FDCIC(outputs):
+    '''
+    Calculate the feedstock carbon intensities of all site-years
+    from the processed DayCent outputs in batch using :class:`DayCentFDCIC`.
+
+    Parameters
+    ----------
+    outputs : :class:`pandas.DataFrame`
+        Processed DayCent outputs (see :func:`read_user_outputs`),
+        with the names of the variables as the columns.
+
+    Returns
+    -------
+    results : :class:`pandas.DataFrame`
+        GHG breakdown and the carbon intensities (with and without SOC)
+        in g CO2e/bu, in the same order as `outputs`.
+    '''
+    items = DayCentFDCIC._GHG_items
+    CI_columns = ['CI without SOC', 'CI with SOC']
+    results = np.full((outputs.shape[0], len(items)+2), np.nan)
+    crop_types = outputs.CROP_type.astype(str).str.lower()
+    for crop_type, index in crop_types.groupby(crop_types, sort=False).indices.items():
+        if crop_type not in crop_inputs:
+            print(f'\nNo FD-CIC inputs for {crop_type}, carbon intensity not calculated.')
+            continue
+        df = outputs.iloc[index]
+        inputs = crop_inputs[crop_type]()
+        inputs.Yield_TS = df.Yield.values.astype('float64')
+        fdcic = DayCentFDCIC(inputs,
+                             N2O_direct=df.N2O_FLUX.values.astype('float64'),
+                             N2O_indirect=df.N_leaching.values.astype('float64'),
+                             CH4_emission=df.CH4_FLUX.values.astype('float64'))
+        fdcic.SOC_emission = df.SOC.values.astype('float64') # kg C/ha
+        crop = fdcic.crop
+        for name in untracked_fertilizers:
+            setattr(fdcic, name.format(crop), 0)
+        for column, name in (*fertilizer_columns.items(), *other_columns.items()):
+            if column not in df: continue
+            default = 0 if column in fertilizer_columns else getattr(fdcic, name.format(crop))
+            setattr(fdcic, name.format(crop), df[column].astype('float64').fillna(default).values)
+        N = index.size
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = np.array([np.broadcast_to(getattr(fdcic, item), N) for item in items])
+        results[index, :-2] = values.T
+        # Missing items (e.g., years not simulated) are skipped as in `FDCIC.GHG_table`
+        results[index, -2] = np.nansum(values[:-1], axis=0)
+        results[index, -1] = np.nansum(values, axis=0)
+    return pd.DataFrame(results, index=outputs.index, columns=[*items, *CI_columns])
+
+
+def run_FDCIC_native(data_path, output_path=None):
+    '''
+    Calculate the feedstock carbon intensities from the processed DayCent outputs
+    (user_data_outputs.csv, or the "outputs" sheet of user_data.xlsx) without Excel,
+    the processed outputs and the results will be saved to `output_path`
+    (default to FDCIC_results.csv in the same folder as `data_path`).
+    '''
+    if data_path.lower().endswith('.csv'): data = read_table(data_path, multiindex=False)
+    else:
+        data = pd.read_excel(data_path, sheet_name='outputs', header=[0, 1, 2], index_col=0)
+        data.columns = data.columns.get_level_values(1)
+    results = calc_FDCIC(data)
+    output_path = output_path or os.path.join(os.path.dirname(data_path), 'FDCIC_results.csv')
+    pd.concat([data, results], axis=1).to_csv(output_path)
+    return results
+
+
+# %%
+
+# =============================================================================
+# FD-CIC in Excel
+# =============================================================================
+
 def num_to_col(num):
     '''Convert number to Excel column letters'''
     col = ''
@@ -22,6 +183,11 @@ def num_to_col(num):
 
 
 def run_FDCIC(data_path, fdcic_path):
+    '''
+    Calculate the feedstock carbon intensities through the macro
+    in the Excel FD-CIC (requires Excel and xlwings).
+    '''
+    import xlwings as xw
     # Copy data from the processed DayCent outputs to FD-CICd
     data = pd.read_excel(data_path, sheet_name='outputs', index_col=0)
     letter = num_to_col(data.shape[1]+1) # +1 for the index column
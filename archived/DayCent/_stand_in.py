@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in of DayCent and list100 for running, testing, and benchmarking
+the connector without the DayCent executables (e.g., on Linux).
+
+Outputs have the columns of the outputs of DayCent-CABBI and
+realistic sizes and values, they are deterministic: values are drawn from
+a random number generator seeded by the contents of the schedule
+(and extension) files, so identical inputs always give identical outputs.
+
+Usage (same arguments as DayCent and list100):
+    python _stand_in.py DayCent -s <schedule> -n <output> [-e <extension>]
+    python _stand_in.py list100 <binary> <lis> outvars.txt
+
+Outputs can also be generated without starting processes
+with :func:`simulate` and :func:`list100`, and workspaces of sites
+(e.g., for tests and benchmarks) can be made with :func:`make_workspace`.
+
+Schedules containing `STAND_IN_FAIL` make DayCent fail (exit code 1)
+and list100 fails if the binary output is incomplete.
+
+Behaviors can be changed through environment variables:
+    STAND_IN_DELAY: seconds to wait before writing the outputs, default 0
+    STAND_IN_EXIT_CODE: exit code of DayCent, default 0
+    STAND_IN_PID_FILE: file (relative to the working directory) to write
+        the process ID to when started, not written by default
+    STAND_IN_BIN_LAG: seconds that the binary output is still being written
+        (by another process) after DayCent has exited, default 0
+    STAND_IN_YEARS: number of simulated years, default 10
+    STAND_IN_EXTRA_COLUMNS: number of additional columns in each CSV output
+        (to mimic outputs with more variables), default 0
+    STAND_IN_BIN_SIZE: bytes of the binary output per simulated year, default 4096
+"""
+
+import os, sys, time, struct, random, zlib, argparse, subprocess
+
+start_year = 2000
+join = os.path.join
+
+# Binary outputs start with a header of the first year, number of years, and seed,
+# and end with the trailer (i.e., they are incomplete without it)
+bin_magic = b'STANDIN1'
+bin_header = struct.Struct('<iiI')
+bin_trailer = b'STANDEND'
+fail_marker = b'STAND_IN_FAIL'
+
+harvest_columns = (
+    'time', 'dayofyr', 'crpval', 'agcacc', 'bgcacc', 'cgrain',
+    'egrain(N)', 'egrain(P)', 'egrain(S)', 'crmvst', 'ermvst(N)', 'ermvst(P)', 'ermvst(S)',
+    'cstraw', 'estraw(N)', 'estraw(P)', 'estraw(S)', 'stdstraw',
+    'addsdc', 'resid', 'irrapp', 'fertapp(N)', 'fertapp(P)', 'fertapp(S)', 'omadapp',
+    *(f'strmac({i})' for i in range(1, 9)),
+    'cgracc', 'egracc(N)', 'egracc(P)', 'egracc(S)',
+    )
+year_summary_columns = ('time', 'N2Oflux', 'NOflux', 'N2flux', 'CH4_oxid', 'NIT', 'ANNPPT')
+methane_columns = (
+    'time', 'dayofyr', 'aglivc', 'bglivcj', 'bglivcm',
+    'prev_mcprd1', 'prev_mcprd2', 'prev_mcprd3', 'COM', 'ppt', 'irri',
+    'watr2sat', 'avgst_10cm', 'TI', 'Cr', 'Eh', 'Feh',
+    'CH4_prod', 'CH4_Ep', 'CH4_Ebl', 'CH4_oxid',
+    )
+# Other CSV outputs listed in outfiles.in, only with the time
+other_outputs = ('co2.csv', 'nflux.csv', 'potcrp.csv', 'potfor.csv', 'potgt.csv',
+                 'resp.csv', 'summary.csv')
+# Variables in the .lis output needed by the connector
+lis_columns = ('somtc', 'strmac(2)', 'volpac')
+
+# Ranges of the values used by the connector, other variables are in [0, 100)
+ranges = {
+    'cgrain': (300, 600),
+    'crmvst': (0, 100),
+    'strmac(2)': (0.1, 0.3),
+    'fertapp(N)': (10, 20),
+    'fertapp(P)': (1, 3),
+    'N2Oflux': (0.05, 0.5),
+    'NOflux': (0.02, 0.1),
+    'CH4_prod': (0, 0.002),
+    'CH4_oxid': (0, 0.004),
+    }
+
+
+def get_setting(name, default):
+    return type(default)(os.environ.get(f'STAND_IN_{name}', default))
+
+
+def get_seed(*paths):
+    '''Seed from the contents of the files.'''
+    seed = 0
+    for path in paths:
+        with open(path, 'rb') as file: seed = zlib.crc32(file.read(), seed)
+    return seed
+
+
+def read_bin(path):
+    '''First year, number of years, and seed of the binary output.'''
+    with open(path, 'rb') as file:
+        header = file.read(len(bin_magic)+bin_header.size)
+        file.seek(max(0, os.path.getsize(path)-len(bin_trailer)))
+        trailer = file.read()
+    if not header.startswith(bin_magic):
+        raise ValueError(f'{path} is not a binary output of the stand-in.')
+    if trailer != bin_trailer:
+        raise ValueError(f'{path} is incomplete.')
+    return bin_header.unpack(header[len(bin_magic):])
+
+
+def write_bin_later(path, content, lag, interval=0.02):
+    '''Append the content to the file in chunks over `lag` seconds.'''
+    chunks = max(1, int(lag/interval))
+    size = -(-len(content)//chunks)
+    for i in range(0, len(content), size):
+        time.sleep(interval)
+        with open(path, 'ab') as file: file.write(content[i:i+size])
+
+
+def write_csv(path, header, rows):
+    with open(path, 'w') as file:
+        file.write(','.join(header) + '\n')
+        file.writelines(f'{row[0]:.4f}' + ''.join(map(',{:.6g}'.format, row[1:])) + '\n'
+                        for row in rows)
+
+
+def _get_values(rng, columns):
+    uniform = rng.uniform
+    return [uniform(*ranges.get(i, (0, 100))) for i in columns]
+
+
+def simulate(schedule, output, extension='', cwd='', years=None, extra_columns=None, bin_size=None):
+    '''
+    Write the outputs of DayCent in `cwd` (current directory if not given),
+    return the exit code.
+
+    Parameters
+    ----------
+    schedule: str
+        Name of the schedule file (without .sch).
+    output: str
+        Name of the binary output (without .bin).
+    extension: str
+        Name of the binary output to extend (without .bin),
+        the simulation starts after the last year of it.
+    years: int
+        Number of simulated years, default to STAND_IN_YEARS.
+    extra_columns: int
+        Number of additional columns in each CSV output, default to STAND_IN_EXTRA_COLUMNS.
+    bin_size: int
+        Bytes of the binary output per simulated year, default to STAND_IN_BIN_SIZE.
+    '''
+    files = [join(cwd, f'{schedule}.sch')]
+    if extension: files.append(join(cwd, f'{extension}.bin'))
+    for file in files:
+        if not os.path.isfile(file):
+            print(f'Cannot find {os.path.basename(file)}.')
+            return 1
+    with open(files[0], 'rb') as file:
+        if fail_marker in file.read():
+            print(f'Simulation of {schedule} failed ({fail_marker.decode()} in the schedule).')
+            return 1
+    years = get_setting('YEARS', 10) if years is None else years
+    extra_columns = get_setting('EXTRA_COLUMNS', 0) if extra_columns is None else extra_columns
+    bin_size = get_setting('BIN_SIZE', 4096) if bin_size is None else bin_size
+    first = start_year
+    if extension:
+        ext_first, ext_years, _ = read_bin(files[1])
+        first = ext_first + ext_years
+    seed = get_seed(*files)
+    rng = random.Random(seed)
+    extra = tuple(f'extra{i}' for i in range(extra_columns))
+
+    harvest, year_summary, methane = [], [], []
+    for year in range(first, first+years):
+        harvest.append([year, rng.randint(250, 300), *_get_values(rng, harvest_columns[2:]+extra)])
+        year_summary.append([year, *_get_values(rng, year_summary_columns[1:]+extra)])
+        for day in range(1, 366):
+            methane.append([year+(day-1)/365, day, *_get_values(rng, methane_columns[2:]+extra)])
+    write_csv(join(cwd, 'harvest.csv'), harvest_columns+extra, harvest)
+    write_csv(join(cwd, 'year_summary.csv'), year_summary_columns+extra, year_summary)
+    write_csv(join(cwd, 'methane.csv'), methane_columns+extra, methane)
+    for file in other_outputs:
+        write_csv(join(cwd, file), ('time',), [(year,) for year in range(first, first+years)])
+
+    header = bin_magic + bin_header.pack(first, years, seed)
+    content = header + bytes(max(0, years*bin_size-len(header)-len(bin_trailer))) + bin_trailer
+    bin_path = join(cwd, f'{output}.bin')
+    lag = get_setting('BIN_LAG', 0.)
+    if not lag:
+        with open(bin_path, 'wb') as file: file.write(content)
+        return 0
+    # Only the header is written before exiting, the rest is written by another process
+    with open(bin_path, 'wb') as file: file.write(header)
+    rest = bin_path + '.rest'
+    with open(rest, 'wb') as file: file.write(content[len(header):])
+    subprocess.Popen([sys.executable, __file__, 'write_bin', bin_path, rest, str(lag)],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, start_new_session=True)
+    return 0
+
+
+def list100(binary, lis, outvars='outvars.txt', cwd=''):
+    '''
+    Write the .lis output of the variables listed in `outvars`
+    (and the ones needed by the connector) in `cwd`, return the exit code.
+    '''
+    bin_path = join(cwd, f'{binary}.bin')
+    if not os.path.isfile(bin_path):
+        print(f'Cannot find {binary}.bin.')
+        return 1
+    try: first, years, seed = read_bin(bin_path)
+    except ValueError as error:
+        print(error)
+        return 1
+    columns = list(lis_columns)
+    outvars_path = join(cwd, outvars)
+    if os.path.isfile(outvars_path):
+        with open(outvars_path, 'r') as file:
+            columns.extend(i for i in file.read().split() if i not in columns)
+    rng = random.Random(seed+1)
+    uniform = rng.uniform
+    somtc = 5000.
+    with open(join(cwd, f'{lis}.lis'), 'w') as file:
+        file.write(''.join(f'{i:>14}' for i in ('time', *columns)) + '\n\n')
+        # Initial state, one line per year, then a dummy line
+        for year in range(first-1, first+years):
+            values = [somtc, uniform(0.3, 0.8), uniform(0.5, 2),
+                      *(uniform(0, 100) for i in columns[3:])]
+            file.write(''.join(f'{i:14.4f}' for i in (year, *values)) + '\n')
+            somtc += uniform(-30, 20)
+        file.write(''.join(f'{0:14.4f}' for i in range(len(columns)+1)) + '\n')
+    return 0
+
+
+def write_pid():
+    path = os.environ.get('STAND_IN_PID_FILE')
+    if path:
+        with open(path, 'w') as file: file.write(str(os.getpid()))
+
+
+def run_DayCent(argv):
+    write_pid()
+    parser = argparse.ArgumentParser(prog='DayCent')
+    parser.add_argument('-s', required=True)
+    parser.add_argument('-n', required=True)
+    parser.add_argument('-e', default='')
+    args = parser.parse_args(argv)
+    time.sleep(get_setting('DELAY', 0.))
+    exit_code = get_setting('EXIT_CODE', 0)
+    if exit_code: return exit_code
+    return simulate(args.s, args.n, args.e)
+
+
+def run_list100(argv):
+    if len(argv) != 3:
+        print('Usage: list100 <binary> <lis> <outvars>')
+        return 1
+    write_pid()
+    time.sleep(get_setting('DELAY', 0.))
+    return list100(*argv)
+
+
+
+# %%
+
+# =============================================================================
+# Workspaces for tests and benchmarks
+# =============================================================================
+
+# Sites with distinct DayCent outputs, outputs of the other sites are linked to them
+# so that large workspaces can be made quickly
+distinct_sites = 10
+
+
+def write_user_data(path, years, crops=('corn', 'soybean')):
+    '''Write user_data.xlsx of a site with a rotation of the crops (by `CROP_type`).'''
+    import pandas as pd
+    from . import _connector_path
+    template = pd.read_excel(join(_connector_path, 'user_data.xlsx'), sheet_name='inputs',
+                             header=[0,1,2], index_col=0)
+    columns = template.columns
+    inputs = pd.DataFrame(index=range(years), columns=columns)
+    inputs[columns[3]] = [crops[i%len(crops)] for i in range(years)]
+    with pd.ExcelWriter(path) as writer:
+        inputs.to_excel(writer, sheet_name='inputs')
+        inputs.to_excel(writer, sheet_name='outputs')
+    return path
+
+
+def make_workspace(path, n_sites, years=20, outputs=True, crops=('corn', 'soybean')):
+    '''
+    Make a workspace of `n_sites` sites (named "site0", "site1", ...) with
+    DayCent inputs and user_data.xlsx (with a rotation of `crops`),
+    return the names of the site folders. If `outputs` is True,
+    DayCent outputs are also saved in the site folders.
+    '''
+    import shutil
+    from ._cache import link_or_copy
+    from ._daycent import input_files, output_files
+    os.makedirs(path, exist_ok=True)
+    user_data = write_user_data(join(path, 'user_data.xlsx'), years, crops)
+    folders = [f'site{i}' for i in range(n_sites)]
+    for n, folder in enumerate(folders):
+        folder_path = join(path, folder)
+        os.makedirs(folder_path)
+        for file in input_files:
+            with open(join(folder_path, file), 'w') as f: f.write(f'{file} of {folder}\n')
+        with open(join(folder_path, 'outvars.txt'), 'w') as f:
+            f.write('\n'.join(lis_columns) + '\n')
+        with open(join(folder_path, f'{folder}.sch'), 'w') as f:
+            f.write(f'Schedule of {folder}\n')
+        shutil.copy(user_data, folder_path)
+        if not outputs: continue
+        if n < distinct_sites:
+            simulate(folder, folder, cwd=folder_path, years=years)
+            list100(folder, folder, cwd=folder_path)
+        else:
+            source = folders[n%distinct_sites]
+            files = {**{i: i for i in output_files},
+                     f'{source}.lis': f'{folder}.lis', f'{source}.bin': f'{folder}.bin'}
+            for file, name in files.items():
+                link_or_copy(join(path, source, file), join(folder_path, name), symlink=False)
+    return folders
+
+
+if __name__ == '__main__':
+    program, *argv = sys.argv[1:]
+    if program == 'write_bin':
+        path, rest, lag = argv
+        with open(rest, 'rb') as file: content = file.read()
+        os.remove(rest)
+        write_bin_later(path, content, float(lag))
+        sys.exit(0)
+    sys.exit(run_DayCent(argv) if program == 'DayCent' else run_list100(argv))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Yalin Li
+
+Storage of the connector's inputs and outputs (the "inputs" and "outputs"
+sheets of user_data.xlsx) as CSV files, the three-row header of the sheets
+(column number, variable name, and unit) and the dtypes are saved in
+a sidecar schema (.schema.json) so that the tables can be exported
+to Excel without loss.
+"""
+
+import os, json, threading
+import pandas as pd
+
+__all__ = (
+    'export_user_data',
+    'read_table',
+    'read_user_inputs',
+    'read_user_outputs',
+    'write_table',
+    'write_user_outputs',
+    )
+
+join = os.path.join
+
+user_data_xlsx = 'user_data.xlsx'
+inputs_csv = 'user_data_inputs.csv'
+outputs_csv = 'user_data_outputs.csv'
+
+
+def get_schema_path(csv_path):
+    '''Path to the schema of the table saved as CSV.'''
+    return f'{os.path.splitext(csv_path)[0]}.schema.json'
+
+
+def _to_json(value):
+    return value.item() if hasattr(value, 'item') else value
+
+
+def write_table(df, csv_path, **info):
+    '''
+    Save the table (with a MultiIndex header) as CSV with the variable names
+    (second level of the header) as the column names and the header and dtypes
+    in the schema, `info` will be saved in the schema as well.
+    '''
+    columns = df.columns
+    if isinstance(columns, pd.MultiIndex):
+        header = [[_to_json(i) for i in column] for column in columns]
+        names = columns.get_level_values(1)
+    else:
+        header = [[i, name, ''] for i, name in enumerate(columns)]
+        names = columns
+    schema = {'columns': header,
+              'dtypes': [str(i) for i in df.dtypes],
+              **info}
+    flat = df.copy(deep=False)
+    flat.columns = names
+    # Write to temporary files first so that the table can be read
+    # while being saved (e.g., by the watch mode)
+    schema_path = get_schema_path(csv_path)
+    suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+    flat.to_csv(csv_path+suffix, index=False)
+    with open(schema_path+suffix, 'w') as file:
+        json.dump(schema, file, indent=1)
+    os.replace(csv_path+suffix, csv_path)
+    os.replace(schema_path+suffix, schema_path)
+
+
+def read_schema(csv_path):
+    '''Schema of the table saved as CSV, None if not available.'''
+    schema_path = get_schema_path(csv_path)
+    if not os.path.isfile(schema_path): return None
+    with open(schema_path, 'r') as file: return json.load(file)
+
+
+def read_table(csv_path, multiindex=True, usecols=None):
+    '''
+    Read the table saved by :func:`write_table` with the dtypes in the schema,
+    the columns will be the MultiIndex header in the schema if `multiindex`
+    is True, otherwise the variable names; `usecols` can be used to only read
+    some of the columns (by variable names).
+    '''
+    schema = read_schema(csv_path)
+    names = [i[1] for i in schema['columns']]
+    dtypes = dict(zip(names, schema['dtypes']))
+    df = pd.read_csv(csv_path, usecols=usecols,
+                     dtype={k: v for k, v in dtypes.items()
+                            if (usecols is None or k in usecols) and v != 'object'})
+    # Values of object columns (e.g., numbers and text) are inferred,
+    # empty ones would be read as float
+    empty = [i for i in df.columns if dtypes[i] == 'object' and df[i].dtype != object]
+    if empty: df[empty] = df[empty].astype(object)
+    if multiindex:
+        header = {i[1]: tuple(i) for i in schema['columns']}
+        df.columns = pd.MultiIndex.from_tuples([header[i] for i in df.columns])
+    return df
+
+
+def read_user_inputs(folder_path, save=True):
+    '''
+    Read the "inputs" sheet of user_data.xlsx in the folder (with the three-row header),
+    the sheet is saved as CSV the first time it is read and the CSV is used
+    until user_data.xlsx is changed; nothing is saved if `save` is False
+    (e.g., when the folder is only being watched).
+    '''
+    xlsx_path = join(folder_path, user_data_xlsx)
+    csv_path = join(folder_path, inputs_csv)
+    stat = os.stat(xlsx_path)
+    source = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+    schema = read_schema(csv_path) if os.path.isfile(csv_path) else None
+    if schema and schema.get('source') == source: return read_table(csv_path)
+    inputs = pd.read_excel(xlsx_path, sheet_name='inputs',
+                           header=[0,1,2], index_col=0).reset_index(drop=True)
+    if save: write_table(inputs, csv_path, source=source)
+    return inputs
+
+
+def write_user_outputs(outputs, folder_path):
+    '''Save the processed DayCent outputs (with the three-row header) in the folder.'''
+    write_table(outputs, join(folder_path, outputs_csv))
+
+
+def read_user_outputs(folder_path, multiindex=False):
+    '''
+    Read the processed DayCent outputs in the folder,
+    the columns are the variable names unless `multiindex` is True.
+    '''
+    return read_table(join(folder_path, outputs_csv), multiindex=multiindex)
+
+
+def export_user_data(folder_path, xlsx_path=None):
+    '''
+    Export the inputs and processed outputs in the folder to Excel with
+    the "inputs" and "outputs" sheets (default to user_data.xlsx in the folder).
+    '''
+    xlsx_path = xlsx_path or join(folder_path, user_data_xlsx)
+    inputs = read_user_inputs(folder_path)
+    outputs = read_user_outputs(folder_path, multiindex=True)
+    with pd.ExcelWriter(xlsx_path) as data_writer:
+        inputs.to_excel(data_writer, sheet_name='inputs')
+        outputs.to_excel(data_writer, sheet_name='outputs')
+    # Inputs are not changed, update the source of the saved inputs
+    csv_path = join(folder_path, inputs_csv)
+    if xlsx_path == join(folder_path, user_data_xlsx):
+        stat = os.stat(xlsx_path)
+        write_table(inputs, csv_path, source={'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size})
+    return xlsx_path
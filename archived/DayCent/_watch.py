@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Yalin Li
+
+Watch mode of the DayCent connector, site folders are monitored while
+DayCent is running (by the connector or elsewhere, e.g., on a cluster),
+carbon intensities of each site are calculated as soon as its outputs
+are complete and appended to a results store that can be read
+while the campaign is still running (e.g., by dashboards).
+"""
+
+import os, time, hashlib
+import numpy as np, pandas as pd
+from ._fdcic import DayCentFDCIC, calc_FDCIC
+from ._user_data import read_user_inputs
+from ._daycent import output_columns, read_manifest, read_output, read_parsed, update_results
+
+__all__ = (
+    'ResultsStore',
+    'SiteWatcher',
+    'watch_manifest',
+    )
+
+join = os.path.join
+
+# Outputs used in post-processing, list100 writes the .lis after DayCent has written the others
+watched_outputs = ('harvest.csv', 'year_summary.csv', 'methane.csv')
+
+
+class ResultsStore:
+    '''
+    Carbon intensities of the sites as an append-only CSV file,
+    with one row per site-year and the columns:
+
+        site, source, finished, year, CROP_type, Yield, <GHG items>, CI without SOC, CI with SOC
+
+    where "source" identifies the DayCent outputs used (a site will have
+    more rows if its outputs are changed, e.g., rerun, the latest rows
+    of a site are the current results), "finished" is the time
+    (UTC, ISO format) when the results were added, and "year" is
+    the simulated year.
+
+    Rows of an interrupted append (i.e., the file ends with an incomplete row)
+    are removed when the store is loaded so that the site will be processed again.
+
+    Parameters
+    ----------
+    path : str
+        Path to the CSV file, will be created if not exist.
+    '''
+
+    columns = ['site', 'source', 'finished', 'year', 'CROP_type', 'Yield',
+               *DayCentFDCIC._GHG_items, 'CI without SOC', 'CI with SOC']
+
+    def __init__(self, path):
+        self.path = path
+        #: Source of the latest results of each site.
+        self.sources = {}
+        if not os.path.isfile(path) or not os.path.getsize(path):
+            with open(path, 'w') as file: file.write(','.join(self.columns) + '\n')
+            return
+        with open(path, 'rb+') as file:
+            content = file.read()
+            end = content.rfind(b'\n') + 1
+            partial = content[end:]
+            if partial:
+                # Remove the incomplete last row and the other rows of the interrupted append
+                # (rows of an append share the same site, source, and finished time)
+                header_end = content.find(b'\n') + 1
+                while end > header_end:
+                    start = content.rfind(b'\n', 0, end-1) + 1
+                    key = b','.join(content[start:end].split(b',', 3)[:3]) + b','
+                    if not (key.startswith(partial) or partial.startswith(key)): break
+                    end = start
+                file.truncate(end)
+        stored = pd.read_csv(path, usecols=['site', 'source'], dtype=str)
+        self.sources = dict(zip(stored.site, stored.source))
+
+    def __repr__(self):
+        return f'<{type(self).__name__}: {self.path}, {len(self.sources)} sites>'
+
+    def append(self, site, source, outputs, results, years):
+        '''
+        Append the results of a site.
+
+        Parameters
+        ----------
+        site : str
+            Name of the site.
+        source : str
+            Identifier of the DayCent outputs used.
+        outputs : :class:`pandas.DataFrame`
+            Processed DayCent outputs, with the names of the variables as the columns.
+        results : :class:`pandas.DataFrame`
+            Results of :func:`calc_FDCIC`.
+        years : Iterable(int)
+            Simulated years of the rows.
+        '''
+        df = pd.concat([outputs[['CROP_type', 'Yield']], results], axis=1)
+        df.insert(0, 'year', pd.array(years, dtype='Int64'))
+        df.insert(0, 'finished', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()))
+        df.insert(0, 'source', source)
+        df.insert(0, 'site', site)
+        with open(self.path, 'a') as file:
+            df.reindex(columns=self.columns).to_csv(file, header=False, index=False)
+            file.flush()
+            os.fsync(file.fileno())
+        self.sources[site] = source
+
+    def read(self, latest=True):
+        '''Read the results, only the latest results of each site if `latest` is True.'''
+        df = pd.read_csv(self.path, dtype={'site': str, 'source': str})
+        if latest:
+            latest_sources = df.groupby('site', sort=False).source.transform('last')
+            df = df[df.source == latest_sources].reset_index(drop=True)
+        return df
+
+
+class SiteWatcher:
+    '''
+    Monitor the site folders and calculate the carbon intensities of a site
+    with :func:`calc_FDCIC` once its DayCent outputs are complete,
+    the results are appended to a :class:`ResultsStore`.
+
+    Outputs of a site are complete when harvest.csv, year_summary.csv,
+    methane.csv, and <schedule>.lis all exist, the .lis is not older than
+    the others (list100 is run after DayCent), and none of them have changed
+    since the last check. Sites with results of the same outputs
+    in the store are not processed again.
+
+    Parameters
+    ----------
+    workspace_path : str
+        Path to the workspace containing the site folders.
+    sites : Iterable(str|dict)
+        Names of the site folders or sites (dicts with "folder" and optional
+        "schedule") as in :func:`read_manifest`.
+    store_path : str
+        Path to the results store, default to CI_results.csv in the workspace.
+
+    Examples
+    --------
+    >>> watcher = SiteWatcher('FakeCities', ['Hogwarts', 'Metropolis']) # doctest: +SKIP
+    >>> watcher.watch(interval=2) # doctest: +SKIP
+    >>> watcher.store.read() # doctest: +SKIP
+    '''
+
+    def __init__(self, workspace_path, sites, store_path=None):
+        self.workspace_path = workspace_path
+        sites = [{'folder': i} if isinstance(i, str) else i for i in sites]
+        #: Schedules of the sites.
+        self.schedules = {i['folder']: i.get('schedule') or i['folder'] for i in sites}
+        self.store = ResultsStore(store_path or join(workspace_path, 'CI_results.csv'))
+        #: Sources of the outputs that failed to be processed.
+        self.failed = {}
+        self._last_sources = {}
+
+    def __repr__(self):
+        return (f'<{type(self).__name__}: {len(self.get_pending())} of '
+                f'{len(self.schedules)} sites pending>')
+
+    def get_source(self, folder):
+        '''
+        Identifier of the DayCent outputs of the site (from the modification times
+        and sizes of the outputs), None if the outputs are not all there.
+        '''
+        folder_path = join(self.workspace_path, folder)
+        stats = []
+        for file in (*watched_outputs, f'{self.schedules[folder]}.lis'):
+            try: stat = os.stat(join(folder_path, file))
+            except FileNotFoundError: return None
+            stats.append((stat.st_mtime_ns, stat.st_size))
+        if stats[-1][0] < max(i[0] for i in stats[:-1]): return None # list100 not run yet
+        return hashlib.sha1(repr(stats).encode()).hexdigest()[:16]
+
+    def get_pending(self):
+        '''Sites without results of their current outputs.'''
+        pending = []
+        for folder in self.schedules:
+            source = self.get_source(folder)
+            if source is None or source not in (self.store.sources.get(folder),
+                                                self.failed.get(folder)):
+                pending.append(folder)
+        return pending
+
+    def process(self, folder, source):
+        '''
+        Calculate and save the carbon intensities of the site, return the results.
+        Nothing is written to the site folder other than the parsed copies
+        of the DayCent outputs (see :func:`read_parsed`).
+        '''
+        folder_path = join(self.workspace_path, folder)
+        inputs = read_user_inputs(folder_path, save=False)
+        outputs = update_results(inputs, self.schedules[folder], path=folder_path)
+        outputs.columns = outputs.columns.get_level_values(1)
+        results = calc_FDCIC(outputs)
+        # Rows of the outputs are the simulated years (in year_summary.csv)
+        year_summary = read_parsed(join(folder_path, 'year_summary.csv'),
+                                   output_columns['year_summary.csv'], read_output)
+        years = np.floor(year_summary.time.values[:outputs.shape[0]])
+        years = pd.Series(years).reindex(range(outputs.shape[0])) # years not simulated are empty
+        self.store.append(folder, source, outputs, results, years)
+        return results
+
+    def poll(self):
+        '''
+        Check all sites once and process the ones with complete outputs,
+        return the names of the processed sites.
+        '''
+        processed = []
+        for folder in self.schedules:
+            source = self.get_source(folder)
+            last_source, self._last_sources[folder] = self._last_sources.get(folder), source
+            if source is None or source != last_source: continue # not there or still changing
+            if source in (self.store.sources.get(folder), self.failed.get(folder)): continue
+            try: self.process(folder, source)
+            except Exception as error:
+                self.failed[folder] = source
+                print(f'\nFailed to calculate carbon intensity for {folder}: {error}')
+                continue
+            processed.append(folder)
+            print(f'\nCarbon intensity of {folder} added to {self.store.path}.')
+        return processed
+
+    def watch(self, interval=2, timeout=None):
+        '''
+        Check the sites every `interval` seconds until all sites are processed,
+        the time runs out (`timeout` in seconds), or interrupted (e.g., Ctrl+C),
+        return the names of the processed sites.
+        '''
+        start = time.time()
+        processed = []
+        print(f'\nWatching {len(self.schedules)} sites in {self.workspace_path}...')
+        try:
+            while True:
+                processed.extend(self.poll())
+                pending = self.get_pending()
+                if not pending: break
+                if timeout is not None and time.time()-start > timeout:
+                    print(f'\nStopped watching, {len(pending)} sites pending.')
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print('\nStopped watching.')
+        return processed
+
+
+def watch_manifest(manifest_path, store_path=None, interval=2, timeout=None):
+    '''
+    Watch the sites listed in the manifest (see :func:`read_manifest`)
+    with :class:`SiteWatcher`, the results store defaults to
+    `<manifest name>.results.csv`.
+    '''
+    workspace_path, sites = read_manifest(manifest_path)
+    store_path = store_path or f'{os.path.splitext(manifest_path)[0]}.results.csv'
+    watcher = SiteWatcher(workspace_path, sites, store_path)
+    watcher.watch(interval, timeout)
+    return watcher
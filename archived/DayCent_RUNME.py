@@ -3,10 +3,23 @@
 Created on Wed Nov 10 12:04:14 2021
 
 @author: Yalin Li
+
+Usage:
+    python DayCent_RUNME.py [manifest]
+    python DayCent_RUNME.py --watch manifest
+
+Sites will be asked for if the manifest (.csv or .json) is not given.
+With --watch, the sites in the manifest are monitored and their carbon
+intensities are calculated as soon as their DayCent outputs are complete.
 """
 
 import os
 path = os.path.dirname(__file__)
 os.sys.path.insert(0, path)
-from DayCent import run_DayCent_connector
-run_DayCent_connector()
\ No newline at end of file
+args = os.sys.argv[1:]
+if args[:1] == ['--watch']:
+    from DayCent import watch_manifest
+    watch_manifest(args[1])
+else:
+    from DayCent import run_DayCent_connector
+    run_DayCent_connector(*args[:1])
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmarks of the DayCent connector on synthetic workspaces of
+1, 100, and 1000 sites (see `conftest.py`), DayCent outputs are generated by
+the stand-in so that the benchmarks can be run without the DayCent executables.
+
+Throughput (sites/s) of each stage is saved in the `extra_info` of the results.
+Full batch runs start the stand-in DayCent and list100 as processes
+for each site, so the run of 1000 sites is skipped unless the environment
+variable BENCH_LARGE_BATCH is set (e.g., to "1").
+"""
+
+import os, pytest
+from archived.DayCent import _daycent
+from archived.DayCent._daycent import SiteRun, calc_site_CI, process_site, run_batch
+
+join = os.path.join
+
+site_numbers = (1, 100, 1000)
+large_batch = os.environ.get('BENCH_LARGE_BATCH', '') not in ('', '0')
+batch_site_numbers = (1, 100, pytest.param(1000, marks=pytest.mark.skipif(
+    not large_batch, reason='set BENCH_LARGE_BATCH to run the batch of 1000 sites')))
+years = 20
+
+
+def get_rounds(n_sites):
+    '''Fewer rounds for large workspaces to keep the time of each benchmark reasonable.'''
+    return max(1, min(20, 300//n_sites))
+
+
+@pytest.fixture
+def run_benchmark(benchmark, record_throughput):
+    '''Run the benchmark of all sites and record the throughput.'''
+    def run(n_sites, f, *args, **kwargs):
+        result = benchmark.pedantic(f, args, kwargs, rounds=get_rounds(n_sites), iterations=1)
+        record_throughput(n_sites, 'sites')
+        return result
+    return run
+
+
+@pytest.fixture(scope='module', params=site_numbers, ids=lambda n: f'{n}sites')
+def workspace(request, workspace_factory):
+    path, folders = workspace_factory(request.param, years)
+    # Processed outputs for the CI calculation
+    for folder in folders:
+        if not os.path.isfile(join(path, folder, 'user_data_outputs.csv')):
+            process_site(path, folder)
+    return path, folders
+
+
+def stage_sites(path, folders):
+    for folder in folders:
+        run = SiteRun(path, folder)
+        try: run.stage()
+        finally: run.close()
+
+
+def parse_sites(path, folders):
+    for folder in folders: process_site(path, folder)
+
+
+def calc_sites_CI(path, folders):
+    for folder in folders: calc_site_CI(path, folder)
+
+
+def bench_stage(run_benchmark, workspace):
+    path, folders = workspace
+    run_benchmark(len(folders), stage_sites, path, folders)
+
+
+@pytest.mark.parametrize('parsed', (False, True), ids=('raw', 'parsed'))
+def bench_parse(run_benchmark, monkeypatch, workspace, parsed):
+    '''Post-processing from the raw outputs or their parsed copies.'''
+    monkeypatch.setattr(_daycent, 'save_parsed_outputs', parsed)
+    path, folders = workspace
+    if parsed: parse_sites(path, folders) # save the parsed copies
+    run_benchmark(len(folders), parse_sites, path, folders)
+
+
+def bench_CI(run_benchmark, workspace):
+    path, folders = workspace
+    run_benchmark(len(folders), calc_sites_CI, path, folders)
+    assert os.path.isfile(join(path, folders[-1], f'{folders[-1]}_CI.csv'))
+
+
+@pytest.mark.parametrize('n_sites', batch_site_numbers, ids=lambda n: f'{n}sites')
+def bench_run_batch(benchmark, record_throughput, monkeypatch, workspace_factory, n_sites):
+    '''Staging, DayCent and list100 (stand-in), parsing, and CI calculation of all sites.'''
+    monkeypatch.setattr(_daycent, 'dc_path', _daycent.stand_in_paths[0])
+    monkeypatch.setattr(_daycent, 'dclist_path', _daycent.stand_in_paths[1])
+    monkeypatch.setattr(_daycent, 'cache_dir', '') # all sites are run in each round
+    monkeypatch.setenv('STAND_IN_YEARS', str(years))
+    path, folders = workspace_factory(n_sites, years, outputs=False)
+    sites = [{'folder': folder} for folder in folders]
+    journals = iter(range(1000))
+    def setup():
+        return (path, sites, join(path, f'journal_{next(journals)}.jsonl')), {}
+    benchmark.pedantic(run_batch, setup=setup, rounds=1 if n_sites > 10 else 3)
+    record_throughput(n_sites, 'sites')
+    assert all(os.path.isfile(join(path, i, f'{i}_CI.csv')) for i in folders)
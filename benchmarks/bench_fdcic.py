@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the crop inputs and :class:`FDCIC` of each crop.
+"""
+
+import pytest
+from BioSTEAMconnectors import CornInputs, SorghumInputs, SugarcaneInputs, FDCIC
+
+crop_inputs = (CornInputs, SorghumInputs, SugarcaneInputs)
+
+
+@pytest.fixture(params=crop_inputs, ids=lambda cls: cls.__name__)
+def inputs_cls(request):
+    return request.param
+
+
+@pytest.fixture
+def fdcic(inputs_cls):
+    return FDCIC(inputs_cls())
+
+
+def bench_inputs(benchmark, inputs_cls):
+    benchmark(inputs_cls)
+
+
+def bench_FDCIC_init(benchmark, inputs_cls):
+    inputs = inputs_cls()
+    benchmark(FDCIC, inputs)
+
+
+def bench_GHG_table(benchmark, fdcic):
+    table = benchmark(lambda: fdcic.GHG_table)
+    assert table.index[-1] == 'CI with SOC'
+
+
+def bench_CI(benchmark, fdcic):
+    CI = benchmark(lambda: fdcic.CI)
+    assert CI > 0
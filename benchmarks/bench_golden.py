@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the site-year pipeline (`run_total`):
+
+- The results of `inputs/SORG.csv` are compared with the golden results
+  `outputs/Complete_CI.csv` (every numeric column within `rtol`/`atol`,
+  other columns exactly), and the run must be within the wall-time
+  and peak-memory budgets (environment variables GOLDEN_TIME_BUDGET in s
+  and GOLDEN_MEMORY_BUDGET in MB).
+- The faster engines (batch, chunked, and incremental) are compared with
+  the reference property-based calculation (`update_results_reference`)
+  on randomized site-year tables of all crops.
+
+The golden results should only be updated (by running `run_total.py`)
+when a change of the results is intended.
+"""
+
+import os, tracemalloc, numpy as np, pandas as pd, pytest
+from conftest import make_site_years
+from BioSTEAMconnectors import outputs_path
+from BioSTEAMconnectors.run_total import (
+    CI_columns, crop_registry, key_columns, hash_rows, run,
+    update_results, update_results_incremental, update_results_reference,
+    )
+
+join = os.path.join
+
+golden_path = join(outputs_path, 'Complete_CI.csv')
+rtol = 1e-6
+atol = 1e-9
+time_budget = float(os.environ.get('GOLDEN_TIME_BUDGET', 2))
+memory_budget = float(os.environ.get('GOLDEN_MEMORY_BUDGET', 20))
+
+# Crops of the randomized tables, including one not in `crop_registry` (kept as zeros)
+crops = (*crop_registry, 'Soybean')
+seeds = (0, 1, 2)
+n_rows = 300
+
+
+def compare_outputs(outputs, expected):
+    '''Assert that the outputs are the same as the expected ones within the tolerance.'''
+    assert list(outputs.columns) == list(expected.columns), 'columns differ'
+    assert outputs.shape == expected.shape, f'{outputs.shape} rows/columns instead of {expected.shape}'
+    failed = []
+    for col in expected.columns:
+        actual, desired = outputs[col], expected[col]
+        if pd.api.types.is_numeric_dtype(desired):
+            actual, desired = actual.values.astype('float64'), desired.values.astype('float64')
+            close = np.isclose(actual, desired, rtol=rtol, atol=atol, equal_nan=True)
+            if not close.all():
+                errors = np.abs(actual-desired)[~close]
+                finite = np.isfinite(errors)
+                message = f'{col}: {(~close).sum()} rows'
+                if finite.any(): message += f', max. absolute error {errors[finite].max():.3g}'
+                if not finite.all(): message += f', {(~finite).sum()} missing values differ'
+                failed.append(message)
+        elif not (actual.astype(str).values == desired.astype(str).values).all():
+            failed.append(f'{col}: values differ')
+    assert not failed, 'outputs differ from the expected ones:\n' + '\n'.join(failed)
+
+
+def bench_golden_outputs(benchmark, tmp_path):
+    output_path = str(tmp_path/'Complete_CI.csv')
+    benchmark.pedantic(run, kwargs={'output_path': output_path, 'verbose': False},
+                       rounds=3, iterations=1)
+    compare_outputs(pd.read_csv(output_path, index_col=0),
+                    pd.read_csv(golden_path, index_col=0))
+    if benchmark.stats: # None if benchmarks are disabled
+        time = benchmark.stats.stats.min
+        assert time <= time_budget, f'{time:.3f} s over the budget of {time_budget} s'
+    tracemalloc.start()
+    try:
+        run(output_path=output_path, verbose=False)
+        peak = tracemalloc.get_traced_memory()[1]/1e6
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info['peak_MB'] = peak
+    assert peak <= memory_budget, f'{peak:.3f} MB over the budget of {memory_budget} MB'
+
+
+# %%
+
+# =============================================================================
+# Engines
+# =============================================================================
+
+def update_results_chunked(inputs, chunksize=64):
+    return pd.concat([update_results(inputs.iloc[i:i+chunksize])
+                      for i in range(0, inputs.shape[0], chunksize)])
+
+
+def update_results_cached(inputs):
+    # Half of the site-years have changed since the previous run
+    changed = inputs.copy()
+    changed.loc[1::2, 'net_GHG_gCO2e'] *= 2
+    previous = update_results(changed)
+    previous_hashes = changed.loc[:, key_columns].assign(hash=hash_rows(changed))
+    return update_results_incremental(inputs, previous, previous_hashes, verbose=False)
+
+
+engines = {
+    'batch': update_results,
+    'chunked': update_results_chunked,
+    'incremental': update_results_cached,
+    }
+
+
+@pytest.fixture(scope='module', params=seeds, ids=lambda seed: f'seed{seed}')
+def site_years(request):
+    df = make_site_years(n_rows, seed=request.param, crops=crops)
+    return df, update_results_reference(df)
+
+
+@pytest.mark.parametrize('engine', engines)
+def bench_engine(benchmark, site_years, engine):
+    inputs, expected = site_years
+    outputs = benchmark(engines[engine], inputs)
+    compare_outputs(outputs, expected)
+    assert (outputs.loc[inputs.Crop == 'Soybean', list(CI_columns)] == 0).all(axis=None)
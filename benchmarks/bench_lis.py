@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of reading DayCent .lis outputs of multi-century daily simulations.
+"""
+
+import numpy as np, pandas as pd, pytest
+from archived.DayCent._daycent import read_lis, update_col
+
+# Typical outvars.txt of the connector plus extra variables
+lis_columns = ['time', 'somtc', 'strmac(2)', 'volpac',
+               *(f'var{i}' for i in range(26))]
+
+
+def write_lis(path, years, columns=lis_columns):
+    rng = np.random.default_rng(0)
+    time = 1 + np.arange(years*365)/365
+    data = np.column_stack([time, rng.random((time.size, len(columns)-1))*1000])
+    with open(path, 'w') as file:
+        file.write(''.join(f'{i:>14}' for i in columns) + '\n\n')
+        np.savetxt(file, data, fmt='%14.4f', delimiter='')
+        file.write(''.join(f'{0:14.4f}' for i in columns) + '\n')
+    return path
+
+
+def read_lis_loadtxt(lis_path, head_skip, tail_skip):
+    '''Previous implementation using `np.loadtxt`, for comparison.'''
+    input_data = open(lis_path, 'r')
+    for i in range(head_skip):
+        if i== 0:
+            header = next(input_data).split()
+        else:
+            next(input_data)
+    data = np.loadtxt(input_data)[:-tail_skip]
+    df = pd.DataFrame(data, columns=header)
+    return update_col(df)
+
+
+@pytest.fixture(scope='module', params=[100, 300], ids=lambda years: f'{years}yr')
+def lis_path(request, tmp_path_factory):
+    path = tmp_path_factory.mktemp('lis') / f'daily_{request.param}.lis'
+    return str(write_lis(path, request.param))
+
+
+def bench_read_lis_loadtxt(benchmark, lis_path):
+    benchmark(read_lis_loadtxt, lis_path, 2, 1)
+
+
+def bench_read_lis(benchmark, lis_path):
+    df = benchmark(read_lis, lis_path, 2, 1)
+    assert df.shape[1] == len(lis_columns)
+
+
+def bench_read_lis_projected(benchmark, lis_path):
+    df = benchmark(read_lis, lis_path, 2, 1, columns=('somtc', 'strmac(2)', 'volpac'))
+    assert list(df.columns) == ['somtc', 'strmac2', 'volpac']
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of calculating the carbon intensities of site-year tables
+(`run_total.update_results`) of the shipped `inputs/SORG.csv` and
+synthetic tables of 10^5 and 10^6 rows (see `conftest.py`).
+"""
+
+import pytest
+from BioSTEAMconnectors.run_total import CI_columns, update_results
+
+sizes = ('SORG', 10**5, 10**6)
+
+
+@pytest.fixture(scope='module', params=sizes, ids=('SORG', '1e5rows', '1e6rows'))
+def site_years(request, site_years_factory):
+    return site_years_factory(request.param)
+
+
+def bench_update_results(benchmark, record_throughput, site_years):
+    n_rows = site_years.shape[0]
+    if n_rows >= 10**6: # a few rounds are enough for large tables
+        outputs = benchmark.pedantic(update_results, (site_years,), rounds=3, iterations=1)
+    else:
+        outputs = benchmark(update_results, site_years)
+    record_throughput(n_rows, 'rows')
+    assert outputs.shape == (n_rows, site_years.shape[1]+len(CI_columns))
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic site-year tables and DayCent workspaces for the benchmarks,
+DayCent outputs are generated by the stand-in (see `archived/DayCent/_stand_in.py`).
+
+Results of each run are saved in `.benchmarks` (with the commit) and can be
+compared with the last saved run by `--benchmark-compare`, benchmarks
+slower than `regression_thresholds` will fail unless other thresholds
+are given by `--benchmark-compare-fail`.
+"""
+
+import os, numpy as np, pandas as pd, pytest
+from BioSTEAMconnectors import inputs_path
+from BioSTEAMconnectors.run_total import load_inputs
+from archived.DayCent._stand_in import make_workspace
+
+join = os.path.join
+
+# Regressions (relative to the compared run) that fail the benchmarks, only the fastest
+# round is checked as it is the least affected by noise, runs should be compared
+# on the same (otherwise idle) machine
+regression_thresholds = ('min:25%',)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    option = config.option
+    if getattr(option, 'benchmark_compare', None) and not getattr(option, 'benchmark_compare_fail', None):
+        from pytest_benchmark.utils import parse_compare_fail
+        option.benchmark_compare_fail = [parse_compare_fail(i) for i in regression_thresholds]
+
+
+@pytest.fixture
+def record_throughput(benchmark):
+    '''Save the number of `name` (e.g., "sites" or "rows") and the throughput in the results.'''
+    def record(n, name):
+        benchmark.extra_info[name] = n
+        if benchmark.stats: # None if benchmarks are disabled
+            benchmark.extra_info[f'{name}_per_s'] = n / benchmark.stats.stats.mean
+    return record
+
+
+# %%
+
+# =============================================================================
+# Site-year tables
+# =============================================================================
+
+def make_site_years(n_rows, seed=0, crops=None):
+    '''
+    Synthetic site-year table of `n_rows` rows, rows of `inputs/SORG.csv`
+    are sampled and the numeric DayCent outputs are scaled by random factors
+    in [0.9, 1.1] so that the values are realistic but not repeated.
+    If `crops` are given, the crops of the rows are randomly chosen from them.
+    '''
+    sorg = load_inputs(join(inputs_path, 'SORG.csv'), verbose=False)
+    rng = np.random.default_rng(seed)
+    df = sorg.iloc[rng.integers(0, sorg.shape[0], n_rows)].reset_index(drop=True)
+    outputs = df.columns[df.columns.get_loc('AbovegroundBiomass_gCm'):]
+    df[outputs] = df[outputs].values * rng.uniform(0.9, 1.1, (n_rows, outputs.size))
+    if crops: df['Crop'] = pd.Categorical(rng.choice(crops, n_rows), categories=crops)
+    return df
+
+
+@pytest.fixture(scope='session')
+def site_years_factory():
+    '''Make (or reuse) a site-year table, "SORG" for the shipped `inputs/SORG.csv`.'''
+    tables = {}
+    def get_site_years(n_rows):
+        if n_rows not in tables:
+            tables[n_rows] = load_inputs(join(inputs_path, 'SORG.csv'), verbose=False) \
+                if n_rows == 'SORG' else make_site_years(n_rows)
+        return tables[n_rows]
+    return get_site_years
+
+
+# %%
+
+# =============================================================================
+# DayCent workspaces
+# =============================================================================
+
+@pytest.fixture(scope='session')
+def workspace_factory(tmp_path_factory):
+    '''Make (or reuse) a workspace with the number of sites and years.'''
+    workspaces = {}
+    def get_workspace(n_sites, years=20, outputs=True):
+        key = (n_sites, years, outputs)
+        if key not in workspaces:
+            path = str(tmp_path_factory.mktemp(f'workspace_{n_sites}'))
+            workspaces[key] = path, make_workspace(path, n_sites, years, outputs)
+        return workspaces[key]
+    return get_workspace
@@ -14,7 +14,7 @@ setup(
         "Guest Group Lab": "https://engineeringforsustainability.com/",
         "CABBI-DayCent": "https://github.com/cabbi-bio/DayCent-CABBI",
     },
-    install_requires=['biosteam', 'biorefineries', 'xlwings'],
+    install_requires=['biosteam', 'biorefineries', 'scipy', 'xlwings'],
     package_data=
         {'BioSTEAMconnectors': [
                     'DayCent/*',
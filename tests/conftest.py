@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures of the tests, DayCent runs use the stand-in of DayCent and list100
+(see `archived/DayCent/_stand_in.py`) with short simulations.
+"""
+
+import os, json, pytest
+from archived.DayCent import _daycent
+from archived.DayCent._stand_in import make_workspace, fail_marker
+
+years = 3
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    '''Run the stand-in instead of DayCent and list100.'''
+    monkeypatch.setattr(_daycent, 'dc_path', _daycent.stand_in_paths[0])
+    monkeypatch.setattr(_daycent, 'dclist_path', _daycent.stand_in_paths[1])
+    monkeypatch.setenv('STAND_IN_YEARS', str(years))
+    return monkeypatch
+
+
+@pytest.fixture
+def workspace(stand_in, tmp_path):
+    '''Workspace of 4 sites without outputs, runs are not cached.'''
+    stand_in.setattr(_daycent, 'cache_dir', '')
+    path = str(tmp_path/'workspace')
+    return path, make_workspace(path, 4, years, outputs=False)
+
+
+def set_failing(workspace_path, folder, schedule='', failing=True):
+    '''Make the schedule of the site fail (or not) in the stand-in.'''
+    path = os.path.join(workspace_path, folder, f'{schedule or folder}.sch')
+    content = f'Schedule of {schedule or folder}\n'
+    if failing: content += fail_marker.decode() + '\n'
+    with open(path, 'w') as file: file.write(content)
+
+
+def read_journal(path):
+    '''All records of the journal as (site, state) tuples in order.'''
+    with open(path) as file:
+        return [(i['site'], i['state']) for i in map(json.loads, file) if i]
+
+
+def is_running(pid):
+    '''Whether the process is running (POSIX-only).'''
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    return True
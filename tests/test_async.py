@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of running batches of sites with asyncio (`run_batch_async`) with the stand-in.
+"""
+
+import os, time, asyncio, threading, pytest, numpy as np
+from archived.DayCent import _async
+from archived.DayCent._daycent import SiteJournal
+from archived.DayCent._async import run_batch_async
+from conftest import is_running, read_journal, set_failing
+
+join = os.path.join
+
+
+def run_batch(*args, **kwargs):
+    return asyncio.run(run_batch_async(*args, report_interval=None, **kwargs))
+
+
+def get_states(journal_path):
+    '''Latest state of each site in the journal file.'''
+    return dict(read_journal(journal_path))
+
+
+def test_batch(workspace, monkeypatch):
+    path, folders = workspace
+    journal_path = join(path, 'journal.jsonl')
+
+    # Sites are only running once they are let through by the semaphore
+    started = set()
+    run_DayCent_async = _async.run_DayCent_async
+    async def check_running(sch_file, *args, **kwargs):
+        started.add(sch_file)
+        running = {i for i, state in get_states(journal_path).items() if state == 'running'}
+        assert running <= started
+        return await run_DayCent_async(sch_file, *args, **kwargs)
+    monkeypatch.setattr(_async, 'run_DayCent_async', check_running)
+
+    journal = run_batch(path, [{'folder': i} for i in folders], journal_path, max_concurrency=1)
+    assert started == set(folders)
+    assert journal.get_sites('done') == folders
+    assert all(os.path.isfile(join(path, i, f'{i}_CI.csv')) for i in folders)
+    assert not [i for i in os.listdir(path) if i.startswith('site0_')] # sandboxes removed
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='process check is POSIX-only')
+def test_hung_run(workspace, monkeypatch, tmp_path):
+    path, folders = workspace
+    pid_path = str(tmp_path/'DayCent.pid')
+    monkeypatch.setenv('STAND_IN_DELAY', '60')
+    monkeypatch.setenv('STAND_IN_PID_FILE', pid_path)
+    start = time.time()
+    journal = run_batch(path, [{'folder': 'site0'}], join(path, 'journal.jsonl'), timeout=1)
+    assert time.time() - start < 30
+    assert journal['site0'] == 'failed'
+    assert journal.records['site0']['error'].startswith('TimeoutError: DayCent did not finish within 1 s')
+    with open(pid_path) as file: pid = int(file.read())
+    assert not is_running(pid) # killed
+
+
+def test_retry_failed(workspace):
+    path, folders = workspace
+    journal_path = join(path, 'journal.jsonl')
+    set_failing(path, 'site1')
+    journal = run_batch(path, [{'folder': i} for i in folders[:2]], journal_path)
+    assert journal['site0'] == 'done'
+    assert journal['site1'] == 'failed'
+
+    # Retry site1 with the spin-up of site2 failing and that of site3 missing
+    set_failing(path, 'site1', failing=False)
+    set_failing(path, 'site2', 'spinup')
+    sites = [{'folder': 'site0'}, {'folder': 'site1'},
+             {'folder': 'site2', 'spinup': 'spinup'}, {'folder': 'site3', 'spinup': 'missing'}]
+    n_records = len(read_journal(journal_path))
+    journal = run_batch(path, sites, journal_path)
+    assert journal['site1'] == 'done'
+    assert journal.get_sites('failed') == ['site2', 'site3']
+    records = read_journal(journal_path)[n_records:]
+    assert ('site1', 'running') in records
+    assert ('site3', 'running') not in records # failed before running
+    assert all(i != 'site0' for i, state in records) # skipped
+    assert SiteJournal(journal_path).get_sites('done') == ['site0', 'site1']
+
+
+def test_excel_FDCIC(workspace, monkeypatch):
+    # The Excel FD-CIC is run one site at a time outside of the event loop
+    path, folders = workspace
+    monkeypatch.setattr(_async._daycent, 'use_excel_FDCIC', True)
+    threads, running, ticks = set(), [], []
+    def calc_in_excel(workspace_path, folder):
+        threads.add(threading.get_ident())
+        running.append(folder)
+        assert len(running) == 1
+        time.sleep(0.2)
+        running.remove(folder)
+    monkeypatch.setattr(_async, 'calc_site_CI', calc_in_excel)
+    async def run_with_ticker():
+        async def tick():
+            while True:
+                ticks.append(time.time())
+                await asyncio.sleep(0.05)
+        ticker = asyncio.get_running_loop().create_task(tick())
+        try: return await run_batch_async(path, [{'folder': i} for i in folders],
+                                          report_interval=None)
+        finally: ticker.cancel()
+    journal = asyncio.run(run_with_ticker())
+    assert journal.get_sites('done') == folders
+    assert len(threads) == 1 and threading.get_ident() not in threads
+    assert max(np.diff(ticks)) < 0.15 # the event loop is not blocked
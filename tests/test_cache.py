@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of staging files with links (`link_or_copy`).
+"""
+
+import os, pytest
+from archived.DayCent._cache import link_or_copy
+from archived.DayCent._daycent import run_batch
+
+join = os.path.join
+
+
+def fail(*args, **kwargs):
+    raise OSError('not supported')
+
+
+@pytest.fixture
+def src(tmp_path):
+    path = tmp_path/'src.txt'
+    path.write_text('contents')
+    return str(path)
+
+
+def test_hardlink(src, tmp_path):
+    dst = str(tmp_path/'dst.txt')
+    with open(dst, 'w') as file: file.write('old') # replaced
+    assert link_or_copy(src, dst) == 'hardlink'
+    assert os.path.samefile(src, dst)
+    # To a directory
+    os.mkdir(tmp_path/'dir')
+    assert link_or_copy(src, str(tmp_path/'dir')) == 'hardlink'
+    assert os.path.samefile(src, tmp_path/'dir'/'src.txt')
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='symbolic links need privilege on Windows')
+def test_symlink(src, tmp_path, monkeypatch):
+    monkeypatch.setattr(os, 'link', fail)
+    dst = str(tmp_path/'dst.txt')
+    assert link_or_copy(src, dst) == 'symlink'
+    assert os.path.islink(dst) and os.path.samefile(src, dst)
+
+
+@pytest.mark.parametrize('symlink', [True, False])
+def test_copy(src, tmp_path, monkeypatch, symlink):
+    # Copied if links are not supported (e.g., across file systems), or symbolic links not wanted
+    monkeypatch.setattr(os, 'link', fail)
+    if symlink: monkeypatch.setattr(os, 'symlink', fail)
+    dst = str(tmp_path/'dst.txt')
+    assert link_or_copy(src, dst, symlink=symlink) == 'copy'
+    assert not os.path.islink(dst) and not os.path.samefile(src, dst)
+    with open(dst) as file: assert file.read() == 'contents'
+
+
+def test_batch_without_links(workspace, monkeypatch):
+    path, folders = workspace
+    monkeypatch.setattr(os, 'link', fail)
+    monkeypatch.setattr(os, 'symlink', fail)
+    journal = run_batch(path, [{'folder': i} for i in folders[:2]], max_workers=2)
+    assert journal.get_sites('done') == folders[:2]
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of running DayCent and list100 (`run_DayCent`) and batches of sites
+(`run_batch`) with the stand-in.
+"""
+
+import os, time, pytest, pandas as pd
+from archived.DayCent import _daycent, _stand_in
+from archived.DayCent._daycent import SiteJournal, input_files, run_batch, run_DayCent
+from conftest import is_running, read_journal, set_failing, years
+
+join = os.path.join
+
+
+def write_schedule(path, name='site', content='Schedule\n'):
+    with open(join(path, f'{name}.sch'), 'w') as file: file.write(content)
+
+
+# %%
+
+# =============================================================================
+# DayCent and list100
+# =============================================================================
+
+def test_run_DayCent(stand_in, tmp_path):
+    write_schedule(tmp_path)
+    run_DayCent('site', '', cwd=str(tmp_path))
+    assert os.path.isfile(tmp_path/'site.lis')
+    assert _stand_in.read_bin(tmp_path/'site.bin')[1] == 3
+
+
+def test_failed_run(stand_in, tmp_path):
+    write_schedule(tmp_path, content=f'Schedule\n{_stand_in.fail_marker.decode()}\n')
+    with pytest.raises(RuntimeError, match='DayCent exited with code 1') as error:
+        run_DayCent('site', '', cwd=str(tmp_path))
+    # Last lines of the output of DayCent are in the error
+    assert 'Simulation of site failed' in str(error.value)
+    assert not os.path.isfile(tmp_path/'site.lis')
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='process check is POSIX-only')
+def test_hung_run(stand_in, tmp_path):
+    stand_in.setattr(_daycent, 'run_timeout', 1)
+    stand_in.setenv('STAND_IN_DELAY', '60')
+    stand_in.setenv('STAND_IN_PID_FILE', 'DayCent.pid')
+    write_schedule(tmp_path)
+    start = time.time()
+    with pytest.raises(TimeoutError, match='DayCent did not finish within 1 s'):
+        run_DayCent('site', '', cwd=str(tmp_path))
+    assert time.time() - start < 30
+    with open(tmp_path/'DayCent.pid') as file: pid = int(file.read())
+    assert not is_running(pid) # killed
+    assert not os.path.isfile(tmp_path/'site.bin')
+
+
+def test_list100_after_complete_bin(stand_in, tmp_path):
+    # The binary output is still being written for 1 s after DayCent exits
+    stand_in.setenv('STAND_IN_BIN_LAG', '1')
+    write_schedule(tmp_path)
+    run_DayCent('site', '', cwd=str(tmp_path))
+    assert os.path.isfile(tmp_path/'site.lis')
+    _stand_in.read_bin(tmp_path/'site.bin') # complete
+
+    # list100 fails if it does not wait for the binary output
+    stand_in.setattr(_daycent, 'wait_for_file', lambda *args, **kwargs: None)
+    with pytest.raises(RuntimeError, match='(?s)list100 exited with code 1.*site.bin is incomplete'):
+        run_DayCent('site', '', cwd=str(tmp_path))
+    time.sleep(1.5) # let the writer finish before the directory is removed
+
+
+# %%
+
+# =============================================================================
+# Batches
+# =============================================================================
+
+def test_retry_with_failed_spinup(workspace):
+    path, folders = workspace
+    journal_path = join(path, 'journal.jsonl')
+    set_failing(path, 'site1')
+    run_batch(path, [{'folder': i} for i in folders[:2]], journal_path, max_workers=1)
+    assert SiteJournal(journal_path)['site1'] == 'failed'
+
+    # Retry site1 with the spin-up of site2 failing and that of site3 missing
+    set_failing(path, 'site1', failing=False)
+    set_failing(path, 'site2', 'spinup')
+    sites = [{'folder': 'site0'}, {'folder': 'site1'},
+             {'folder': 'site2', 'spinup': 'spinup'}, {'folder': 'site3', 'spinup': 'missing'}]
+    n_records = len(read_journal(journal_path))
+    journal = run_batch(path, sites, journal_path, max_workers=1)
+    assert journal['site1'] == 'done'
+    assert journal.get_sites('failed') == ['site2', 'site3']
+    records = read_journal(journal_path)[n_records:]
+    assert ('site1', 'running') in records
+    assert ('site3', 'running') not in records # failed before running
+    assert all(i != 'site0' for i, state in records) # skipped
+    assert not os.path.isfile(join(path, 'site2', 'site2.bin'))
+
+
+def test_resume_batch(workspace, monkeypatch):
+    path, folders = workspace
+    sites = [{'folder': i} for i in folders]
+    journal_path = join(path, 'journal.jsonl')
+    set_failing(path, 'site1')
+
+    # Interrupt the batch (e.g., Ctrl+C) when site2 is being finished
+    calc_site_CI = _daycent.calc_site_CI
+    def interrupt(workspace_path, folder):
+        if folder == 'site2': raise KeyboardInterrupt
+        return calc_site_CI(workspace_path, folder)
+    monkeypatch.setattr(_daycent, 'calc_site_CI', interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        run_batch(path, sites, journal_path, max_workers=1)
+    monkeypatch.setattr(_daycent, 'calc_site_CI', calc_site_CI)
+    journal = SiteJournal(journal_path)
+    assert journal['site0'] == 'done'
+    assert journal['site1'] == 'failed'
+    assert journal['site2'] == journal['site3'] == 'pending' # interrupted
+
+    # Failed sites are not rerun if not asked to
+    set_failing(path, 'site1', failing=False)
+    n_records = len(read_journal(journal_path))
+    journal = run_batch(path, sites, journal_path, max_workers=1, retry_failed=False)
+    rerun = {i for i, state in read_journal(journal_path)[n_records:]}
+    assert rerun == {'site2', 'site3'}
+    assert journal.get_sites('failed') == ['site1']
+
+    # Done sites are skipped and failed sites are retried
+    n_records = len(read_journal(journal_path))
+    journal = run_batch(path, sites, journal_path, max_workers=1)
+    assert read_journal(journal_path)[n_records:] == [('site1', 'running'), ('site1', 'done')]
+    assert journal.get_sites('done') == folders
+    assert all(os.path.isfile(join(path, i, f'{i}_CI.csv')) for i in folders)
+
+
+def test_cached_batch(workspace, monkeypatch):
+    path, folders = workspace
+    monkeypatch.setattr(_daycent, 'cache_dir', '.cache')
+    caches = []
+    class RunCache(_daycent.RunCache):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            caches.append(self)
+    monkeypatch.setattr(_daycent, 'RunCache', RunCache)
+    def write_extension(content):
+        site_path = join(path, 'site1')
+        with open(join(site_path, 'ext.sch'), 'w') as file: file.write(content)
+        _stand_in.simulate('ext', 'ext', cwd=site_path, years=years)
+    write_extension('Extended schedule\n')
+    sites = [{'folder': i} for i in folders]
+    sites[1]['extension'] = 'ext'
+    def read_CI(folder):
+        return pd.read_csv(join(path, folder, f'{folder}_CI.csv'), index_col=0)
+
+    run_batch(path, sites, join(path, 'journal0.jsonl'), max_workers=1)
+    assert (caches[-1].hits, caches[-1].misses) == (0, 4)
+    CIs = [read_CI(i) for i in folders]
+
+    # Rerunning the same sites (in a new batch) only restores the outputs
+    journal = run_batch(path, sites, join(path, 'journal1.jsonl'), max_workers=1)
+    assert caches[-1].hit_rate == 1
+    assert journal.get_sites('done') == folders
+    for folder, CI in zip(folders, CIs): pd.testing.assert_frame_equal(read_CI(folder), CI)
+
+    # Changing the schedule, extension, or other inputs of a site reruns it
+    with open(join(path, 'site0', 'site0.sch'), 'a') as file: file.write('Changed\n')
+    write_extension('Changed extended schedule\n')
+    with open(join(path, 'site2', input_files[0]), 'a') as file: file.write('Changed\n')
+    run_batch(path, sites, join(path, 'journal2.jsonl'), max_workers=1)
+    assert (caches[-1].hits, caches[-1].misses) == (1, 3)
+
+
+# %%
+
+# =============================================================================
+# Outputs
+# =============================================================================
+
+def write_output(path, rows=((2000, 1.5, 10, 'a'), (2001, 2.5, 20, 'b'))):
+    with open(path, 'w') as file:
+        file.write('time, strmac(2), cgrain, note\n')
+        for row in rows: file.write(', '.join(map(str, row)) + '\n')
+
+
+def test_read_output(tmp_path):
+    path = str(tmp_path/'harvest.csv')
+    write_output(path)
+    df = _daycent.read_output(path, {'cgrain': 'float64', 'strmac2': 'float32'})
+    assert list(df.columns) == ['cgrain', 'strmac2']
+    assert df.dtypes.astype(str).tolist() == ['float64', 'float32']
+    assert df.cgrain.tolist() == [10., 20.]
+    with pytest.raises(ValueError, match=r'Columns fertappN, volpac not in .*harvest\.csv'):
+        _daycent.read_output(path, {'cgrain': 'float64', 'volpac': 'float64', 'fertappN': 'float64'})
+
+
+def test_read_output_of_stand_in(stand_in, tmp_path):
+    # Only the needed columns (`output_columns`) are read from the outputs with extra columns
+    stand_in.setenv('STAND_IN_EXTRA_COLUMNS', '20')
+    write_schedule(tmp_path)
+    _stand_in.simulate('site', 'site', cwd=str(tmp_path), years=years)
+    for file, columns in _daycent.output_columns.items():
+        df = _daycent.read_output(str(tmp_path/file))
+        assert df.dtypes.astype(str).to_dict() == columns
+
+
+def test_read_parsed(tmp_path, monkeypatch):
+    path = str(tmp_path/'harvest.csv')
+    write_output(path)
+    columns = {'time': 'float64', 'cgrain': 'float64'}
+    reads = []
+    def read(path):
+        reads.append(path)
+        return _daycent.read_output(path, columns)
+    def read_parsed():
+        return _daycent.read_parsed(path, columns, read)
+
+    expected = read_parsed()
+    assert len(reads) == 1 and os.path.isfile(f'{path}.npz')
+    pd.testing.assert_frame_equal(read_parsed(), expected)
+    assert len(reads) == 1 # parsed copy used
+
+    # Changed modification time (e.g., rerun with the same results)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns+10**9))
+    read_parsed()
+    assert len(reads) == 2
+    read_parsed()
+    assert len(reads) == 2
+
+    # Changed size, with the modification time kept
+    stat = os.stat(path)
+    write_output(path, [(2000, 1.5, 10, 'a'), (2001, 2.5, 200, 'b')])
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert read_parsed().cgrain.tolist() == [10., 200.]
+    assert len(reads) == 3
+
+    # Other columns, or a parsed copy that cannot be read
+    _daycent.read_parsed(path, {'cgrain': 'float32'}, lambda path: read(path).astype('float32'))
+    assert len(reads) == 4
+    with open(f'{path}.npz', 'wb') as file: file.write(b'incomplete')
+    assert read_parsed().cgrain.tolist() == [10., 200.]
+    assert len(reads) == 5
+
+    # No parsed copies if not saved
+    os.remove(f'{path}.npz')
+    monkeypatch.setattr(_daycent, 'save_parsed_outputs', False)
+    read_parsed()
+    assert len(reads) == 6 and not os.path.exists(f'{path}.npz')
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the native FD-CIC of the DayCent connector (`calc_FDCIC`).
+"""
+
+import os, numpy as np, pandas as pd, pytest
+from BioSTEAMconnectors import CornInputs
+from archived.DayCent import _daycent
+from archived.DayCent._daycent import run_batch
+from archived.DayCent._fdcic import DayCentFDCIC, calc_FDCIC, untracked_fertilizers
+from archived.DayCent._stand_in import make_workspace
+from conftest import years
+
+join = os.path.join
+
+
+@pytest.mark.parametrize('SOC', [-150., np.nan], ids=['SOC', 'missing SOC'])
+def test_calc_FDCIC(SOC):
+    outputs = pd.DataFrame({'CROP_type': ['corn'], 'Yield': [180.], 'SOC': [SOC],
+                            'N2O_FLUX': [2500.], 'N_leaching': [800.], 'CH4_FLUX': [-30.],
+                            'Ammonia': [120.], 'Lime': [np.nan]})
+    results = calc_FDCIC(outputs).iloc[0]
+
+    fdcic = DayCentFDCIC(CornInputs(), N2O_direct=2500., N2O_indirect=800., CH4_emission=-30.)
+    fdcic.crop_inputs.Yield_TS = 180.
+    fdcic.SOC_emission = SOC
+    for name in untracked_fertilizers: setattr(fdcic, name.format(fdcic.crop), 0)
+    fdcic.Ammonia_CornFarming_val = 120.
+    expected = fdcic.GHG_table
+    for item in (*DayCentFDCIC._GHG_items, 'CI without SOC', 'CI with SOC'):
+        np.testing.assert_allclose(results[item], expected[item], rtol=1e-12, err_msg=item)
+    assert np.isfinite(results['CI with SOC'])
+
+
+def test_sorghum_batch(stand_in, tmp_path):
+    stand_in.setattr(_daycent, 'cache_dir', '')
+    path = str(tmp_path/'workspace')
+    folders = make_workspace(path, 1, years, outputs=False, crops=('sorghum',))
+    journal = run_batch(path, [{'folder': i} for i in folders], max_workers=1)
+    assert journal.get_sites('done') == folders
+    CI = pd.read_csv(join(path, 'site0', 'site0_CI.csv'), index_col=0)
+    assert (CI.CROP_type == 'sorghum').all()
+    assert CI.Yield.notna().all()
+    assert np.isfinite(CI['CI with SOC']).all()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the instrumentation of the properties of `FDCIC` (`PropertyProfile` and `DependencyTrace`).
+"""
+
+import json, pytest
+from BioSTEAMconnectors import CornInputs, FDCIC
+
+
+@pytest.fixture(scope='module')
+def trace():
+    fdcic = FDCIC(CornInputs())
+    with fdcic.trace() as trace: fdcic.GHG_table
+    assert type(fdcic) is FDCIC # restored
+    return trace
+
+
+def test_profile():
+    fdcic = FDCIC(CornInputs())
+    with fdcic.profile() as profile: fdcic.GHG_table
+    table = profile.table
+    assert table.loc['CF_Ammonia_Intermediate', 'calls'] > 1
+    assert (table.cumulative_time >= table.self_time).all()
+
+
+def test_yield_as_variable(trace):
+    # `Yield_TS` is read from `crop_inputs`, but it is the main input of the yield-based results
+    assert 'Yield_TS' not in trace.properties
+    assert 'Yield_TS' in trace.get_variables('N2O_Fert_and_Res_GHG')
+    assert 'N2O_Fert_and_Res_GHG' in trace.get_affected(['Yield_TS'])
+    nodes = {i['name']: i for i in json.loads(trace.to_json())['nodes']}
+    assert nodes['Yield_TS']['kind'] == 'input'
+    assert nodes['Yield_TS']['value'] == CornInputs().Yield_TS
+    assert nodes['N2O_Fert_and_Res_GHG']['kind'] == 'property'
+
+
+def test_dependencies(trace):
+    dependencies = trace.dependencies
+    assert 'Yield_TS' not in dependencies
+    assert 'Cornfarming_biomass_N2O_factor' in dependencies['N2O_Fert_and_Res_GHG']
+    assert not set(dependencies['N2O_Fert_and_Res_GHG']) & trace.properties
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the site-year pipeline (`BioSTEAMconnectors/run_total.py`)
+with the shipped `inputs/SORG.csv`.
+"""
+
+import os, numpy as np, pandas as pd, pytest
+from BioSTEAMconnectors import CISummary, MemoryProfile, inputs_path
+from BioSTEAMconnectors.run_total import (
+    CI_columns, categorical_columns, crop_registry, key_columns,
+    compact_dtypes, hash_rows, load_inputs, run,
+    summary_keys, update_results, update_results_incremental, weight_column,
+    )
+
+join = os.path.join
+SORG_path = join(inputs_path, 'SORG.csv')
+
+
+@pytest.fixture(scope='module')
+def SORG():
+    return load_inputs(SORG_path, verbose=False)
+
+
+# %%
+
+# =============================================================================
+# Dtypes
+# =============================================================================
+
+def test_compact_dtypes():
+    raw = pd.read_csv(SORG_path, index_col=0).reset_index(drop=True)
+    compact = compact_dtypes(raw)
+    assert all(compact[i].dtype == 'category' for i in categorical_columns)
+    assert (compact.select_dtypes('number').dtypes == raw.select_dtypes('number').dtypes).all()
+    pd.testing.assert_frame_equal(compact.astype(raw.dtypes.to_dict()), raw)
+    assert raw.Crop.dtype == object # not changed
+
+    compact32 = compact_dtypes(raw, float32=True)
+    assert not compact32.select_dtypes('float64').shape[1]
+    floats = raw.select_dtypes('float64').columns
+    np.testing.assert_allclose(compact32[floats], raw[floats], rtol=1e-7)
+
+
+def test_float32_outputs(SORG):
+    outputs = update_results(SORG)
+    assert all(outputs[i].dtype == 'float64' for i in CI_columns)
+    outputs32 = update_results(compact_dtypes(SORG, float32=True))
+    assert all(outputs32[i].dtype == 'float32' for i in CI_columns)
+    # Screening precision
+    for i in CI_columns:
+        np.testing.assert_allclose(outputs32[i], outputs[i], rtol=1e-4, atol=1e-3)
+
+
+# %%
+
+# =============================================================================
+# Crops
+# =============================================================================
+
+def test_unregistered_crops(SORG):
+    assert 'Soybean' not in crop_registry
+    inputs = SORG.copy()
+    inputs['Crop'] = inputs.Crop.cat.add_categories(['Wheat'])
+    inputs.loc[:9, 'Crop'] = 'Wheat'
+    outputs = update_results(inputs)
+    unregistered = ~inputs.Crop.isin(crop_registry).values
+    assert unregistered.sum() > 10
+    assert (outputs.loc[unregistered, list(CI_columns)] == 0).all(axis=None)
+    registered = outputs.loc[~unregistered, list(CI_columns)]
+    assert (registered != 0).any(axis=None)
+    # Results of a crop do not depend on the other crops in the table
+    pd.testing.assert_frame_equal(registered, update_results(inputs[~unregistered])[list(CI_columns)])
+
+
+def test_registered_crops(SORG):
+    # Each crop is calculated with its own conversion
+    inputs = SORG[SORG.Crop == 'Sorghum'].reset_index(drop=True)
+    for crop in crop_registry:
+        df = inputs.assign(Crop=pd.Categorical([crop]*inputs.shape[0]))
+        results = crop_registry[crop].get_results(df)
+        outputs = update_results(df)
+        for col, values in zip(CI_columns, results):
+            np.testing.assert_array_equal(outputs[col].values, values)
+
+
+# %%
+
+# =============================================================================
+# Incremental runs
+# =============================================================================
+
+def get_previous(inputs):
+    return update_results(inputs), inputs.loc[:, key_columns].assign(hash=hash_rows(inputs))
+
+
+def test_hash_rows(SORG):
+    hashes = hash_rows(SORG)
+    assert hashes.dtype == np.uint64
+    changed = SORG.copy()
+    changed.loc[3, 'net_GHG_gCO2e'] += 1
+    assert (hash_rows(changed) != hashes).tolist() == [i == 3 for i in range(SORG.shape[0])]
+
+
+def test_incremental(SORG, capsys):
+    previous, previous_hashes = get_previous(SORG)
+    inputs = SORG.copy()
+    inputs.loc[[1, 10], 'net_GHG_gCO2e'] += 1
+    outputs = update_results_incremental(inputs, previous, previous_hashes)
+    assert '0 new, 2 changed, 0 removed, 1870 reused' in capsys.readouterr().out
+    pd.testing.assert_frame_equal(outputs, update_results(inputs))
+
+
+def test_incremental_reordered(SORG, capsys):
+    # Repeated site-years are reused when the table is reordered
+    assert SORG.duplicated(list(key_columns)).any()
+    previous, previous_hashes = get_previous(SORG)
+    rng = np.random.default_rng(0)
+    inputs = SORG.iloc[rng.permutation(SORG.shape[0])].reset_index(drop=True)
+    inputs.loc[5, 'net_GHG_gCO2e'] += 1
+    outputs = update_results_incremental(inputs, previous, previous_hashes)
+    assert '0 new, 1 changed, 0 removed, 1871 reused' in capsys.readouterr().out
+    pd.testing.assert_frame_equal(outputs, update_results(inputs))
+
+
+def test_incremental_new_and_removed(SORG, capsys):
+    previous, previous_hashes = get_previous(SORG.iloc[:1000])
+    inputs = SORG.iloc[500:].reset_index(drop=True)
+    outputs = update_results_incremental(inputs, previous, previous_hashes)
+    out = capsys.readouterr().out
+    reused = int(out.split(' reused')[0].split()[-1])
+    assert reused == 500
+    pd.testing.assert_frame_equal(outputs, update_results(inputs))
+
+
+def test_run_incremental(SORG, tmp_path, capsys):
+    # Hashes are saved next to the results and read back as uint64
+    data_path, output_path = str(tmp_path/'SORG.csv'), str(tmp_path/'CI.csv')
+    SORG.to_csv(data_path)
+    run(data_path, output_path, summarize=False, verbose=False)
+    assert pd.read_csv(tmp_path/'CI_hashes.csv').hash.dtype == np.uint64
+    SORG.iloc[::-1].reset_index(drop=True).to_csv(data_path)
+    capsys.readouterr()
+    outputs, _ = run(data_path, output_path, incremental=True, summarize=False)
+    assert '0 new, 0 changed, 0 removed, 1872 reused' in capsys.readouterr().out
+    expected = update_results(SORG.iloc[::-1].reset_index(drop=True))
+    for col in CI_columns:
+        np.testing.assert_allclose(outputs[col], expected[col], rtol=1e-12)
+
+
+# %%
+
+# =============================================================================
+# Summary
+# =============================================================================
+
+def make_summary():
+    return CISummary(summary_keys, weight_column, CI_columns, crop_registry)
+
+
+def test_summary_chunks(SORG):
+    outputs = update_results(SORG)
+    summary = make_summary()
+    summary.add(outputs)
+    expected = summary.table
+    assert set(expected.index.get_level_values('Crop')) <= set(crop_registry)
+
+    # Chunks added to one summary or to separate summaries that are merged
+    chunked, merged = make_summary(), make_summary()
+    for i in range(0, outputs.shape[0], 500):
+        chunk = outputs.iloc[i:i+500]
+        chunked.add(chunk)
+        other = make_summary()
+        other.add(chunk)
+        merged.merge(other)
+    for summary in (chunked, merged):
+        pd.testing.assert_frame_equal(summary.table.sort_index(), expected.sort_index(),
+                                      check_exact=False, rtol=1e-12)
+
+
+@pytest.mark.parametrize('relative_accuracy', [0.01, 0.05])
+def test_summary_percentiles(relative_accuracy):
+    rng = np.random.default_rng(0)
+    N = 5000
+    values = rng.lognormal(10, 1, N) * rng.choice([-1, 1], N, p=[0.2, 0.8])
+    weights = rng.uniform(0, 100, N)
+    outputs = pd.DataFrame({'Group': rng.choice(['a', 'b'], N), 'Crop': 'Sorghum',
+                            'Weight': weights, 'x': values})
+    summary = CISummary(['Group'], 'Weight', ['x'], relative_accuracy=relative_accuracy)
+    summary.add(outputs)
+    table = summary.table
+    for group, df in outputs.groupby('Group'):
+        row = table.loc[(group, 'x')]
+        df = df.sort_values('x')
+        fraction = df.Weight.cumsum().values/df.Weight.sum()
+        assert row['count'] == df.shape[0]
+        assert row['mean'] == pytest.approx(np.average(df.x, weights=df.Weight), rel=1e-12)
+        assert (row['min'], row['max']) == (df.x.min(), df.x.max())
+        for p in summary.percentiles:
+            exact = df.x.values[np.searchsorted(fraction, p/100)]
+            assert abs(row[f'p{p:g}'] - exact) <= relative_accuracy*abs(exact)
+
+
+def test_memory_profile(SORG):
+    with MemoryProfile() as profile:
+        with profile.stage('calculate'): outputs = update_results(SORG)
+        with profile.stage('summarize'): make_summary().add(outputs)
+    assert list(profile.table.index) == ['calculate', 'summarize']
+    assert (profile.table.peak_MB > 0).all()
+    lines = profile.lines
+    assert list(lines.stage.unique()) == ['calculate', 'summarize']
+    # Allocations are attributed to the lines of the pipeline
+    assert lines.caller.str.contains('run_total.py').any()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the nearest-site lookup of carbon intensities (`SiteIndex`).
+"""
+
+import numpy as np, pandas as pd, pytest
+from BioSTEAMconnectors import SiteIndex
+
+column = 'total g CO2eq/ton'
+weight = 'AbovegroundBiomass_gCm'
+
+# Sites (lon, lat) and the carbon intensities and yields of their two site-years
+sites = {
+    (-90., 40.): ([100., 200.], [1., 3.]),
+    (-89., 40.): ([300., 300.], [2., 2.]),
+    (-90., 41.): ([50., 150.], [1., 1.]),
+    (-80., 35.): ([1000., 1000.], [1., 1.]),
+    }
+
+
+def haversine(lon0, lat0, lon1, lat1):
+    lon0, lat0, lon1, lat1 = map(np.radians, (lon0, lat0, lon1, lat1))
+    a = np.sin((lat1-lat0)/2)**2 + np.cos(lat0)*np.cos(lat1)*np.sin((lon1-lon0)/2)**2
+    return 2*SiteIndex.earth_radius*np.arcsin(np.sqrt(a))
+
+
+@pytest.fixture
+def outputs():
+    rows = [{'Lon': lon, 'Lat': lat, 'Year': 2020+i, 'Crop': 'Sorghum',
+             'SorgType': 'SweetSorghum', column: CI, weight: w}
+            for (lon, lat), (CIs, weights) in sites.items()
+            for i, (CI, w) in enumerate(zip(CIs, weights))]
+    # Site-years without carbon intensities are excluded
+    rows.append({**rows[0], 'Year': 2030, column: np.nan})
+    return pd.DataFrame(rows)
+
+
+def test_sites(outputs):
+    index = SiteIndex(outputs)
+    assert index.sites[column].tolist() == [175., 300., 100., 1000.] # yield-weighted
+    index = SiteIndex(outputs, weight=None)
+    assert index.sites[column].tolist() == [150., 300., 100., 1000.]
+
+
+def test_query(outputs):
+    index = SiteIndex(outputs)
+    distances, indices = index.query(-89.9, 40.1, k=2)
+    assert indices.tolist() == [0, 1] # 1 degree of longitude is shorter than that of latitude
+    np.testing.assert_allclose(distances, [haversine(-89.9, 40.1, -90., 40.),
+                                           haversine(-89.9, 40.1, -89., 40.)], rtol=1e-9)
+    # Longitudes of 0 to 360
+    distances, indices = index.query(270., 40.)
+    assert indices == 0 and distances == pytest.approx(0, abs=1e-6)
+    assert index.get_CI(270., 40.) == pytest.approx(175.)
+    # Sites out of the radius are missing
+    distances, indices = index.query(-90., 40., k=3, radius=100)
+    assert indices.tolist() == [0, 1, 4]
+    assert np.isinf(distances[2])
+    assert sorted(index.query_radius(-90., 40., 120)) == [0, 1, 2]
+    assert [sorted(i) for i in index.query_radius([-90., -80.], [40., 35.], 10)] == [[0], [3]]
+
+
+def test_get_CI(outputs):
+    index = SiteIndex(outputs)
+    lon, lat = -89.6, 40.3
+    distances = haversine(lon, lat, index.sites.Lon.values, index.sites.Lat.values)
+    nearest = np.argsort(distances)[:3]
+    weights = 1/distances[nearest]**2
+    expected = (weights*index.sites[column].values[nearest]).sum()/weights.sum()
+    assert index.get_CI(lon, lat, k=3) == pytest.approx(expected, rel=1e-9)
+    assert index.get_CI(-80., 35.) == 1000. # at a site
+    assert np.isnan(index.get_CI(-70., 30., radius=100)) # no sites within the radius
+    # Only the sites within the radius are used (site 0 and 1 are as far from the point)
+    assert index.get_CI(-89.5, 40., k=3, radius=100) == pytest.approx((175.+300.)/2, rel=1e-6)
+    CIs = index.get_CI(np.array([lon, -80.]), np.array([lat, 35.]), k=3)
+    assert CIs.shape == (2,)
+    assert CIs[0] == pytest.approx(expected, rel=1e-9) and CIs[1] == 1000.
+    assert index.get_CI(np.array([-80.]), 35.).shape == (1,)
+
+
+def test_mixed_feedstocks(outputs):
+    outputs.loc[1, 'SorgType'] = 'GrainSorghum'
+    with pytest.raises(ValueError, match='1 site\\(s\\) have site-years of more than one feedstock'):
+        SiteIndex(outputs)
+    SiteIndex(outputs, by=()) # not checked
+    SiteIndex(outputs[outputs.SorgType == 'SweetSorghum'])
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of storing the user_data tables as CSV with a schema
+(`write_table`, `read_table`, and `read_user_inputs`).
+"""
+
+import os, numpy as np, pandas as pd
+from archived.DayCent._user_data import (
+    inputs_csv, get_schema_path, read_schema, read_table, read_user_inputs, write_table,
+    )
+from archived.DayCent._stand_in import write_user_data
+
+join = os.path.join
+
+
+def make_table():
+    df = pd.DataFrame({
+        'Site': ['a', 'b', 'c'],
+        'Year': np.array([2000, 2001, 2002], dtype='int64'),
+        'Yield': [180.5, np.nan, 175.25],
+        'SOC': np.array([-1.5, 2., 0.], dtype='float32'),
+        'Irrigated': [True, False, True],
+        'Crop': pd.Categorical(['corn', 'soybean', 'corn']),
+        'Notes': pd.Series([np.nan]*3, dtype=object),
+        })
+    df.columns = pd.MultiIndex.from_tuples([(i, name, unit) for i, (name, unit) in enumerate(
+        zip(df.columns, ['-', '-', '[bu/ac]', '[kg C/ha]', '-', '-', '-']))])
+    return df
+
+
+def test_table_round_trip(tmp_path):
+    df = make_table()
+    path = str(tmp_path/'table.csv')
+    write_table(df, path, source='test')
+    assert read_schema(path)['source'] == 'test'
+    assert not [i for i in os.listdir(tmp_path) if i.endswith('.tmp')]
+    pd.testing.assert_frame_equal(read_table(path), df)
+
+    flat = read_table(path, multiindex=False)
+    assert list(flat.columns) == list(df.columns.get_level_values(1))
+    assert flat.dtypes.astype(str).tolist() == ['object', 'int64', 'float64', 'float32', 'bool', 'category', 'object']
+    subset = read_table(path, multiindex=False, usecols=['Year', 'SOC'])
+    pd.testing.assert_frame_equal(subset, flat[['Year', 'SOC']])
+
+    # Tables with single-level columns
+    write_table(flat, path)
+    pd.testing.assert_frame_equal(read_table(path, multiindex=False), flat)
+    assert read_table(path).columns[2] == (2, 'Yield', '')
+
+
+def test_user_inputs(tmp_path):
+    folder_path = str(tmp_path)
+    write_user_data(join(folder_path, 'user_data.xlsx'), 3)
+    csv_path = join(folder_path, inputs_csv)
+
+    # Not saved when only reading the folder
+    inputs = read_user_inputs(folder_path, save=False)
+    assert not os.path.exists(csv_path)
+
+    # Saved the first time and used until user_data.xlsx is changed
+    pd.testing.assert_frame_equal(read_user_inputs(folder_path), inputs)
+    assert os.path.isfile(csv_path) and os.path.isfile(get_schema_path(csv_path))
+    mtime = os.stat(csv_path).st_mtime_ns
+    pd.testing.assert_frame_equal(read_user_inputs(folder_path), inputs)
+    assert os.stat(csv_path).st_mtime_ns == mtime
+    write_user_data(join(folder_path, 'user_data.xlsx'), 4)
+    assert read_user_inputs(folder_path).shape[0] == 4
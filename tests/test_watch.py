@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the watch mode (`SiteWatcher` and `ResultsStore`) with the stand-in.
+"""
+
+import os, numpy as np
+from archived.DayCent import _stand_in
+from archived.DayCent._watch import ResultsStore, SiteWatcher
+from archived.DayCent._stand_in import make_workspace
+from conftest import years
+
+join = os.path.join
+
+
+def list_files(path, folders):
+    return {(i, j) for i in folders for j in os.listdir(join(path, i))}
+
+
+def test_watch(stand_in, tmp_path):
+    path = str(tmp_path/'workspace')
+    folders = make_workspace(path, 2, years)
+    # list100 has not been run for site1
+    os.remove(join(path, 'site1', 'site1.lis'))
+    files = list_files(path, folders)
+    store_path = str(tmp_path/'CI_results.csv')
+    watcher = SiteWatcher(path, folders, store_path)
+
+    assert watcher.poll() == [] # outputs may still be changing
+    assert watcher.poll() == ['site0']
+    assert watcher.get_pending() == ['site1']
+    _stand_in.list100('site1', 'site1', cwd=join(path, 'site1'))
+    files.add(('site1', 'site1.lis'))
+    assert watcher.poll() == []
+    assert watcher.poll() == ['site1']
+    assert watcher.poll() == [] # not processed again
+    assert not watcher.get_pending()
+
+    df = watcher.store.read()
+    assert list(df.site) == ['site0']*years + ['site1']*years
+    assert list(df.year) == list(range(_stand_in.start_year, _stand_in.start_year+years))*2
+    assert list(df.CROP_type[:2]) == ['corn', 'soybean']
+    assert np.isfinite(df['CI with SOC'][df.CROP_type == 'corn']).all()
+    # Only the parsed copies of the outputs are written to the site folders
+    assert all(j.endswith('.npz') for i, j in list_files(path, folders) - files)
+
+    # Resume from a store with an interrupted append of site1
+    with open(store_path, 'rb+') as file: file.truncate(os.path.getsize(store_path) - 20)
+    store = ResultsStore(store_path)
+    assert store.sources == {'site0': watcher.store.sources['site0']}
+    assert list(store.read().site) == ['site0']*years
+    watcher = SiteWatcher(path, folders, store_path)
+    assert watcher.get_pending() == ['site1']
+    watcher.poll()
+    assert watcher.poll() == ['site1']
+    df = watcher.store.read()
+    assert list(df.site) == ['site0']*years + ['site1']*years
+    assert df.year.notna().all()